@@ -1,34 +1,26 @@
 # app/api/routes.py
-import random, asyncio
-from fastapi import APIRouter, HTTPException, status
+import asyncio, json
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Response, WebSocket, WebSocketDisconnect, status
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.openapi.utils import get_openapi
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
 
-from app.core.deps import firebase_enabled, gemini_enabled
+from app.core import metrics
+from app.core import deps
+from app.core.registry import resources
 from app.core.settings import settings
-from app.core.constants import TOPICS, ARGUMENT_STYLES
-from app.models.schemas import MessageRequest, ChatResponse, ErrorResponse
-from app.services.nlp import extract_topic_from_seed, is_on_topic, ground_reply
-from app.services.llm import generate_gemini_response_async
-
-# seleccionar storage
-if settings.redis_url:
-    from app.storage.redis_store import save_conversation, load_conversation, save_meta, load_meta
-elif firebase_enabled:
-    from app.storage.firestore import save_conversation, load_conversation
-    def save_meta(cid: str, topic: str, stance: str):  # no-op
-        pass
-    def load_meta(cid: str) -> dict:
-        return {"topic": "", "stance": ""}
-else:
-    from app.storage.memory import save_conversation, load_conversation
-    # no-op meta en memoria (para no romper la firma)
-    def save_meta(cid: str, topic: str, stance: str):
-        pass
-    def load_meta(cid: str) -> dict:
-        return {"topic": "", "stance": ""}
-        
+from app.models.schemas import (
+    MessageRequest, ChatResponse, ErrorResponse, BatchChatRequest, BatchChatResponse,
+)
+from app.services.llm import generate_gemini_response_async, stream_gemini_response_async, LLMOverloaded
+from app.services.turns import (
+    open_turn, finish_turn, open_turns, finish_turns, new_conversation_id, DebateSession,
+)
+
+from app.storage import backend
+
 router = APIRouter()
 
 @router.get("/", tags=["meta"], summary="Root")
@@ -36,14 +28,35 @@ def root():
     return {
         "name": "Kopi Debate API",
         "version": "1.2.0",
-        "ready": True,
-        "gemini": gemini_enabled,
-        "storage": "redis" if settings.redis_url else ("firestore" if firebase_enabled else "memory"),
+        "ready": resources.ready,
+        "gemini": deps.gemini() is not None,
+        "storage": backend.name,
     }
 
-@router.get("/healthz", tags=["meta"], summary="Health")
-def health():
-    return {"status": "ok"}
+@router.get(
+    "/healthz",
+    tags=["meta"],
+    summary="Health",
+    responses={503: {"description": "Live but not ready (`?ready=1`)."}},
+)
+def health(ready: bool = False):
+    """
+    Liveness by default (always 200 while the process answers). With
+    `?ready=1` it is a readiness probe: 503 until startup has created the
+    storage backend and LLM clients and warmed their connections.
+    """
+    body = {"status": "ok", "live": True, "ready": resources.ready, "resources": resources.status()}
+    if ready and not resources.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={**body, "status": "starting"})
+    return body
+
+@router.get("/metrics", tags=["meta"], summary="Prometheus metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """
+    Counters from the LLM, caches and storage layers; per-stage latency
+    histograms too when `METRICS_ENABLED=1`.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @router.post(
     "/chat",
@@ -53,53 +66,255 @@ def health():
         408: {"model": ErrorResponse, "description": "Generation timeout (≥30s)."},
         422: {"description": "Payload validation error."},
         500: {"model": ErrorResponse, "description": "Internal server error."},
+        503: {"model": ErrorResponse, "description": "LLM saturated; retry after `Retry-After` seconds."},
     },
 )
 async def chat(req: MessageRequest):
-    cid = req.conversation_id or f"conv_{random.randint(1000, 9999)}"
-    history = load_conversation(cid)
-
-    if not history:
-        from app.services.nlp import parse_topic_and_stance
-        topic, stance = parse_topic_and_stance(req.message)
-        seed = f"I will prove that {stance}!"
-        history.append({"role": "bot", "message": seed})
-        save_meta(cid, topic, stance)
-        claim = stance
-    else:
-        meta = load_meta(cid)
-        stance = (meta.get("stance") or "").strip()
-        if not stance:
-            stance = extract_topic_from_seed(history[0]["message"])
-            topic = stance
-        else:
-            topic = meta.get("topic", stance)
-        claim = stance
-
-    history.append({"role": "user", "message": req.message})
-
-    if not is_on_topic(req.message, claim):
-        history.append({"role": "bot", "message": ground_reply(claim)})
-
-    style = random.choice(ARGUMENT_STYLES)
+    timings = metrics.begin()
+    cid = req.conversation_id or new_conversation_id()
+    turn = await open_turn(cid, req.message)
+    budget = _reply_budget()
+    deadline = asyncio.get_running_loop().time() + budget
 
     try:
-        bot_msg = await asyncio.wait_for(
-            generate_gemini_response_async(claim, req.message, style),
-            timeout=max(1, settings.max_reply_secs - 2),
-        )
+        with metrics.stage("llm"):
+            bot_msg = await asyncio.wait_for(
+                generate_gemini_response_async(turn.claim, req.message, turn.style,
+                                               deadline=deadline, context=turn.context),
+                timeout=budget,
+            )
     except asyncio.TimeoutError:
+        metrics.http["timeouts"] += 1
         raise HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT,
                             detail="Response time exceeded 30 seconds")
+    except LLMOverloaded as e:
+        raise _overloaded(e)
 
-    history.append({"role": "bot", "message": bot_msg})
-    save_conversation(cid, history)
+    window = await finish_turn(turn, bot_msg)
 
-    payload = {"conversation_id": cid, "message": history[-5:]}
+    payload = {"conversation_id": cid, "message": window}
     resp = JSONResponse(payload)
+    _tag(resp, cid, timings)
+    return resp
+
+
+@router.post(
+    "/chat/batch",
+    tags=["chat"],
+    summary="Chat (batch of turns)",
+    response_model=BatchChatResponse,
+    responses={422: {"description": "Payload validation error."}},
+)
+async def chat_batch(req: BatchChatRequest, response: Response):
+    """
+    Plays many turns (each on a different conversation) in one request.
+    Storage is read and written once for the whole batch and generations run
+    concurrently under the shared LLM limit. Each item reports its own status.
+    """
+    timings = metrics.begin()
+    results: list = [None] * len(req.items)
+    pending = []  # (índice, cid, mensaje)
+    seen = set()
+    for i, item in enumerate(req.items):
+        cid = item.conversation_id or new_conversation_id()
+        if cid in seen:
+            results[i] = {"conversation_id": cid, "status": status.HTTP_409_CONFLICT,
+                          "error": "Duplicate conversation_id in batch"}
+            continue
+        seen.add(cid)
+        pending.append((i, cid, item.message))
+
+    turns = await open_turns([(cid, message) for _, cid, message in pending])
+    budget = _reply_budget()
+    deadline = asyncio.get_running_loop().time() + budget
+
+    async def _reply(turn, message):
+        return await asyncio.wait_for(
+            generate_gemini_response_async(turn.claim, message, turn.style,
+                                           deadline=deadline, context=turn.context),
+            timeout=budget,
+        )
+
+    with metrics.stage("llm"):
+        replies = await asyncio.gather(*[_reply(t, m) for t, (_, _, m) in zip(turns, pending)],
+                                       return_exceptions=True)
+
+    ok = []
+    for turn, (i, cid, _), reply in zip(turns, pending, replies):
+        if isinstance(reply, asyncio.TimeoutError):
+            metrics.http["timeouts"] += 1
+            results[i] = {"conversation_id": cid, "status": status.HTTP_408_REQUEST_TIMEOUT,
+                          "error": "Response time exceeded 30 seconds"}
+        elif isinstance(reply, LLMOverloaded):
+            metrics.http["overloaded"] += 1
+            results[i] = {"conversation_id": cid, "status": status.HTTP_503_SERVICE_UNAVAILABLE,
+                          "error": "Too many debates in progress, try again shortly"}
+        elif isinstance(reply, BaseException):
+            results[i] = {"conversation_id": cid, "status": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                          "error": "Internal server error"}
+        else:
+            ok.append((i, turn, reply))
+
+    if ok:
+        windows = await finish_turns([t for _, t, _ in ok], [r for _, _, r in ok])
+        for (i, turn, _), window in zip(ok, windows):
+            results[i] = {"conversation_id": turn.cid, "status": status.HTTP_200_OK, "message": window}
+
+    timing = metrics.server_timing(timings)
+    if timing:
+        response.headers["Server-Timing"] = timing
+    return {"results": results}
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post(
+    "/chat/stream",
+    tags=["chat"],
+    summary="Chat (Server-Sent Events)",
+    responses={
+        200: {"content": {"text/event-stream": {}},
+              "description": "Events: `start` (turn so far), `chunk` (reply text), `done` (last 5 messages) or `error`."},
+        422: {"description": "Payload validation error."},
+        503: {"model": ErrorResponse, "description": "LLM saturated; retry after `Retry-After` seconds."},
+    },
+)
+async def chat_stream(req: MessageRequest):
+    timings = metrics.begin()  # el Server-Timing cubre hasta el inicio del stream
+    cid = req.conversation_id or new_conversation_id()
+    turn = await open_turn(cid, req.message)
+    deadline = asyncio.get_running_loop().time() + _reply_budget()
+
+    try:
+        stream = await stream_gemini_response_async(turn.claim, req.message, turn.style, context=turn.context)
+    except LLMOverloaded as e:
+        raise _overloaded(e)
+
+    async def events():
+        # el slot del LLM se libera aunque el cliente corte antes de los chunks
+        try:
+            yield _sse("start", {"conversation_id": cid, "message": turn.preview})
+            parts = []
+            try:
+                async for piece in _pieces(stream, deadline):
+                    parts.append(piece)
+                    yield _sse("chunk", {"text": piece})
+            except asyncio.TimeoutError:
+                metrics.http["timeouts"] += 1
+                yield _sse("error", {"detail": "Response time exceeded 30 seconds"})
+                return
+            except Exception as e:  # fallo del proveedor a mitad del stream
+                metrics.http["stream_errors"] += 1
+                print(f"[WARN] LLM stream failed ({type(e).__name__}): {e}")
+                yield _sse("error", {"status": 502, "detail": "The model stream failed"})
+                return
+            # se persiste solo la respuesta completa
+            window = await finish_turn(turn, "".join(parts).strip())
+            yield _sse("done", {"conversation_id": cid, "message": window})
+        finally:
+            await stream.aclose()
+
+    resp = StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    _tag(resp, cid, timings)
+    return resp
+
+
+@router.websocket("/ws")
+async def chat_ws(websocket: WebSocket, conversation_id: Optional[str] = None):
+    """
+    Debate session over WebSocket. The client sends `{"message": "..."}`; the
+    server answers with `start`, `chunk`* and `done` (or `error`) events.
+    Conversation state stays resident for the whole session and each turn is
+    persisted in the background.
+    """
+    await websocket.accept()
+    session = await DebateSession.open(conversation_id)
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            if session.failed is not None:
+                # un turno anterior no se persistió: se corta para que el cliente
+                # reconecte y retome desde lo que hay en el store
+                await websocket.send_json({"event": "error", "status": 500,
+                                           "detail": "Could not persist the conversation; reconnect to resume"})
+                await websocket.close(code=1011)
+                break
+            try:
+                data = json.loads(raw) if raw.lstrip().startswith("{") else {"message": raw}
+                req = MessageRequest(conversation_id=session.cid, message=data.get("message", ""))
+            except (ValueError, ValidationError):
+                await websocket.send_json({"event": "error", "status": 422, "detail": "Invalid message"})
+                continue
+
+            turn = await session.begin(req.message)
+            deadline = loop.time() + _reply_budget()
+            try:
+                stream = await stream_gemini_response_async(turn.claim, req.message, turn.style, context=turn.context)
+            except LLMOverloaded as e:
+                metrics.http["overloaded"] += 1
+                await websocket.send_json({"event": "error", "status": 503, "retry_after": e.retry_after,
+                                           "detail": "Too many debates in progress, try again shortly"})
+                continue
+
+            parts = []
+            try:  # el slot del LLM se libera aunque el envío falle antes de los chunks
+                await websocket.send_json({"event": "start", "conversation_id": session.cid, "message": turn.preview})
+                async for piece in _pieces(stream, deadline):
+                    parts.append(piece)
+                    await websocket.send_json({"event": "chunk", "text": piece})
+            except asyncio.TimeoutError:
+                metrics.http["timeouts"] += 1
+                await websocket.send_json({"event": "error", "status": 408,
+                                           "detail": "Response time exceeded 30 seconds"})
+                continue
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:  # fallo del proveedor: se avisa y la sesión sigue abierta
+                metrics.http["stream_errors"] += 1
+                print(f"[WARN] LLM stream failed ({type(e).__name__}): {e}")
+                await websocket.send_json({"event": "error", "status": 500, "detail": "The model stream failed"})
+                continue
+            finally:
+                await stream.aclose()
+            window = session.complete(turn, "".join(parts).strip())
+            await websocket.send_json({"event": "done", "conversation_id": session.cid, "message": window})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await session.close()
+
+
+async def _pieces(stream, deadline: float):
+    """Trozos del stream del LLM; TimeoutError si se agota el presupuesto. Siempre cierra el stream."""
+    loop = asyncio.get_running_loop()
+    chunks = stream.__aiter__()
+    try:
+        while True:
+            try:
+                yield await asyncio.wait_for(chunks.__anext__(), timeout=max(0, deadline - loop.time()))
+            except StopAsyncIteration:
+                return
+    finally:
+        await stream.aclose()
+
+def _reply_budget() -> float:
+    return max(1, settings.max_reply_secs - 2)
+
+def _overloaded(e: LLMOverloaded) -> HTTPException:
+    metrics.http["overloaded"] += 1
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                         detail="Too many debates in progress, try again shortly",
+                         headers={"Retry-After": str(e.retry_after)})
+
+def _tag(resp, cid: str, timings: Optional[metrics.RequestTimings] = None):
     resp.headers["X-Conversation-Id"] = cid
     resp.headers["X-Service"] = "kopi-debate"
-    return resp
+    timing = metrics.server_timing(timings)
+    if timing:
+        resp.headers["Server-Timing"] = timing
 
 
 # Swagger custom (se registra en app.main)
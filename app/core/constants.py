@@ -20,3 +20,6 @@ ARGUMENT_STYLES = [
     "Socratic: Ask pointed questions that expose assumptions and guide the user to your conclusion.",
     "Sarcastic (lightly): Use wit to underscore weaknesses in the opposing view without ad-hominem.",
 ]
+
+# Mensajes que devuelve /chat (los últimos N, el más reciente al final)
+RESPONSE_WINDOW = 5
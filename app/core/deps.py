@@ -1,58 +1,93 @@
+"""
+SDKs externos, importados e inicializados solo si están configurados y al
+primer uso (normalmente desde el lifespan, vía app.core.registry), no al
+importar la app:
+
+  firebase() -> (db, adb, módulo firestore) o None
+  gemini()   -> módulo google.generativeai ya configurado o None
+
+firebase_configured() / gemini_configured() solo miran la configuración.
+Los nombres antiguos (db, adb, firestore, genai, firebase_enabled,
+gemini_enabled) siguen disponibles como atributos del módulo.
+"""
 import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
-try:
-    import firebase_admin
-    from firebase_admin import credentials, firestore
-except Exception:
-    firebase_admin = None
-    credentials = None
-    firestore = None
+from .settings import settings
 
-try:
-    import google.generativeai as genai
-except Exception:
-    genai = None
 
-from .settings import settings
+def firebase_configured() -> bool:
+    return bool(settings.firebase_creds_path) and os.getenv("DISABLE_FIREBASE") != "1"
+
+
+def gemini_configured() -> bool:
+    return bool(settings.gemini_key) and os.getenv("DISABLE_GEMINI") != "1"
+
 
 # ---- Firebase ----
-db = None
-firebase_enabled = False
-if settings.firebase_creds_path:
+@lru_cache(maxsize=None)
+def firebase() -> Optional[tuple]:
+    if not firebase_configured():
+        if not settings.firebase_creds_path:
+            print("[INFO] FIREBASE_CREDENTIALS not set. Using in-memory persistence.")
+        return None
+    try:
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+    except Exception:
+        firebase_admin = None
     p = Path(settings.firebase_creds_path)
-    if firebase_admin and credentials and firestore and p.exists():
-        try:
-            if not firebase_admin._apps:
-                cred = credentials.Certificate(str(p))
-                firebase_admin.initialize_app(cred)
-            db = firestore.client()
-            firebase_enabled = True
-            print("[INFO] Firebase initialized.")
-        except Exception as e:
-            print(f"[WARN] Could not initialize Firebase: {e}. Using in-memory persistence.")
-    else:
+    if firebase_admin is None or not p.exists():
         print(f"[WARN] FIREBASE_CREDENTIALS '{settings.firebase_creds_path}' not found or SDK unavailable. Using in-memory persistence.")
-else:
-    print("[INFO] FIREBASE_CREDENTIALS not set. Using in-memory persistence.")
+        return None
+    try:
+        from firebase_admin import firestore_async  # firebase-admin >= 6.0
+    except Exception:
+        firestore_async = None
+    try:
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate(str(p)))
+        db = firestore.client()
+        adb = firestore_async.client() if firestore_async else None  # AsyncClient (si el SDK lo soporta)
+        print("[INFO] Firebase initialized.")
+        return db, adb, firestore
+    except Exception as e:
+        print(f"[WARN] Could not initialize Firebase: {e}. Using in-memory persistence.")
+        return None
+
 
 # ---- Gemini ----
-gemini_enabled = bool(settings.gemini_key) and genai is not None
-if gemini_enabled:
+@lru_cache(maxsize=None)
+def gemini():
+    if not gemini_configured():
+        if not settings.gemini_key:
+            print("[INFO] GEMINI_API_KEY not set. Using mock responses.")
+        return None
+    try:
+        import google.generativeai as genai
+    except Exception:
+        print("[INFO] google-generativeai not installed. Using mock responses.")
+        return None
     try:
         genai.configure(api_key=settings.gemini_key)
         print("[INFO] Gemini configured.")
+        return genai
     except Exception as e:
         print(f"[WARN] Could not configure Gemini: {e}. Using mock responses.")
-        gemini_enabled = False
-else:
-    print("[INFO] GEMINI_API_KEY not set or SDK unavailable. Using mock responses.")
+        return None
 
-# ---- Test overrides ----
-if os.getenv("DISABLE_FIREBASE") == "1":
-    firebase_enabled = False
-    db = None
 
-if os.getenv("DISABLE_GEMINI") == "1":
-    gemini_enabled = False
+# ---- Compatibilidad: from app.core.deps import db, gemini_enabled, ... ----
+def __getattr__(name):
+    if name in ("db", "adb", "firestore"):
+        fb = firebase()
+        return fb[("db", "adb", "firestore").index(name)] if fb else None
+    if name == "firebase_enabled":
+        return firebase() is not None
+    if name == "genai":
+        return gemini()
+    if name == "gemini_enabled":
+        return gemini() is not None
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,106 @@
+# app/core/ids.py
+"""
+Ids de conversación únicos y ordenados por tiempo (estilo ULID con nodo).
+
+    conv_ + 26 caracteres Crockford base32 de un entero de 128 bits:
+    | 48 bits ms epoch | 16 bits nodo | 16 bits secuencia | 48 bits aleatorios |
+
+- Orden: el orden lexicográfico de los ids es el de creación (el timestamp
+  va delante y el alfabeto Crockford es ascendente en ASCII).
+- Unicidad sin coordinación: el nodo sale de ID_NODE o de hostname+pid, la
+  secuencia es monótona dentro del proceso y los 48 bits aleatorios cubren
+  el caso (improbable) de dos workers con el mismo nodo en el mismo ms.
+- Los 10 primeros caracteres codifican exactamente el ms, así que un rango
+  de tiempo es un rango de ids: id_bounds() da los límites para un range
+  query ordenado.
+"""
+import os
+import secrets
+import socket
+import threading
+import time
+from hashlib import blake2b
+from typing import Optional, Tuple
+
+from app.core.settings import settings
+
+PREFIX = "conv_"
+_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_INDEX = {c: i for i, c in enumerate(_ALPHABET)}
+_LEN = 26
+_TIME_LEN = 10  # 10 * 5 = 50 bits >= 48 bits de ms
+_MAX_TIME = (1 << 48) - 1
+
+
+def _default_node() -> int:
+    raw = f"{socket.gethostname()}:{os.getpid()}".encode("utf-8")
+    return int.from_bytes(blake2b(raw, digest_size=2).digest(), "big")
+
+
+def _encode(value: int, length: int) -> str:
+    out = []
+    for _ in range(length):
+        out.append(_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(out))
+
+
+def _decode(text: str) -> int:
+    value = 0
+    for c in text:
+        value = (value << 5) | _INDEX[c]
+    return value
+
+
+class IdGenerator:
+    def __init__(self, node: Optional[int] = None):
+        self.node = (_default_node() if node is None else node) & 0xFFFF
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._seq = 0
+
+    def _pid_changed(self):
+        # tras un fork (workers de gunicorn) cada hijo necesita su propio nodo
+        if settings.id_node is None:
+            self.node = _default_node()
+        self._lock = threading.Lock()
+        self._last_ms = self._seq = 0
+
+    def new_id(self) -> str:
+        with self._lock:
+            now = int(time.time() * 1000)
+            # reloj que retrocede o >65536 ids en el mismo ms: seguimos en
+            # el último ms y, si se agota la secuencia, avanzamos uno
+            if now > self._last_ms:
+                self._last_ms, self._seq = now, 0
+            else:
+                self._seq += 1
+                if self._seq > 0xFFFF:
+                    self._last_ms, self._seq = self._last_ms + 1, 0
+            ms, seq = self._last_ms, self._seq
+        value = (ms << 80) | (self.node << 64) | (seq << 48) | secrets.randbits(48)
+        return PREFIX + _encode(value, _LEN)
+
+
+_generator = IdGenerator(settings.id_node)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_generator._pid_changed)
+
+
+def new_id() -> str:
+    return _generator.new_id()
+
+
+def id_timestamp(cid: str) -> Optional[float]:
+    """Segundos epoch de creación; None si el id no es de este generador (p. ej. legacy)."""
+    body = cid[len(PREFIX):]
+    if not cid.startswith(PREFIX) or len(body) != _LEN or any(c not in _INDEX for c in body):
+        return None
+    return _decode(body[:_TIME_LEN]) / 1000
+
+
+def id_bounds(start: float, end: float) -> Tuple[str, str]:
+    """[lo, hi) tales que lo <= id < hi para todo id creado en [start, end]."""
+    lo = _encode(max(0, int(start * 1000)), _TIME_LEN)
+    hi = _encode(min(_MAX_TIME, int(end * 1000)) + 1, _TIME_LEN)
+    return PREFIX + lo, PREFIX + hi
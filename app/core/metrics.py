@@ -0,0 +1,167 @@
+# app/core/metrics.py
+"""
+Instrumentación del camino caliente, sin dependencias externas.
+
+- stage(nombre, backend) mide un tramo (with). El tiempo va a:
+    * el Server-Timing del request en curso (SERVER_TIMING=1, por defecto), y
+    * un histograma por (tramo, backend) si METRICS_ENABLED=1.
+  Con ambos apagados stage() devuelve un contexto nulo compartido.
+- register_stats(nombre, fuente) publica en /metrics los contadores que ya
+  llevan los módulos (llm.stats, reply_cache.stats, capas del store...). Se
+  leen al hacer scrape, así que no añaden nada al camino caliente.
+- render() genera el formato de texto de Prometheus.
+
+Cada worker expone sus propias métricas (Prometheus las agrega por instancia).
+"""
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from app.core.settings import settings
+
+_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_NULL = nullcontext()
+
+_timings: ContextVar[Optional["RequestTimings"]] = ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKETS) + 1)  # el último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, secs: float):
+        self.counts[bisect_left(_BUCKETS, secs)] += 1
+        self.sum += secs
+        self.count += 1
+
+
+_histograms: Dict[Tuple[str, str], Histogram] = {}
+_stats: Dict[str, Union[dict, Callable[[], dict]]] = {}
+
+# contadores propios de las rutas (el resto vive en cada módulo)
+http = {"timeouts": 0, "overloaded": 0, "stream_errors": 0}
+
+
+class RequestTimings(dict):
+    """tramo -> segundos acumulados en este request."""
+    __slots__ = ("t0",)
+
+    def __init__(self):
+        super().__init__()
+        self.t0 = time.perf_counter()
+
+
+def begin() -> Optional[RequestTimings]:
+    """Abre la medición del request actual (la heredan las tareas que lance)."""
+    if not settings.server_timing:
+        return None
+    timings = RequestTimings()
+    _timings.set(timings)
+    return timings
+
+
+def record(name: str, secs: float, backend: str = ""):
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + secs
+    if settings.metrics_enabled:
+        hist = _histograms.get((name, backend))
+        if hist is None:
+            hist = _histograms[(name, backend)] = Histogram()
+        hist.observe(secs)
+
+
+class _Stage:
+    __slots__ = ("name", "backend", "t0")
+
+    def __init__(self, name: str, backend: str):
+        self.name = name
+        self.backend = backend
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.t0, self.backend)
+        return False
+
+
+def stage(name: str, backend: str = ""):
+    if not (settings.server_timing or settings.metrics_enabled):
+        return _NULL
+    return _Stage(name, backend)
+
+
+def server_timing(timings: Optional[RequestTimings]) -> Optional[str]:
+    """Valor de la cabecera Server-Timing (ms) o None si no se mide."""
+    if timings is None:
+        return None
+    parts = [f"{name};dur={secs * 1000:.1f}" for name, secs in timings.items()]
+    parts.append(f"total;dur={(time.perf_counter() - timings.t0) * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# ---- /metrics ----
+
+def register_stats(name: str, source: Union[dict, Callable[[], dict]]):
+    _stats[name] = source
+
+
+def layer_stats(store) -> Dict[str, dict]:
+    """Contadores de cada capa del backend (write-behind, caché L1, tiering, memoria)."""
+    out, layer = {}, store
+    while layer is not None:
+        attrs = vars(layer)  # sin pasar por el __getattr__ de los wrappers
+        stats = attrs.get("stats")
+        stats = stats() if callable(stats) else stats
+        if isinstance(stats, dict):
+            out[(attrs.get("__name__") or type(layer).__name__).rsplit(".", 1)[-1]] = dict(stats)
+        layer = attrs.get("inner")
+    return out
+
+
+def _labels(**kv) -> str:
+    return "{" + ",".join(f'{k}="{v}"' for k, v in kv.items()) + "}"
+
+
+def _emit(lines: List[str], name: str, stats: dict, labels: str = ""):
+    for key, value in sorted(stats.items()):
+        if isinstance(value, (int, float)):
+            lines.append(f"{name}_{key}{labels} {float(value)}")
+    if "hits" in stats and "misses" in stats:
+        lines.append(f"{name}_hit_ratio{labels} {hit_ratio(stats['hits'], stats['misses'])}")
+
+
+def render() -> str:
+    lines: List[str] = []
+    if _histograms:
+        lines += ["# HELP debate_stage_seconds Time spent per request stage.",
+                  "# TYPE debate_stage_seconds histogram"]
+        for (name, backend), hist in sorted(_histograms.items()):
+            acc = 0
+            for le, n in zip(_BUCKETS + ("+Inf",), hist.counts):
+                acc += n
+                lines.append(f"debate_stage_seconds_bucket{_labels(stage=name, backend=backend, le=le)} {acc}")
+            lines.append(f"debate_stage_seconds_sum{_labels(stage=name, backend=backend)} {hist.sum}")
+            lines.append(f"debate_stage_seconds_count{_labels(stage=name, backend=backend)} {hist.count}")
+    for component, source in sorted(_stats.items()):
+        stats = source() if callable(source) else source
+        nested = {k: v for k, v in stats.items() if isinstance(v, dict)}
+        _emit(lines, f"debate_{component}", stats)
+        for layer, sub in sorted(nested.items()):  # p. ej. cada capa del store
+            _emit(lines, f"debate_{component}", sub, _labels(layer=layer.lower()))
+    return "\n".join(lines) + "\n"
+
+
+def hit_ratio(hits: int, misses: int) -> float:
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+register_stats("http", http)
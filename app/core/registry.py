@@ -0,0 +1,83 @@
+# app/core/registry.py
+"""
+Registro de recursos con ciclo de vida (backend de persistencia, clientes
+del LLM, ...). Importar la app ya no crea clientes ni importa SDKs: cada
+módulo registra una fábrica y el lifespan de FastAPI llama a
+
+  startup()  -> crea lo registrado y calienta las conexiones en paralelo;
+                al terminar el proceso está `ready`
+  shutdown() -> cierra en orden inverso (vuelca pendientes, cierra pools)
+
+get(nombre) crea el recurso en el primer uso si el lifespan aún no lo hizo
+(scripts, tests con TestClient sin `with`).
+"""
+import asyncio
+import inspect
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+
+class _Spec(NamedTuple):
+    factory: Callable[[], Any]
+    warm: Optional[Callable[[Any], Any]]
+    close: Optional[Callable[[Any], Any]]
+
+
+async def _maybe_await(result):
+    if inspect.isawaitable(result):
+        await result
+
+
+class Registry:
+    def __init__(self):
+        self._specs: Dict[str, _Spec] = {}
+        self._objs: Dict[str, Any] = {}
+        self.ready = False
+
+    def register(self, name: str, factory: Callable[[], Any],
+                 warm: Optional[Callable[[Any], Any]] = None, close: Optional[Callable[[Any], Any]] = None):
+        self._specs[name] = _Spec(factory, warm, close)
+
+    def get(self, name: str):
+        try:
+            return self._objs[name]
+        except KeyError:
+            obj = self._objs[name] = self._specs[name].factory()
+            return obj
+
+    def peek(self, name: str):
+        """El recurso si ya existe, sin crearlo."""
+        return self._objs.get(name)
+
+    async def _warm(self, name: str):
+        spec = self._specs[name]
+        if spec.warm is None:
+            return
+        try:
+            await _maybe_await(spec.warm(self._objs[name]))
+        except Exception as e:  # un warm-up fallido no impide arrancar: el primer request reintenta
+            print(f"[WARN] Warm-up of '{name}' failed: {e}")
+
+    async def startup(self):
+        for name in self._specs:
+            self.get(name)
+        await asyncio.gather(*(self._warm(name) for name in self._specs))
+        self.ready = True
+
+    async def shutdown(self):
+        self.ready = False
+        for name in reversed(list(self._objs)):
+            spec = self._specs[name]
+            obj = self._objs.pop(name)
+            if spec.close is None:
+                continue
+            try:
+                await _maybe_await(spec.close(obj))
+            except Exception as e:
+                print(f"[WARN] Closing '{name}' failed: {e}")
+
+    def status(self) -> Dict[str, bool]:
+        """recurso -> creado."""
+        return {name: name in self._objs for name in self._specs}
+
+
+resources = Registry()
@@ -10,6 +10,50 @@ class Settings(BaseModel):
     history_soft_limit: int = Field(200, alias="HISTORY_SOFT_LIMIT")
     redis_url: Optional[str] = Field(None, alias="REDIS_URL")
     redis_ttl_secs: Optional[int] = Field(None, alias="REDIS_TTL_SECS")
+    redis_pool_size: int = Field(50, alias="REDIS_POOL_SIZE")
+    redis_cluster: bool = Field(False, alias="REDIS_CLUSTER")
+    redis_vnodes: int = Field(160, alias="REDIS_VNODES")
+    redis_adopt_legacy: bool = Field(True, alias="REDIS_ADOPT_LEGACY")
+    redis_codec: str = Field("v1", alias="REDIS_CODEC")
+    redis_compress_min: int = Field(512, alias="REDIS_COMPRESS_MIN")
+    memory_max_conversations: int = Field(10000, alias="MEMORY_MAX_CONVERSATIONS")
+    memory_max_bytes: int = Field(64 * 1024 * 1024, alias="MEMORY_MAX_BYTES")
+    memory_ttl_secs: int = Field(24 * 3600, alias="MEMORY_TTL_SECS")
+    l1_cache_size: int = Field(0, alias="L1_CACHE_SIZE")
+    l1_cache_ttl_secs: int = Field(60, alias="L1_CACHE_TTL_SECS")
+    write_behind: bool = Field(False, alias="WRITE_BEHIND")
+    write_behind_max_pending: int = Field(5000, alias="WRITE_BEHIND_MAX_PENDING")
+    write_behind_interval_ms: int = Field(50, alias="WRITE_BEHIND_INTERVAL_MS")
+    llm_max_concurrency: int = Field(16, alias="LLM_MAX_CONCURRENCY")
+    llm_queue_size: int = Field(64, alias="LLM_QUEUE_SIZE")
+    llm_queue_timeout_secs: float = Field(5.0, alias="LLM_QUEUE_TIMEOUT_SECS")
+    llm_provider: str = Field("", alias="LLM_PROVIDER")
+    llm_local_provider: str = Field("", alias="LLM_LOCAL_PROVIDER")
+    llm_hedge: bool = Field(True, alias="LLM_HEDGE")
+    llm_hedge_min_delay_secs: float = Field(0.5, alias="LLM_HEDGE_MIN_DELAY_SECS")
+    llm_hedge_default_delay_secs: float = Field(3.0, alias="LLM_HEDGE_DEFAULT_DELAY_SECS")
+    llm_fallback_model: str = Field("", alias="LLM_FALLBACK_MODEL")
+    llm_fallback_reserve_secs: float = Field(6.0, alias="LLM_FALLBACK_RESERVE_SECS")
+    llm_canned_margin_secs: float = Field(0.5, alias="LLM_CANNED_MARGIN_SECS")
+    context_token_budget: int = Field(800, alias="CONTEXT_TOKEN_BUDGET")
+    context_window_msgs: int = Field(12, alias="CONTEXT_WINDOW_MSGS")
+    context_summary_step: int = Field(6, alias="CONTEXT_SUMMARY_STEP")
+    context_summary_tokens: int = Field(200, alias="CONTEXT_SUMMARY_TOKENS")
+    reply_cache_size: int = Field(1000, alias="REPLY_CACHE_SIZE")
+    reply_cache_ttl_secs: int = Field(3600, alias="REPLY_CACHE_TTL_SECS")
+    reply_cache_shared: bool = Field(False, alias="REPLY_CACHE_SHARED")
+    id_node: Optional[int] = Field(None, alias="ID_NODE")
+    tiered_store: bool = Field(False, alias="TIERED_STORE")
+    metrics_enabled: bool = Field(False, alias="METRICS_ENABLED")
+    server_timing: bool = Field(True, alias="SERVER_TIMING")
+    archive_idle_secs: int = Field(7 * 24 * 3600, alias="ARCHIVE_IDLE_SECS")
+    archive_interval_secs: int = Field(300, alias="ARCHIVE_INTERVAL_SECS")
+    archive_batch: int = Field(200, alias="ARCHIVE_BATCH")
+    sqlite_path: Optional[str] = Field(None, alias="SQLITE_PATH")
+    sqlite_ttl_secs: int = Field(30 * 24 * 3600, alias="SQLITE_TTL_SECS")
+    sqlite_vacuum_interval_secs: int = Field(600, alias="SQLITE_VACUUM_INTERVAL_SECS")
+    sqlite_readers: int = Field(4, alias="SQLITE_READERS")
+    sqlite_busy_timeout_ms: int = Field(5000, alias="SQLITE_BUSY_TIMEOUT_MS")
 
 def load_settings() -> Settings:
     data = {
@@ -20,6 +64,50 @@ def load_settings() -> Settings:
         "HISTORY_SOFT_LIMIT": int(os.getenv("HISTORY_SOFT_LIMIT", "200")),
         "REDIS_URL": os.getenv("REDIS_URL"),
         "REDIS_TTL_SECS": int(os.getenv("REDIS_TTL_SECS", "0") or 0),
+        "REDIS_POOL_SIZE": int(os.getenv("REDIS_POOL_SIZE", "50")),
+        "REDIS_CLUSTER": os.getenv("REDIS_CLUSTER") == "1",
+        "REDIS_VNODES": int(os.getenv("REDIS_VNODES", "160")),
+        "REDIS_ADOPT_LEGACY": os.getenv("REDIS_ADOPT_LEGACY", "1") == "1",
+        "REDIS_CODEC": os.getenv("REDIS_CODEC", "v1"),
+        "REDIS_COMPRESS_MIN": int(os.getenv("REDIS_COMPRESS_MIN", "512")),
+        "MEMORY_MAX_CONVERSATIONS": int(os.getenv("MEMORY_MAX_CONVERSATIONS", "10000")),
+        "MEMORY_MAX_BYTES": int(os.getenv("MEMORY_MAX_BYTES", str(64 * 1024 * 1024))),
+        "MEMORY_TTL_SECS": int(os.getenv("MEMORY_TTL_SECS", str(24 * 3600))),
+        "L1_CACHE_SIZE": int(os.getenv("L1_CACHE_SIZE", "0")),
+        "L1_CACHE_TTL_SECS": int(os.getenv("L1_CACHE_TTL_SECS", "60")),
+        "WRITE_BEHIND": os.getenv("WRITE_BEHIND") == "1",
+        "WRITE_BEHIND_MAX_PENDING": int(os.getenv("WRITE_BEHIND_MAX_PENDING", "5000")),
+        "WRITE_BEHIND_INTERVAL_MS": int(os.getenv("WRITE_BEHIND_INTERVAL_MS", "50")),
+        "LLM_MAX_CONCURRENCY": int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+        "LLM_QUEUE_SIZE": int(os.getenv("LLM_QUEUE_SIZE", "64")),
+        "LLM_QUEUE_TIMEOUT_SECS": float(os.getenv("LLM_QUEUE_TIMEOUT_SECS", "5")),
+        "LLM_PROVIDER": os.getenv("LLM_PROVIDER", ""),
+        "LLM_LOCAL_PROVIDER": os.getenv("LLM_LOCAL_PROVIDER", ""),
+        "LLM_HEDGE": os.getenv("LLM_HEDGE", "1") == "1",
+        "LLM_HEDGE_MIN_DELAY_SECS": float(os.getenv("LLM_HEDGE_MIN_DELAY_SECS", "0.5")),
+        "LLM_HEDGE_DEFAULT_DELAY_SECS": float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_SECS", "3")),
+        "LLM_FALLBACK_MODEL": os.getenv("LLM_FALLBACK_MODEL", ""),
+        "LLM_FALLBACK_RESERVE_SECS": float(os.getenv("LLM_FALLBACK_RESERVE_SECS", "6")),
+        "LLM_CANNED_MARGIN_SECS": float(os.getenv("LLM_CANNED_MARGIN_SECS", "0.5")),
+        "CONTEXT_TOKEN_BUDGET": int(os.getenv("CONTEXT_TOKEN_BUDGET", "800")),
+        "CONTEXT_WINDOW_MSGS": int(os.getenv("CONTEXT_WINDOW_MSGS", "12")),
+        "CONTEXT_SUMMARY_STEP": int(os.getenv("CONTEXT_SUMMARY_STEP", "6")),
+        "CONTEXT_SUMMARY_TOKENS": int(os.getenv("CONTEXT_SUMMARY_TOKENS", "200")),
+        "REPLY_CACHE_SIZE": int(os.getenv("REPLY_CACHE_SIZE", "1000")),
+        "REPLY_CACHE_TTL_SECS": int(os.getenv("REPLY_CACHE_TTL_SECS", "3600")),
+        "REPLY_CACHE_SHARED": os.getenv("REPLY_CACHE_SHARED") == "1",
+        "ID_NODE": int(os.getenv("ID_NODE")) if os.getenv("ID_NODE") else None,
+        "TIERED_STORE": os.getenv("TIERED_STORE") == "1",
+        "METRICS_ENABLED": os.getenv("METRICS_ENABLED") == "1",
+        "SERVER_TIMING": os.getenv("SERVER_TIMING", "1") == "1",
+        "ARCHIVE_IDLE_SECS": int(os.getenv("ARCHIVE_IDLE_SECS", str(7 * 24 * 3600))),
+        "ARCHIVE_INTERVAL_SECS": int(os.getenv("ARCHIVE_INTERVAL_SECS", "300")),
+        "ARCHIVE_BATCH": int(os.getenv("ARCHIVE_BATCH", "200")),
+        "SQLITE_PATH": os.getenv("SQLITE_PATH"),
+        "SQLITE_TTL_SECS": int(os.getenv("SQLITE_TTL_SECS", str(30 * 24 * 3600))),
+        "SQLITE_VACUUM_INTERVAL_SECS": int(os.getenv("SQLITE_VACUUM_INTERVAL_SECS", "600")),
+        "SQLITE_READERS": int(os.getenv("SQLITE_READERS", "4")),
+        "SQLITE_BUSY_TIMEOUT_MS": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
     }
     return Settings(**data)
 
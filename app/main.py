@@ -1,12 +1,22 @@
 # app/main.py
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.api.routes import router as api_router, swagger_ui, build_openapi
+from app.core.registry import resources
 
 openapi_tags = [
     {"name": "meta", "description": "Health and metadata endpoints."},
     {"name": "chat", "description": "Debate with the bot: it defends its stance and stays on topic."},
 ]
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # backend, clientes del LLM, ...: se crean aquí (no al importar) y se
+    # calientan en paralelo; al salir se vuelca lo pendiente y se cierran pools
+    await resources.startup()
+    yield
+    await resources.shutdown()
+
 app = FastAPI(
     title="Kopi Debate API",
     version="1.2.0",
@@ -22,6 +32,7 @@ app = FastAPI(
     openapi_tags=openapi_tags,
     docs_url=None,
     redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
 app.include_router(api_router)
@@ -19,3 +19,16 @@ class ChatResponse(BaseModel):
 
 class ErrorResponse(BaseModel):
     detail: str
+
+class BatchChatRequest(BaseModel):
+    items: List[MessageRequest] = Field(..., min_length=1, max_length=100,
+                                        description="Turns to play, each on its own conversation.")
+
+class BatchChatItem(BaseModel):
+    conversation_id: str
+    status: int = Field(..., description="HTTP-like status of this item (200 on success).")
+    message: Optional[List[ChatMessage]] = None
+    error: Optional[str] = None
+
+class BatchChatResponse(BaseModel):
+    results: List[BatchChatItem]
@@ -0,0 +1,103 @@
+# app/services/context.py
+"""
+Contexto de conversación para el prompt, con tamaño acotado.
+
+- Los turnos recientes (cola de CONTEXT_WINDOW_MSGS mensajes) se empaquetan
+  del más nuevo al más viejo hasta llenar CONTEXT_TOKEN_BUDGET.
+- Lo que sale de la ventana se pliega en un resumen extractivo guardado en
+  la meta ("summary" + "summary_v" = versión hasta la que cubre). Solo se
+  recalcula cuando la ventana se ha desplazado CONTEXT_SUMMARY_STEP mensajes,
+  y está acotado a CONTEXT_SUMMARY_TOKENS, así que el prompt no crece con la
+  conversación.
+"""
+import re
+from typing import List, Optional
+
+from app.core.settings import settings
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_SKIP_PREFIXES = ("I will prove that ", "Let's stay on our original claim")
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 caracteres por token: suficiente para presupuestar sin tokenizer
+    return len(text) // 4 + 1
+
+
+# Mensajes que puede añadir un turno: usuario + réplica, más la semilla (1er
+# turno) o el aviso de "fuera de tema" con su par
+MAX_TURN_MSGS = 4
+
+
+def tail_size() -> int:
+    """
+    Mensajes a leer por turno: la ventana + lo que puede tener que plegarse.
+    El resumen se recalcula en el primer turno en que la ventana se ha
+    desplazado CONTEXT_SUMMARY_STEP mensajes, pero un turno largo puede
+    pasarse hasta MAX_TURN_MSGS - 1 de ese paso: la cola debe cubrirlo o
+    esos mensajes nunca llegan al resumen.
+    """
+    step = settings.context_summary_step
+    return settings.context_window_msgs + step + max(step, MAX_TURN_MSGS)
+
+
+def _label(msg: dict) -> str:
+    return "User" if msg["role"] == "user" else "AI"
+
+
+def _gist(msg: dict) -> Optional[str]:
+    text = msg["message"].strip()
+    if not text or (msg["role"] == "bot" and text.startswith(_SKIP_PREFIXES)):
+        return None
+    first = _SENTENCE_RE.split(text, 1)[0].replace("\n", " ")
+    if len(first) > 160:
+        first = first[:157].rstrip() + "..."
+    return f"{_label(msg)}: {first}"
+
+
+def fold_summary(summary: str, msgs: List[dict]) -> str:
+    """Añade los mensajes al resumen y recorta por el principio hasta caber en el presupuesto."""
+    lines = [l for l in summary.splitlines() if l] + [g for g in map(_gist, msgs) if g]
+    while lines and estimate_tokens("\n".join(lines)) > settings.context_summary_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def roll_summary(meta: dict, tail: List[dict]) -> Optional[dict]:
+    """
+    Meta a actualizar ({"summary", "summary_v"}) si la ventana se desplazó lo
+    suficiente desde el último resumen; None si no hay nada que recalcular.
+    """
+    version = meta.get("v")
+    if version is None:
+        return None
+    window_start = version - settings.context_window_msgs  # índice absoluto
+    done = int(meta.get("summary_v") or 0)
+    if window_start - done < settings.context_summary_step:
+        return None
+    tail_start = version - len(tail)
+    fresh = tail[max(done, tail_start) - tail_start: max(0, window_start - tail_start)]
+    return {"summary": fold_summary(meta.get("summary") or "", fresh), "summary_v": window_start}
+
+
+def build_context(summary: str, recent: List[dict]) -> str:
+    """Resumen + turnos recientes (los más nuevos primero) dentro del presupuesto de tokens."""
+    budget = settings.context_token_budget
+    parts: List[str] = []
+    if summary:
+        block = f"Earlier in the debate (summary):\n{summary}"
+        if estimate_tokens(block) <= budget:
+            parts.append(block)
+            budget -= estimate_tokens(block)
+    lines: List[str] = []
+    for msg in reversed(recent[-settings.context_window_msgs:]):
+        line = f"{_label(msg)}: {msg['message']}"
+        cost = estimate_tokens(line)
+        if cost > budget:
+            break
+        lines.append(line)
+        budget -= cost
+    if lines:
+        parts.append("\n".join(reversed(lines)))
+    return "\n\n".join(parts)
+
@@ -1,20 +1,422 @@
 import asyncio
+import importlib
+import inspect
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Optional
 from app.core.settings import settings
-from app.core.deps import gemini_enabled, genai  # genai se importa desde deps
+from app.core import deps
+from app.core.metrics import record, register_stats, stage
+from app.core.registry import resources
 from .nlp import build_prompt
+from .reply_cache import reply_cache, cache_key
 
-def call_model_sync(prompt: str) -> str:
-    model = genai.GenerativeModel(model_name=settings.model_name)
-    resp = model.generate_content(prompt)
+# ---- Control de admisión para las llamadas al modelo ----
+# Pool dedicado (no compartimos el executor por defecto de asyncio) y un
+# semáforo del mismo tamaño. El slot se libera cuando el hilo termina de
+# verdad, no cuando el request abandona la espera (timeout del route), así
+# que las llamadas abandonadas siguen contando contra la capacidad en vez de
+# apilarse. Si la cola de espera está llena, o no hay slot en
+# LLM_QUEUE_TIMEOUT_SECS, se rechaza rápido con LLMOverloaded.
+# El pool es un recurso de app.core.registry: se crea en el lifespan (o en la
+# primera llamada) y se cierra al salir sin esperar a los hilos en curso.
+
+def _new_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=settings.llm_max_concurrency, thread_name_prefix="llm")
+
+def _close_pool(pool: ThreadPoolExecutor):
+    # las llamadas en cola se cancelan; sus slots se liberan en el callback
+    pool.shutdown(wait=False, cancel_futures=True)
+
+resources.register("llm_pool", _new_pool, close=_close_pool)
+_slots = asyncio.Semaphore(settings.llm_max_concurrency)
+
+stats = {
+    "inflight": 0, "waiting": 0, "rejected": 0, "abandoned": 0, "abandoned_running": 0,
+    "hedged": 0, "hedge_wins": 0, "hedge_skipped": 0, "fallbacks": 0, "canned": 0,
+}
+
+register_stats("llm", lambda: stats)
+
+class LLMOverloaded(Exception):
+    """No hay capacidad para otra llamada al modelo; reintentar tras `retry_after` s."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("LLM capacity exhausted")
+        self.retry_after = retry_after
+
+def _retry_after() -> int:
+    return max(1, int(settings.llm_queue_timeout_secs))
+
+# Un hedge solo usa un slot libre: nunca espera en la cola de admisión
+# delante de requests reales (lanzarlos bajo carga empeora la saturación).
+_no_wait: ContextVar[bool] = ContextVar("llm_no_wait", default=False)
+
+# Duración de la llamada al modelo ya con slot (sin la espera en cola); la
+# lee Provider.generate para la ventana de latencias del hedge.
+_call_secs: ContextVar[Optional[list]] = ContextVar("llm_call_secs", default=None)
+
+class _NoSlot(Exception):
+    """Hedge descartado: no había slot libre."""
+
+def _note_call(secs: float):
+    sink = _call_secs.get()
+    if sink is not None:
+        sink.append(secs)
+
+async def _acquire_slot():
+    if _no_wait.get():
+        if _slots.locked():
+            raise _NoSlot()
+        await _slots.acquire()  # libre: no cede el turno
+        return
+    if _slots.locked() and stats["waiting"] >= settings.llm_queue_size:
+        stats["rejected"] += 1
+        raise LLMOverloaded(_retry_after())
+    stats["waiting"] += 1
+    try:
+        with stage("llm_queue"):  # espera por un slot, separada de la generación
+            await asyncio.wait_for(_slots.acquire(), timeout=settings.llm_queue_timeout_secs)
+    except asyncio.TimeoutError:
+        stats["rejected"] += 1
+        raise LLMOverloaded(_retry_after())
+    finally:
+        stats["waiting"] -= 1
+
+async def run_model_coro(coro_fn, *args):
+    """Await de `coro_fn(*args)` (SDK async nativo) bajo control de admisión."""
+    await _acquire_slot()
+    stats["inflight"] += 1
+    t0 = time.perf_counter()
+    try:
+        with stage("llm_generate"):
+            result = await coro_fn(*args)  # aquí cancelar sí corta la llamada
+        _note_call(time.perf_counter() - t0)
+        return result
+    finally:
+        stats["inflight"] -= 1
+        _slots.release()
+
+async def run_model_call(fn, *args):
+    """Ejecuta `fn(*args)` en el pool del LLM bajo control de admisión."""
+    await _acquire_slot()
+    stats["inflight"] += 1
+    t0 = time.perf_counter()
+    fut = asyncio.get_running_loop().run_in_executor(resources.get("llm_pool"), fn, *args)
+    abandoned = False
+
+    def _release(_):
+        record("llm_generate", time.perf_counter() - t0)  # también si el request ya abandonó
+        stats["inflight"] -= 1
+        if abandoned:
+            stats["abandoned_running"] -= 1
+        _slots.release()
+
+    fut.add_done_callback(_release)
+    try:
+        result = await asyncio.shield(fut)
+        _note_call(time.perf_counter() - t0)
+        return result
+    except asyncio.CancelledError:
+        # el hilo no se puede cancelar: queda contabilizado hasta que termine
+        if not fut.done():
+            abandoned = True
+            stats["abandoned"] += 1
+            stats["abandoned_running"] += 1
+        raise
+
+# ---- Cliente del modelo ----
+# Un GenerativeModel por (modelo, generation config), reutilizado entre
+# requests: cada instancia mantiene su cliente/canal del SDK, así que la
+# conexión queda abierta (keep-alive) en vez de montarse en cada turno.
+
+@lru_cache(maxsize=8)
+def _cached_model(model_name: str, config: tuple):
+    return deps.gemini().GenerativeModel(model_name=model_name, generation_config=dict(config) or None)
+
+def get_model(model_name: str = None, **generation_config):
+    return _cached_model(model_name or settings.model_name, tuple(sorted(generation_config.items())))
+
+def _text(resp) -> str:
     return (getattr(resp, "text", "") or "").strip()
 
-async def generate_gemini_response_async(topic: str, user_message: str, style: str) -> str:
-    if not gemini_enabled:
-        return (
-            f"**{topic}** — (mock)\n"
-            f"Style: {style}\n"
-            f"You said: *{user_message}*.\n"
-            f"My stance remains firm. Which part do you disagree with the most?"
-        )
-    prompt = build_prompt(topic, user_message, style)
-    return await asyncio.to_thread(call_model_sync, prompt)
+def call_model_sync(prompt: str, model_name: str = None) -> str:
+    return _text(get_model(model_name).generate_content(prompt))
+
+async def call_model_async(prompt: str, model_name: str = None) -> str:
+    return _text(await get_model(model_name).generate_content_async(prompt))
+
+async def warm_up(_=None):
+    """Crea el cliente y abre la conexión antes del primer request (lifespan)."""
+    if deps.gemini() is None:
+        return
+    model = get_model()
+    try:
+        if hasattr(model, "count_tokens_async"):
+            await model.count_tokens_async("ping")  # barato: no genera
+        else:
+            await asyncio.to_thread(model.count_tokens, "ping")
+        print("[INFO] Gemini client warmed up.")
+    except Exception as e:
+        print(f"[WARN] Gemini warm-up failed: {e}")
+
+def _mock_reply(topic: str, user_message: str, style: str) -> str:
+    return (
+        f"**{topic}** — (mock)\n"
+        f"Style: {style}\n"
+        f"You said: *{user_message}*.\n"
+        f"My stance remains firm. Which part do you disagree with the most?"
+    )
+
+# ---- Proveedores ----
+# Un proveedor recibe el prompt (y el contexto del turno, que usa el mock) y
+# devuelve texto. Cada uno lleva su ventana de latencias para el hedging.
+
+class LatencyWindow:
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+
+    def add(self, secs: float):
+        self._samples.append(secs)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, q: float) -> float:
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+class Provider:
+    name = "base"
+
+    def __init__(self):
+        self.latency = LatencyWindow()
+
+    async def _call(self, prompt: str, **ctx) -> str:
+        raise NotImplementedError
+
+    async def generate(self, prompt: str, **ctx) -> str:
+        sink: list = []
+        token = _call_secs.set(sink)
+        t0 = time.perf_counter()
+        try:
+            text = await self._call(prompt, **ctx)
+        finally:
+            _call_secs.reset(token)
+        # con control de admisión cuenta solo la llamada, no la cola
+        self.latency.add(sink[-1] if sink else time.perf_counter() - t0)
+        return text
+
+class GeminiProvider(Provider):
+    def __init__(self, model_name: str):
+        super().__init__()
+        self.model_name = model_name
+        self.name = f"gemini:{model_name}"
+
+    async def _call(self, prompt: str, **ctx) -> str:
+        if hasattr(get_model(self.model_name), "generate_content_async"):
+            return await run_model_coro(call_model_async, prompt, self.model_name)
+        return await run_model_call(call_model_sync, prompt, self.model_name)  # SDKs antiguos: hilo dedicado
+
+class MockProvider(Provider):
+    name = "mock"
+
+    async def _call(self, prompt: str, **ctx) -> str:
+        return _mock_reply(ctx.get("topic", ""), ctx.get("user_message", ""), ctx.get("style", ""))
+
+class LocalProvider(Provider):
+    """Stand-in local enchufable: LLM_LOCAL_PROVIDER="paquete.modulo:funcion", fn(prompt) -> str (sync o async)."""
+    name = "local"
+
+    def __init__(self, target: str):
+        super().__init__()
+        module, _, attr = target.partition(":")
+        self.fn = getattr(importlib.import_module(module), attr)
+
+    async def _call(self, prompt: str, **ctx) -> str:
+        if inspect.iscoroutinefunction(self.fn):
+            return await self.fn(prompt)
+        return await run_model_call(self.fn, prompt)
+
+providers: dict = {"mock": MockProvider()}
+
+def register_provider(key: str, provider: Provider):
+    providers[key] = provider
+
+def _setup_providers() -> dict:
+    """Registra los proveedores configurados (importa el SDK solo si hace falta)."""
+    if deps.gemini() is not None:
+        register_provider("gemini", GeminiProvider(settings.model_name))
+        if settings.llm_fallback_model:
+            register_provider("fallback", GeminiProvider(settings.llm_fallback_model))
+    if settings.llm_local_provider:
+        register_provider("local", LocalProvider(settings.llm_local_provider))
+    return providers
+
+resources.register("llm", _setup_providers, warm=warm_up)
+
+def _primary() -> Provider:
+    resources.get("llm")
+    return providers.get(settings.llm_provider) or providers.get("gemini") or providers["mock"]
+
+def canned_reply(topic: str) -> str:
+    return (
+        f"I stand by it: **{topic}**. The evidence and everyday experience keep pointing the same way, "
+        "and nothing you've said changes that. Which part would you like me to break down first?"
+    )
+
+def _hedge_delay(provider: Provider) -> float:
+    if len(provider.latency) >= 20:
+        return max(settings.llm_hedge_min_delay_secs, provider.latency.percentile(0.95))
+    return settings.llm_hedge_default_delay_secs
+
+async def _hedged(provider: Provider, prompt: str, until: float, **ctx) -> str:
+    """
+    Lanza la llamada y, si no ha terminado tras el p95 de latencia del
+    proveedor, una segunda idéntica; gana la primera que termine bien y la
+    otra se cancela. La segunda solo sale si hay un slot libre en ese
+    momento. `until` (loop.time) acota todo.
+    """
+    loop = asyncio.get_running_loop()
+    tasks = [asyncio.ensure_future(provider.generate(prompt, **ctx))]
+    try:
+        delay = _hedge_delay(provider)
+        if settings.llm_hedge and loop.time() + delay < until:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and _slots.locked():
+                stats["hedge_skipped"] += 1
+            elif not done:
+                stats["hedged"] += 1
+                token = _no_wait.set(True)  # la tarea hereda el contexto al crearse
+                try:
+                    tasks.append(asyncio.ensure_future(provider.generate(prompt, **ctx)))
+                finally:
+                    _no_wait.reset(token)
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, timeout=max(0, until - loop.time()), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise asyncio.TimeoutError()
+            for t in done:
+                if t.exception() is None:
+                    if t is not tasks[0]:
+                        stats["hedge_wins"] += 1
+                    return t.result()
+                if isinstance(t.exception(), _NoSlot):  # otro request tomó el slot antes
+                    stats["hedged"] -= 1
+                    stats["hedge_skipped"] += 1
+                    continue
+                error = t.exception()
+        raise error
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+
+async def _generate_with_fallback(prompt: str, deadline: float, **ctx) -> str:
+    """Proveedor principal (con hedging) hasta `deadline - reserva`, luego el modelo de respaldo."""
+    loop = asyncio.get_running_loop()
+    fallback = providers.get("fallback")
+    reserve = settings.llm_fallback_reserve_secs if fallback else 0
+    try:
+        return await _hedged(_primary(), prompt, deadline - reserve, **ctx)
+    except LLMOverloaded:
+        raise
+    except Exception:
+        if not fallback or loop.time() >= deadline:
+            raise
+    stats["fallbacks"] += 1
+    return await asyncio.wait_for(fallback.generate(prompt, **ctx), timeout=max(0, deadline - loop.time()))
+
+async def generate_gemini_response_async(topic: str, user_message: str, style: str,
+                                         deadline: Optional[float] = None, context: str = "") -> str:
+    """
+    Respuesta del bot antes de `deadline` (loop.time()). Si ni el principal
+    ni el respaldo llegan a tiempo, se devuelve una respuesta enlatada en vez
+    de agotar el presupuesto; la saturación sigue propagándose (LLMOverloaded).
+    """
+    if _primary() is providers["mock"] and len(providers) == 1:
+        return _mock_reply(topic, user_message, style)
+    loop = asyncio.get_running_loop()
+    if deadline is None:
+        deadline = loop.time() + max(1, settings.max_reply_secs - 2)
+    # margen para responder con la enlatada antes del límite duro del route
+    soft_deadline = deadline - settings.llm_canned_margin_secs
+    prompt = build_prompt(topic, user_message, style, context)
+    ctx = {"topic": topic, "user_message": user_message, "style": style}
+
+    async def _generate() -> str:
+        return await _generate_with_fallback(prompt, soft_deadline, **ctx)
+
+    try:
+        if reply_cache is None:
+            return await _generate()
+        key = cache_key(topic, user_message, style, _primary().name, context)
+        return await asyncio.wait_for(reply_cache.get_or_generate(key, _generate),
+                                      timeout=max(0, soft_deadline - loop.time()))
+    except LLMOverloaded:
+        raise
+    except Exception as e:
+        stats["canned"] += 1
+        print(f"[WARN] LLM failed ({type(e).__name__}); using canned reply.")
+        return canned_reply(topic)
+
+# ---- Streaming ----
+
+class ReplyStream:
+    """Iterador async de trozos de texto; `aclose()` libera el slot del LLM (idempotente)."""
+
+    def __init__(self, chunks, release=None):
+        self._chunks = chunks
+        self._release = release
+
+    def __aiter__(self):
+        return self._chunks.__aiter__()
+
+    async def aclose(self):
+        try:
+            if hasattr(self._chunks, "aclose"):
+                await self._chunks.aclose()
+        finally:
+            if self._release:
+                release, self._release = self._release, None
+                release()
+
+async def _iter_mock(text: str):
+    # el mock también sale en trozos (por línea) para ejercitar el camino SSE
+    for line in text.splitlines(keepends=True):
+        yield line
+
+async def _iter_gemini(prompt: str):
+    resp = await get_model().generate_content_async(prompt, stream=True)
+    async for chunk in resp:
+        text = getattr(chunk, "text", "")
+        if text:
+            yield text
+
+async def stream_gemini_response_async(topic: str, user_message: str, style: str,
+                                       context: str = "") -> ReplyStream:
+    """
+    Reserva capacidad (LLMOverloaded antes de empezar) y devuelve el stream
+    de la respuesta. El llamador debe hacer `aclose()` al terminar.
+    """
+    resources.get("llm")
+    if deps.gemini() is None:
+        return ReplyStream(_iter_mock(_mock_reply(topic, user_message, style)))
+    if not hasattr(get_model(), "generate_content_async"):
+        text = await generate_gemini_response_async(topic, user_message, style, context=context)
+        return ReplyStream(_iter_mock(text))
+
+    await _acquire_slot()
+    stats["inflight"] += 1
+
+    def _release():
+        stats["inflight"] -= 1
+        _slots.release()
+
+    return ReplyStream(_iter_gemini(build_prompt(topic, user_message, style, context)), _release)
@@ -1,5 +1,18 @@
+import math
 import re
-from typing import Tuple
+import unicodedata
+import zlib
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple
+
+@lru_cache(maxsize=None)
+def _numpy():
+    """NumPy (opcional, solo para puntuar lotes de mensajes); se importa al primer uso."""
+    try:
+        import numpy
+        return numpy
+    except Exception:
+        return None
 
 def extract_topic_from_seed(seed: str) -> str:
     out = seed
@@ -7,10 +20,144 @@ def extract_topic_from_seed(seed: str) -> str:
         out = out[len("I will prove that "):]
     return out.rstrip("!")
 
-def is_on_topic(user_msg: str, topic: str) -> bool:
-    topic_kw = {w.lower() for w in topic.split() if len(w) > 3}
-    msg_kw = {w.lower() for w in user_msg.split() if len(w) > 3}
-    return len(topic_kw & msg_kw) >= max(1, len(topic_kw) // 6)
+# ---- Clasificador on-topic ----
+# Normaliza (casefold, sin acentos, sin stopwords ES/EN, stemming ligero) y
+# representa cada texto como TF-IDF "hasheado" disperso {bucket: peso}.
+# Las features de la claim (conteos por bucket) se calculan una vez al crear
+# la conversación y viajan en la meta; cada turno solo tokeniza el mensaje.
+# El IDF se aprende online de los mensajes vistos por el proceso.
+
+_DIM = 1 << 18
+ON_TOPIC_THRESHOLD = 0.08  # coseno mínimo mensaje/claim
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset("""
+a al algo ante aqui asi como con contra cual cuando de del desde donde dos el ella ellos en entre era es
+esa ese eso esta este esto estos fue ha hay la las le les lo los mas me mi mas mucho muy nada ni no nos o
+otra otro para pero poco por porque pues que quien se ser si sin sobre son su sus tambien te ti tiene
+todo tu tus un una uno unos usted y ya yo
+about after all also an and any are as at be because been but by can could did do does for from had has
+have he her his how i if in into is it its just me more most my no not of on or our out so some than
+that the their them then there these they this to too us was we were what when where which who why will
+with would you your
+""".split())
+_SUFFIXES = ("amiento", "imiento", "aciones", "uciones", "mente", "acion", "ucion", "ando", "iendo",
+             "ness", "ment", "ing", "ers", "ies", "es", "ed", "er", "s")
+
+_df = [0] * _DIM  # lista: el acceso por índice es más barato que en un array NumPy
+_docs = 0
+_LOG_TF = [0.0] + [math.log(c) for c in range(1, 32)]
+
+
+def _strip_accents(text: str) -> str:
+    if text.isascii():
+        return text
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def _stem(tok: str) -> str:
+    for suf in _SUFFIXES:
+        if len(tok) - len(suf) >= 3 and tok.endswith(suf):
+            return tok[: -len(suf)]
+    return tok
+
+
+@lru_cache(maxsize=65536)
+def _token_bucket(tok: str) -> int:
+    # stopword/stem/hash por token, memoizado: el vocabulario real es pequeño
+    if tok in _STOPWORDS or len(tok) < 2:
+        return -1
+    return zlib.crc32(_stem(tok).encode("utf-8")) & (_DIM - 1)  # estable entre procesos
+
+
+def normalize_tokens(text: str) -> List[str]:
+    toks = _TOKEN_RE.findall(_strip_accents(text.casefold()))
+    return [_stem(t) for t in toks if t not in _STOPWORDS and len(t) > 1]
+
+
+def term_counts(text: str) -> Dict[int, int]:
+    counts: Dict[int, int] = {}
+    for tok in _TOKEN_RE.findall(_strip_accents(text.casefold())):
+        b = _token_bucket(tok)
+        if b >= 0:
+            counts[b] = counts.get(b, 0) + 1
+    return counts
+
+
+def claim_features(claim: str) -> str:
+    """Features de la claim serializadas para la meta: "bucket:conteo,..."."""
+    return ",".join(f"{b}:{c}" for b, c in sorted(term_counts(claim).items()))
+
+
+@lru_cache(maxsize=4096)
+def parse_features(raw: str) -> Dict[int, int]:
+    out: Dict[int, int] = {}
+    for item in filter(None, (raw or "").split(",")):
+        b, _, c = item.partition(":")
+        out[int(b)] = int(c)
+    return out
+
+
+def _observe(buckets: Iterable[int]):
+    global _docs
+    _docs += 1
+    for b in buckets:
+        _df[b] += 1
+
+
+def _idf(b: int) -> float:
+    return math.log((1 + _docs) / (1 + _df[b])) + 1.0
+
+
+def _weights(counts: Dict[int, int]) -> Dict[int, float]:
+    return {b: (1.0 + (_LOG_TF[c] if c < len(_LOG_TF) else math.log(c))) * _idf(b) for b, c in counts.items()}
+
+
+def _cosine(a: Dict[int, float], b: Dict[int, float]) -> float:
+    if not a or not b:
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    dot = sum(w * b.get(k, 0.0) for k, w in a.items())
+    if not dot:
+        return 0.0
+    return dot / (math.sqrt(sum(w * w for w in a.values())) * math.sqrt(sum(w * w for w in b.values())))
+
+
+def topic_score(user_msg: str, claim_counts: Dict[int, int]) -> float:
+    msg_counts = term_counts(user_msg)
+    _observe(msg_counts)
+    return _cosine(_weights(msg_counts), _weights(claim_counts))
+
+
+def score_many(messages: List[str], claim_counts: Dict[int, int]) -> List[float]:
+    """Puntúa un lote contra la misma claim (vectorizado con NumPy si está disponible)."""
+    np = _numpy()
+    if np is None or not messages:
+        return [topic_score(m, claim_counts) for m in messages]
+    per_msg = [term_counts(m) for m in messages]
+    for counts in per_msg:
+        _observe(counts)
+    vocab = sorted(set(claim_counts).union(*per_msg))
+    col = {b: i for i, b in enumerate(vocab)}
+    df = np.fromiter((_df[b] for b in vocab), dtype=np.float64, count=len(vocab))
+    idf = np.log((1 + _docs) / (1 + df)) + 1.0
+    tf = np.zeros((len(messages), len(vocab)))
+    for i, counts in enumerate(per_msg):
+        for b, c in counts.items():
+            tf[i, col[b]] = 1.0 + math.log(c)
+    claim = np.zeros(len(vocab))
+    for b, c in claim_counts.items():
+        claim[col[b]] = 1.0 + math.log(c)
+    m = tf * idf
+    q = claim * idf
+    norms = np.linalg.norm(m, axis=1) * (np.linalg.norm(q) or 1.0)
+    return list(np.divide(m @ q, norms, out=np.zeros(len(messages)), where=norms > 0))
+
+
+def is_on_topic(user_msg: str, topic: str, features: str = "") -> bool:
+    counts = parse_features(features) if features else term_counts(topic)
+    return topic_score(user_msg, counts) >= ON_TOPIC_THRESHOLD
+
 
 def ground_reply(topic_or_claim: str) -> str:
     return (
@@ -18,7 +165,8 @@ def ground_reply(topic_or_claim: str) -> str:
         "I'll address your point strictly in relation to this claim."
     )
 
-def build_prompt(topic: str, user_message: str, style: str) -> str:
+def build_prompt(topic: str, user_message: str, style: str, context: str = "") -> str:
+    history = f"{context}\n" if context else ""
     return f"""You must defend "**{topic}**" at all costs.
 
 Guidelines:
@@ -30,7 +178,7 @@ Guidelines:
 - Your argument style is: **{style}**.
 
 Conversation:
-User: {user_message}
+{history}User: {user_message}
 AI:"""
 
 _PREFIXES = [
@@ -0,0 +1,123 @@
+# app/services/reply_cache.py
+"""
+Caché de respuestas generadas + single-flight.
+
+La clave es (claim, mensaje, estilo, modelo) normalizados más un digest del
+contexto de conversación: el prompt que sale de build_prompt es determinista
+para esa tupla. Niveles:
+  1) LRU en proceso con TTL (REPLY_CACHE_SIZE / REPLY_CACHE_TTL_SECS)
+  2) opcional, compartido entre workers en Redis (REPLY_CACHE_SHARED=1); el
+     cliente es un recurso de app.core.registry: se crea en el lifespan (o en
+     el primer uso), no al importar
+Además, prompts idénticos concurrentes esperan una única llamada upstream.
+"""
+import asyncio
+import hashlib
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.core.metrics import register_stats
+from app.core.registry import resources
+from app.core.settings import settings
+
+_WS_RE = re.compile(r"\s+")
+_EDGE_PUNCT = " \t\n\"'¿?¡!.,;:"
+
+
+def _norm(text: str) -> str:
+    text = unicodedata.normalize("NFC", text).casefold()
+    return _WS_RE.sub(" ", text).strip(_EDGE_PUNCT)
+
+
+def cache_key(claim: str, message: str, style: str, model: str, context: str = "") -> str:
+    raw = "\x1f".join((_norm(claim), _norm(message), style, model, context))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class ReplyCache:
+    def __init__(self, max_entries: int, ttl_secs: int, shared: Optional[Callable[[], Any]] = None):
+        self.max_entries = max_entries
+        self.ttl_secs = ttl_secs
+        self._shared = shared  # devuelve el cliente redis.asyncio compartido (opcional)
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"hits": 0, "shared_hits": 0, "misses": 0, "coalesced": 0}
+
+    def _get_local(self, key: str) -> Optional[str]:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put_local(self, key: str, value: str):
+        self._entries[key] = (time.monotonic() + self.ttl_secs, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _produce(self, key: str, producer: Callable[[], Awaitable[str]]) -> str:
+        shared = self._shared() if self._shared else None
+        try:
+            if shared is not None:
+                value = await shared.get(f"replycache:{key}")
+                if value is not None:
+                    value = value.decode("utf-8")
+                    self.stats["shared_hits"] += 1
+                    self._put_local(key, value)
+                    return value
+            self.stats["misses"] += 1
+            value = await producer()
+            if value:
+                self._put_local(key, value)
+                if shared is not None:
+                    await shared.set(f"replycache:{key}", value, ex=self.ttl_secs)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get_or_generate(self, key: str, producer: Callable[[], Awaitable[str]]) -> str:
+        value = self._get_local(key)
+        if value is not None:
+            self.stats["hits"] += 1
+            return value
+        task = self._inflight.get(key)
+        if task is None:
+            # tarea propia: si el primer request abandona (timeout), los demás
+            # siguen esperando la misma llamada y el resultado se cachea igual
+            task = self._inflight[key] = asyncio.ensure_future(self._produce(key, producer))
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+
+def _open_shared():
+    from app.storage.redis_store import shared_client
+    return shared_client()
+
+
+async def _close_shared(_client):
+    # los pools son los de redis_store: si el store es Redis, los cierra él
+    from app.storage import backend, redis_store
+    if backend.name not in ("redis", "tiered"):
+        await redis_store.aclose()
+
+
+_shared = None
+if settings.reply_cache_size and settings.reply_cache_shared and settings.redis_url:
+    resources.register("reply_cache_shared", _open_shared, close=_close_shared)
+    _shared = partial(resources.get, "reply_cache_shared")
+
+reply_cache = ReplyCache(settings.reply_cache_size, settings.reply_cache_ttl_secs, _shared) \
+    if settings.reply_cache_size else None
+
+if reply_cache is not None:
+    register_stats("reply_cache", reply_cache.stats)
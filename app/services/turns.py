@@ -0,0 +1,204 @@
+# app/services/turns.py
+"""
+Ciclo de un turno de debate, compartido por /chat, /chat/stream y /chat/batch:
+  open_turn   -> lee meta + cola, fija la claim, arma el contexto y prepara los mensajes nuevos
+  finish_turn -> añade la respuesta del bot y hace commit (devuelve la ventana)
+open_turns / finish_turns hacen lo mismo para un lote con un solo round trip
+de lectura y otro de escritura. DebateSession mantiene el estado en memoria
+durante una sesión WebSocket y persiste cada turno en segundo plano.
+"""
+import asyncio
+import random
+from typing import List, Optional, Tuple
+
+from app.core.constants import ARGUMENT_STYLES, RESPONSE_WINDOW
+from app.core.ids import new_id
+from app.core.metrics import register_stats, stage
+from app.services.context import build_context, roll_summary, tail_size
+from app.services.llm import canned_reply
+from app.services.nlp import (
+    extract_topic_from_seed, is_on_topic, ground_reply, parse_topic_and_stance, claim_features,
+)
+from app.storage.backend import store
+
+
+class Turn:
+    __slots__ = ("cid", "topic", "claim", "style", "tail", "new_msgs", "new_meta", "context")
+
+    def __init__(self, cid: str, topic: str, claim: str, tail: List[dict],
+                 new_msgs: List[dict], new_meta: Optional[dict], context: str = ""):
+        self.cid = cid
+        self.topic = topic
+        self.claim = claim
+        self.style = random.choice(ARGUMENT_STYLES)
+        self.tail = tail
+        self.new_msgs = new_msgs  # solo lo nuevo de este turno se persiste (append)
+        self.new_meta = new_meta
+        self.context = context  # historial resumido para el prompt
+
+    @property
+    def preview(self) -> List[dict]:
+        """Ventana de respuesta antes de la réplica del bot."""
+        return (self.tail + self.new_msgs)[-RESPONSE_WINDOW:]
+
+
+def new_conversation_id() -> str:
+    # único entre workers y ordenado por tiempo (app.core.ids)
+    return new_id()
+
+
+async def open_turn(cid: str, message: str) -> Turn:
+    # solo leemos la cola que necesita el contexto + la meta (en paralelo)
+    meta, tail = await asyncio.gather(
+        store.load_meta_async(cid),
+        store.load_tail_async(cid, tail_size()),
+    )
+    return await build_turn(cid, message, meta, tail)
+
+
+async def open_turns(requests: List[Tuple[str, str]]) -> List[Turn]:
+    """[(cid, mensaje)] -> turnos, leyendo todas las conversaciones de una vez."""
+    loaded = await store.load_many_async([cid for cid, _ in requests], tail_size())
+    return list(await asyncio.gather(*[
+        build_turn(cid, message, meta, tail) for (cid, message), (meta, tail) in zip(requests, loaded)
+    ]))
+
+
+async def build_turn(cid: str, message: str, meta: dict, tail: List[dict]) -> Turn:
+    new_msgs = []
+    new_meta = None
+
+    if not tail:
+        with stage("nlp"):
+            topic, stance = parse_topic_and_stance(message)
+            # features de la claim: se calculan una vez y viajan con la meta
+            new_meta = {"topic": topic, "stance": stance, "features": claim_features(stance)}
+        new_msgs.append({"role": "bot", "message": f"I will prove that {stance}!"})
+    else:
+        stance = (meta.get("stance") or "").strip()
+        if not stance:
+            # conversaciones sin meta: la postura sale de la semilla
+            seed = await store.load_seed_async(cid) or tail[0]
+            stance = extract_topic_from_seed(seed["message"])
+            topic = stance
+        else:
+            topic = meta.get("topic", stance)
+        with stage("context"):
+            new_meta = roll_summary(meta, tail)  # solo si la ventana se desplazó
+
+    with stage("context"):
+        summary = (new_meta or meta).get("summary") or ""
+        context = build_context(summary, tail)
+
+    new_msgs.append({"role": "user", "message": message})
+
+    features = (new_meta or {}).get("features") or meta.get("features") or ""
+    with stage("nlp"):
+        on_topic = is_on_topic(message, stance, features)
+    if not on_topic:
+        new_msgs.append({"role": "bot", "message": ground_reply(stance)})
+
+    return Turn(cid, topic, stance, tail, new_msgs, new_meta, context)
+
+
+def _add_reply(turn: Turn, bot_msg: str):
+    # una respuesta vacía no se guarda: rompería la validación de cualquier
+    # ventana posterior de esa conversación (ChatMessage.message, min_length=1)
+    turn.new_msgs.append({"role": "bot", "message": bot_msg.strip() or canned_reply(turn.claim)})
+
+
+async def finish_turn(turn: Turn, bot_msg: str) -> List[dict]:
+    _add_reply(turn, bot_msg)
+    # un solo commit: meta (1er turno / resumen) + append + cola actualizada
+    window, _ = await store.commit_turn_async(turn.cid, turn.new_msgs, tail_size(), meta=turn.new_meta)
+    return window[-RESPONSE_WINDOW:]
+
+
+async def finish_turns(turns: List[Turn], bot_msgs: List[str]) -> List[List[dict]]:
+    for turn, bot_msg in zip(turns, bot_msgs):
+        _add_reply(turn, bot_msg)
+    out = await store.commit_many_async([(t.cid, t.new_msgs, t.new_meta) for t in turns], tail_size())
+    return [window[-RESPONSE_WINDOW:] for window, _ in out]
+
+
+# Persistencia de las sesiones WebSocket: reintentos con backoff antes de dar
+# el turno por perdido (el store no es idempotente: un reintento tras un
+# error de red con la escritura ya aplicada puede duplicar el turno)
+_WRITE_ATTEMPTS = 3
+_WRITE_BACKOFF_SECS = 0.2
+
+session_stats = {"write_retries": 0, "write_failures": 0}
+register_stats("sessions", session_stats)
+
+
+class DebateSession:
+    """
+    Conversación residente durante una sesión WebSocket: la meta (claim,
+    features, resumen) y la cola se leen una vez al abrir y luego viven en
+    memoria. Cada turno se persiste write-behind (commit = append) por una
+    tarea en segundo plano que respeta el orden de los turnos.
+    """
+
+    def __init__(self, cid: str, meta: dict, tail: List[dict]):
+        self.cid = cid
+        self.meta = meta
+        self.tail = tail
+        self._writes: "asyncio.Queue" = asyncio.Queue()
+        self._writer: Optional[asyncio.Task] = None
+        self._unwritten = 0  # mensajes encolados aún no confirmados por el store
+        self.failed: Optional[Exception] = None  # un turno no se pudo persistir: la sesión ya no es fiable
+
+    @classmethod
+    async def open(cls, cid: Optional[str]) -> "DebateSession":
+        if not cid:
+            return cls(new_conversation_id(), {}, [])
+        meta, tail = await asyncio.gather(store.load_meta_async(cid), store.load_tail_async(cid, tail_size()))
+        return cls(cid, meta, tail)
+
+    async def begin(self, message: str) -> Turn:
+        return await build_turn(self.cid, message, self.meta, self.tail)
+
+    def complete(self, turn: Turn, bot_msg: str) -> List[dict]:
+        _add_reply(turn, bot_msg)
+        self.tail = (self.tail + turn.new_msgs)[-tail_size():]
+        if turn.new_meta:
+            self.meta.update(turn.new_meta)
+        if "v" in self.meta:
+            self.meta["v"] += len(turn.new_msgs)
+        self._unwritten += len(turn.new_msgs)
+        self._writes.put_nowait((turn.new_msgs, turn.new_meta))
+        if self._writer is None:
+            self._writer = asyncio.ensure_future(self._write_behind())
+        return self.tail[-RESPONSE_WINDOW:]
+
+    async def _commit(self, msgs: List[dict], meta: Optional[dict]) -> int:
+        for attempt in range(_WRITE_ATTEMPTS):
+            try:
+                _, version = await store.commit_turn_async(self.cid, msgs, tail_size(), meta=meta)
+                return version
+            except Exception:
+                if attempt + 1 == _WRITE_ATTEMPTS:
+                    raise
+                session_stats["write_retries"] += 1
+                await asyncio.sleep(_WRITE_BACKOFF_SECS * 2 ** attempt)
+
+    async def _write_behind(self):
+        while True:
+            msgs, meta = await self._writes.get()
+            try:
+                if self.failed is None:  # tras un fallo no se escriben turnos posteriores (habría un hueco)
+                    version = await self._commit(msgs, meta)
+                    if "v" not in self.meta:
+                        self.meta["v"] = version + self._unwritten - len(msgs)
+            except Exception as e:
+                session_stats["write_failures"] += 1
+                self.failed = e
+            finally:
+                self._unwritten -= len(msgs)
+                self._writes.task_done()
+
+    async def close(self):
+        """Espera a que se persistan los turnos pendientes."""
+        if self._writer is not None:
+            await self._writes.join()
+            self._writer.cancel()
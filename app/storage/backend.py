@@ -0,0 +1,103 @@
+# app/storage/backend.py
+"""
+Selección del backend de persistencia (Redis > Firestore > SQLite > memoria).
+Con TIERED_STORE=1 y ambos disponibles: Redis caliente + Firestore frío
+(app.storage.tiered).
+
+Cada backend es un módulo con la misma API async:
+  load_tail_async(cid, n)       -> últimos n mensajes (lo único que lee /chat)
+  load_seed_async(cid)          -> primer mensaje (fallback si no hay meta)
+  append_messages_async(cid, m) -> añade los mensajes nuevos del turno
+  commit_turn_async(cid, m, n, meta=None)
+                                -> (últimos n, versión): meta opcional + append (atómico en Redis)
+  load_many_async(cids, n)      -> [(meta, cola)] de varias conversaciones (un pipeline)
+  commit_many_async([(cid, m, meta)], n) -> commit_turn de varias conversaciones (un pipeline)
+  load_meta_async / save_meta_async
+  load_version_async(cid)       -> solo meta.v (o None); la usa la caché L1
+  load_conversation_async / save_conversation_async (historial completo)
+  scan_ids_async(start, end)    -> ids creados en [start, end] (epoch s), ordenados
+Las funciones sync originales se mantienen en cada módulo para scripts y tests.
+
+Nada se elige ni se importa al importar este módulo: el store se construye
+en el lifespan (app.core.registry, recurso "store") o en el primer uso.
+`store` es un proxy que delega en él; `name` queda fijado al construirlo.
+"""
+from typing import Optional
+
+from app.core import deps
+from app.core.metrics import layer_stats, register_stats
+from app.core.registry import resources
+from app.core.settings import settings
+
+name: Optional[str] = None
+
+
+def _build():
+    global name
+    firebase_enabled = deps.firebase_configured() and deps.firebase() is not None
+    if settings.redis_url and firebase_enabled and settings.tiered_store:
+        from app.storage import redis_store, firestore
+        from app.storage.tiered import TieredStore
+        store = TieredStore(redis_store, firestore, settings.archive_idle_secs,
+                            settings.archive_interval_secs, settings.archive_batch)
+        name = "tiered"
+    elif settings.redis_url:
+        from app.storage import redis_store as store
+        name = "redis"
+    elif firebase_enabled:
+        from app.storage import firestore as store
+        name = "firestore"
+    elif settings.sqlite_path:  # disco local compartido por los workers de la máquina
+        from app.storage import sqlite_store as store
+        name = "sqlite"
+    else:
+        from app.storage import memory as store
+        name = "memory"
+
+    # Caché L1 opcional (no tiene sentido sobre el backend en memoria)
+    if settings.l1_cache_size and name != "memory":
+        from app.storage.cache import CachedStore
+        store = CachedStore(store, settings.l1_cache_size, settings.l1_cache_ttl_secs)
+
+    # Write-behind opcional: el commit del turno sale del camino crítico
+    if settings.write_behind:
+        from app.storage.write_behind import WriteBehindStore
+        store = WriteBehindStore(store, settings.write_behind_max_pending, settings.write_behind_interval_ms)
+
+    # Medición por operación (Server-Timing / METRICS_ENABLED); sin coste si ambos están apagados
+    if settings.server_timing or settings.metrics_enabled:
+        from app.storage.instrumented import InstrumentedStore
+        store = InstrumentedStore(store, name)
+    return store
+
+
+async def _warm(store):
+    if hasattr(store, "start"):  # write-behind / tiering: tareas en segundo plano
+        store.start()
+    if hasattr(store, "ping_async"):  # Redis: abre las conexiones ya
+        await store.ping_async()
+
+
+async def _close(store):
+    if hasattr(store, "aclose"):  # vuelca lo pendiente y cierra pools
+        await store.aclose()
+
+
+resources.register("store", _build, warm=_warm, close=_close)
+
+
+def current():
+    """El store real (lo construye si hace falta)."""
+    return resources.get("store")
+
+
+class _StoreProxy:
+    """Resuelve el store del registro en cada acceso (los tests pueden parchear atributos)."""
+
+    def __getattr__(self, attr):
+        return getattr(current(), attr)
+
+
+store = _StoreProxy()
+
+register_stats("store", lambda: layer_stats(resources.peek("store")))
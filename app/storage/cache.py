@@ -0,0 +1,171 @@
+# app/storage/cache.py
+"""
+Caché L1 en proceso delante de Redis/Firestore.
+
+Guarda por conversación la meta (topic/stance, resumen del contexto) y la
+última ventana de mensajes devuelta por commit_turn, junto con su versión
+(meta "v"). La escritura es write-through: cada commit_turn refresca la
+entrada con lo que devuelve el backend, que es la fuente de verdad.
+
+Antes de servir una entrada se compara su versión con la del backend
+(load_version_async: un HGET en Redis); las lecturas concurrentes de un
+mismo turno (meta + cola) comparten esa comprobación. Si otro worker avanzó
+la conversación, la entrada se descarta y se lee del backend. Así un turno
+cuesta un round trip pequeño en vez de dos lecturas completas y nunca se
+sirve un resumen o una versión antiguos.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+
+class _Entry:
+    __slots__ = ("meta", "tail", "complete", "version", "expires", "check")
+
+    def __init__(self, expires: float):
+        self.meta: Optional[dict] = None
+        self.tail: Optional[List[dict]] = None
+        self.complete = False  # True si `tail` es la conversación entera
+        self.version: Optional[int] = None
+        self.expires = expires
+        self.check: Optional[asyncio.Future] = None  # comprobación de versión en curso
+
+
+class CachedStore:
+    """Envuelve un módulo backend con la API async de app.storage.backend."""
+
+    def __init__(self, inner, max_entries: int, ttl_secs: int):
+        self.inner = inner
+        self.max_entries = max_entries
+        self.ttl_secs = ttl_secs
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0}
+
+    def __getattr__(self, name):
+        # el resto de la API (load_conversation_async, load_seed_async, ...) pasa directo
+        return getattr(self.inner, name)
+
+    def _get(self, cid: str) -> Optional[_Entry]:
+        entry = self._entries.get(cid)
+        if entry is None:
+            return None
+        if entry.expires < time.monotonic():
+            del self._entries[cid]
+            return None
+        self._entries.move_to_end(cid)
+        return entry
+
+    def _put(self, cid: str) -> _Entry:
+        entry = self._get(cid)
+        if entry is None:
+            entry = self._entries[cid] = _Entry(time.monotonic() + self.ttl_secs)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, cid: str):
+        self._entries.pop(cid, None)
+
+    async def _version(self, cid: str) -> Optional[int]:
+        if hasattr(self.inner, "load_version_async"):
+            return await self.inner.load_version_async(cid)
+        return (await self.inner.load_meta_async(cid)).get("v")
+
+    async def _fresh(self, cid: str) -> Optional[_Entry]:
+        """La entrada si su versión coincide con la del backend; si no, se descarta."""
+        entry = self._get(cid)
+        if entry is None or entry.version is None:
+            return None
+        if entry.check is None:
+            entry.check = asyncio.ensure_future(self._version(cid))
+            entry.check.add_done_callback(lambda _: setattr(entry, "check", None))
+        version = await asyncio.shield(entry.check)
+        if version == entry.version:
+            return entry
+        if self._entries.get(cid) is entry:  # las lecturas que compartían la comprobación cuentan una vez
+            self.stats["stale"] += 1
+            self.invalidate(cid)
+        return None
+
+    def _seed_meta(self, cid: str, meta: dict):
+        if meta.get("v") is None:  # conversación nueva: nada que cachear
+            return
+        entry = self._put(cid)
+        if entry.version != meta["v"]:
+            entry.tail, entry.complete = None, False
+        entry.meta, entry.version = dict(meta), meta["v"]
+
+    async def load_meta_async(self, cid: str) -> dict:
+        entry = await self._fresh(cid)
+        if entry and entry.meta is not None:
+            self.stats["hits"] += 1
+            return dict(entry.meta, v=entry.version)
+        self.stats["misses"] += 1
+        meta = await self.inner.load_meta_async(cid)
+        self._seed_meta(cid, meta)
+        return meta
+
+    async def load_tail_async(self, cid: str, n: int) -> List[dict]:
+        entry = await self._fresh(cid)
+        if entry and entry.tail is not None and (entry.complete or len(entry.tail) >= n):
+            self.stats["hits"] += 1
+            return entry.tail[-n:]
+        self.stats["misses"] += 1
+        return await self.inner.load_tail_async(cid, n)
+
+    async def save_meta_async(self, cid: str, topic: str, stance: str):
+        # no cambia la versión: la entrada se actualiza solo si ya tenía la meta completa
+        await self.inner.save_meta_async(cid, topic, stance)
+        entry = self._get(cid)
+        if entry is not None and entry.meta is not None:
+            entry.meta.update(topic=topic, stance=stance)
+
+    async def append_messages_async(self, cid: str, msgs: List[dict]):
+        # sin versión devuelta no se puede mantener la ventana: se invalida
+        await self.inner.append_messages_async(cid, msgs)
+        self.invalidate(cid)
+
+    async def save_conversation_async(self, cid: str, msgs: List[dict]):
+        await self.inner.save_conversation_async(cid, msgs)
+        self.invalidate(cid)
+
+    async def load_many_async(self, cids: List[str], n: int) -> List[Tuple[dict, List[dict]]]:
+        # el lote ya es un único round trip: se lee del backend y se siembra la caché
+        out = await self.inner.load_many_async(cids, n)
+        for cid, (meta, _) in zip(cids, out):
+            self._seed_meta(cid, meta)
+        return out
+
+    async def commit_many_async(
+        self, turns: List[Tuple[str, List[dict], Optional[dict]]], n: int
+    ) -> List[Tuple[List[dict], int]]:
+        out = await self.inner.commit_many_async(turns, n)
+        for (cid, msgs, meta), (window, version) in zip(turns, out):
+            self._remember(cid, msgs, n, meta, window, version)
+        return out
+
+    async def commit_turn_async(
+        self, cid: str, msgs: List[dict], n: int, meta: Optional[dict] = None
+    ) -> Tuple[List[dict], int]:
+        window, version = await self.inner.commit_turn_async(cid, msgs, n, meta=meta)
+        self._remember(cid, msgs, n, meta, window, version)
+        return window, version
+
+    def _remember(self, cid: str, msgs: List[dict], n: int, meta: Optional[dict],
+                  window: List[dict], version: int):
+        entry = self._put(cid)
+        if entry.version is not None and version != entry.version + len(msgs):
+            # otro worker escribió entretanto: su resumen/meta no los conocemos
+            self.stats["stale"] += 1
+            entry.meta = None
+        if version == len(msgs):  # conversación nueva: la meta del commit es toda la meta
+            entry.meta = dict(meta or {})
+        elif meta and entry.meta is not None:
+            entry.meta.update(meta)
+        if entry.meta is not None:
+            entry.meta.setdefault("topic", "")
+            entry.meta.setdefault("stance", "")
+        entry.tail = list(window)
+        entry.complete = len(window) < n or version == len(window)
+        entry.version = version
@@ -0,0 +1,65 @@
+# app/storage/codec.py
+"""
+Codificación compacta de mensajes para Redis.
+
+Formato v1 (binario):
+    byte 0   = cabecera: 0b0000_VVVR -> versión (bits 1-3) | rol (bit 0: 1 = bot)
+               + 0x10 si el cuerpo va comprimido con zlib, 0x20 si con zstd
+    bytes 1+ = mensaje en UTF-8 (comprimido si supera REDIS_COMPRESS_MIN y compensa)
+
+Las entradas legacy (JSON {"role", "message"}) empiezan por '{' (0x7b), un
+valor que la cabecera v1 nunca toma, así que se leen de forma transparente.
+"""
+import json
+import zlib
+from typing import Union
+
+from app.core.settings import settings
+
+try:
+    import zstandard  # opcional: mejor ratio/velocidad que zlib
+    _zc = zstandard.ZstdCompressor(level=3)
+    _zd = zstandard.ZstdDecompressor()
+except Exception:
+    zstandard = None
+
+_V1 = 0x02
+_BOT = 0x01
+_ZLIB = 0x10
+_ZSTD = 0x20
+_LEGACY = ord("{")
+
+
+def encode(msg: dict) -> bytes:
+    if settings.redis_codec == "json":
+        return json.dumps(msg).encode("utf-8")
+    body = msg["message"].encode("utf-8")
+    head = _V1 | (_BOT if msg["role"] == "bot" else 0)
+    if settings.redis_compress_min and len(body) >= settings.redis_compress_min:
+        if zstandard is not None:
+            packed, flag = _zc.compress(body), _ZSTD
+        else:
+            packed, flag = zlib.compress(body, 6), _ZLIB
+        if len(packed) < len(body):
+            body, head = packed, head | flag
+    return bytes((head,)) + body
+
+
+def decode(raw: Union[bytes, str]) -> dict:
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    head = raw[0]
+    if head == _LEGACY:
+        return json.loads(raw)
+    body = raw[1:]
+    if head & _ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstd-compressed message but 'zstandard' is not installed")
+        body = _zd.decompress(body)
+    elif head & _ZLIB:
+        body = zlib.decompress(body)
+    return {"role": "bot" if head & _BOT else "user", "message": body.decode("utf-8")}
+
+
+def is_legacy(raw: Union[bytes, str]) -> bool:
+    return bool(raw) and (raw[0] == _LEGACY if isinstance(raw, bytes) else raw.startswith("{"))
@@ -1,19 +1,268 @@
-from typing import List
-from app.core.deps import db
+import asyncio
+import time
+from typing import List, Optional, Tuple
+from app.core import deps
+from app.core.ids import id_bounds
+from app.storage.codec import decode, encode
 from app.core.settings import settings
 
+# Layout:
+#   conversations/{cid}                 -> doc con la meta {topic, stance} (+ array legacy "messages")
+#   conversations/{cid}/messages/{auto} -> un doc por mensaje {role, message, seq}
+# Los turnos nuevos solo añaden docs a la subcolección (escritura O(1) por turno)
+# y las lecturas del turno son acotadas (limit_to_last).
+# HISTORY_SOFT_LIMIT: la meta lleva "v" (mensajes añadidos) y "trimmed"
+# (mensajes borrados); al pasar del límite se borran los docs más antiguos
+# por seq en un batch aparte, solo en los turnos que lo superan.
+
 def _truncate(msgs: List[dict]) -> List[dict]:
     if len(msgs) > settings.history_soft_limit:
         return msgs[-settings.history_soft_limit:]
     return msgs
 
-def save_conversation(cid: str, msgs: List[dict]):
-    if db is None:
+# Cliente y módulo del SDK se resuelven al primer uso (app.core.deps.firebase)
+def _sdk():
+    fb = deps.firebase()
+    if fb is None:
         raise RuntimeError("Firestore not initialized")
-    db.collection("conversations").document(cid).set({"messages": _truncate(msgs)})
+    return fb
+
+def _require_db():
+    return _sdk()[0]
+
+def _fs():
+    return _sdk()[2]  # módulo firestore del SDK (Increment, SERVER_TIMESTAMP, FieldPath)
+
+def _require_adb():
+    adb = _sdk()[1]
+    if adb is None:
+        raise RuntimeError("Firestore AsyncClient not initialized")
+    return adb
+
+def _records(msgs: List[dict]) -> List[dict]:
+    # seq = reloj en ns + índice: ordena dentro del turno y entre turnos
+    base = time.time_ns()
+    return [{"role": m["role"], "message": m["message"], "seq": base + i} for i, m in enumerate(msgs)]
+
+def _strip(d: dict) -> dict:
+    return {"role": d.get("role"), "message": d.get("message")}
+
+def _doc_data(doc) -> dict:
+    return (doc.to_dict() or {}) if getattr(doc, "exists", False) else {}
+
+def _meta_from(data: dict) -> dict:
+    meta = {k: v for k, v in data.items() if k not in ("messages", "trimmed")}  # sin el array legacy
+    meta.setdefault("topic", "")
+    meta.setdefault("stance", "")
+    return meta
+
+def _tail_from(legacy: List[dict], appended: List[dict], n: int) -> List[dict]:
+    if len(appended) >= n:
+        return appended[-n:]
+    return (legacy + appended)[-n:]
+
+_TRIM_BATCH = 400  # borrados por pasada (un batch admite 500 escrituras)
+
+def _overflow(data: dict) -> int:
+    limit = settings.history_soft_limit
+    if not limit:
+        return 0
+    return min(_TRIM_BATCH, max(0, int(data.get("v", 0)) - int(data.get("trimmed", 0)) - limit))
+
+def _fill_trim_batch(batch, ref, old_docs, extra: int):
+    for d in old_docs:
+        batch.delete(d.reference)
+    # se cuenta `extra` aunque hubiera menos docs: resincroniza si el contador iba por detrás
+    batch.set(ref, {"trimmed": _fs().Increment(extra)}, merge=True)
+
+def _trim(client, ref, data: dict):
+    extra = _overflow(data)
+    if extra:
+        batch = client.batch()
+        _fill_trim_batch(batch, ref, ref.collection("messages").order_by("seq").limit(extra).get(), extra)
+        batch.commit()
+
+async def _trim_async(client, ref, data: dict):
+    extra = _overflow(data)
+    if extra:
+        batch = client.batch()
+        _fill_trim_batch(batch, ref, await ref.collection("messages").order_by("seq").limit(extra).get(), extra)
+        await batch.commit()
+
+def save_conversation(cid: str, msgs: List[dict]):
+    _require_db().collection("conversations").document(cid).set({"messages": _truncate(msgs)}, merge=True)
 
 def load_conversation(cid: str) -> List[dict]:
-    if db is None:
-        raise RuntimeError("Firestore not initialized")
-    doc = db.collection("conversations").document(cid).get()
-    return (doc.to_dict() or {}).get("messages", []) if getattr(doc, "exists", False) else []
+    ref = _require_db().collection("conversations").document(cid)
+    legacy = _doc_data(ref.get()).get("messages", [])
+    appended = [_strip(d.to_dict()) for d in ref.collection("messages").order_by("seq").stream()]
+    return _truncate(legacy + appended)
+
+def load_tail(cid: str, n: int) -> List[dict]:
+    ref = _require_db().collection("conversations").document(cid)
+    appended = [_strip(d.to_dict()) for d in ref.collection("messages").order_by("seq").limit_to_last(n).get()]
+    if len(appended) >= n:
+        return appended
+    return _tail_from(_doc_data(ref.get()).get("messages", []), appended, n)
+
+def load_seed(cid: str) -> Optional[dict]:
+    ref = _require_db().collection("conversations").document(cid)
+    legacy = _doc_data(ref.get()).get("messages", [])
+    if legacy:
+        return legacy[0]
+    first = list(ref.collection("messages").order_by("seq").limit(1).stream())
+    return _strip(first[0].to_dict()) if first else None
+
+def append_messages(cid: str, msgs: List[dict]):
+    if msgs:
+        commit_turn(cid, msgs, 0)
+
+def _fill_commit_batch(batch, ref, msgs: List[dict], meta: Optional[dict]):
+    # meta + versión + mensajes en un único batch
+    batch.set(ref, {**(meta or {}), "v": _fs().Increment(len(msgs))}, merge=True)
+    for rec in _records(msgs):
+        batch.set(ref.collection("messages").document(), rec)
+
+def commit_turn(cid: str, msgs: List[dict], n: int, meta: Optional[dict] = None) -> Tuple[List[dict], int]:
+    client = _require_db()
+    ref = client.collection("conversations").document(cid)
+    batch = client.batch()
+    _fill_commit_batch(batch, ref, msgs, meta)
+    batch.commit()
+    # la cola y la versión se releen después (lecturas acotadas)
+    data = _doc_data(ref.get())
+    _trim(client, ref, data)
+    return (load_tail(cid, n) if n else []), int(data.get("v", 0))
+
+def save_meta(cid: str, topic: str, stance: str):
+    _require_db().collection("conversations").document(cid).set({"topic": topic, "stance": stance}, merge=True)
+
+def load_meta(cid: str) -> dict:
+    return _meta_from(_doc_data(_require_db().collection("conversations").document(cid).get()))
+
+# ---- API async (AsyncClient) ----
+
+async def save_conversation_async(cid: str, msgs: List[dict]):
+    await _require_adb().collection("conversations").document(cid).set({"messages": _truncate(msgs)}, merge=True)
+
+async def load_conversation_async(cid: str) -> List[dict]:
+    ref = _require_adb().collection("conversations").document(cid)
+    legacy = _doc_data(await ref.get()).get("messages", [])
+    appended = [_strip(d.to_dict()) async for d in ref.collection("messages").order_by("seq").stream()]
+    return _truncate(legacy + appended)
+
+async def load_tail_async(cid: str, n: int) -> List[dict]:
+    ref = _require_adb().collection("conversations").document(cid)
+    docs = await ref.collection("messages").order_by("seq").limit_to_last(n).get()
+    appended = [_strip(d.to_dict()) for d in docs]
+    if len(appended) >= n:
+        return appended
+    return _tail_from(_doc_data(await ref.get()).get("messages", []), appended, n)
+
+async def load_seed_async(cid: str) -> Optional[dict]:
+    ref = _require_adb().collection("conversations").document(cid)
+    legacy = _doc_data(await ref.get()).get("messages", [])
+    if legacy:
+        return legacy[0]
+    first = [d async for d in ref.collection("messages").order_by("seq").limit(1).stream()]
+    return _strip(first[0].to_dict()) if first else None
+
+async def append_messages_async(cid: str, msgs: List[dict]):
+    if msgs:
+        await commit_turn_async(cid, msgs, 0)
+
+async def commit_turn_async(cid: str, msgs: List[dict], n: int, meta: Optional[dict] = None) -> Tuple[List[dict], int]:
+    client = _require_adb()
+    ref = client.collection("conversations").document(cid)
+    batch = client.batch()
+    _fill_commit_batch(batch, ref, msgs, meta)
+    await batch.commit()
+    window, doc = await asyncio.gather(load_tail_async(cid, n) if n else asyncio.sleep(0, []), ref.get())
+    data = _doc_data(doc)
+    await _trim_async(client, ref, data)
+    return window, int(data.get("v", 0))
+
+async def save_meta_async(cid: str, topic: str, stance: str):
+    await _require_adb().collection("conversations").document(cid).set({"topic": topic, "stance": stance}, merge=True)
+
+async def load_meta_async(cid: str) -> dict:
+    return _meta_from(_doc_data(await _require_adb().collection("conversations").document(cid).get()))
+
+async def load_version_async(cid: str) -> Optional[int]:
+    v = _doc_data(await _require_adb().collection("conversations").document(cid).get()).get("v")
+    return int(v) if v is not None else None
+
+async def load_many_async(cids: List[str], n: int) -> List[Tuple[dict, List[dict]]]:
+    # Firestore no tiene pipeline: las lecturas van en paralelo
+    metas, tails = await asyncio.gather(
+        asyncio.gather(*[load_meta_async(cid) for cid in cids]),
+        asyncio.gather(*[load_tail_async(cid, n) for cid in cids]),
+    )
+    return list(zip(metas, tails))
+
+async def commit_many_async(turns: List[Tuple[str, List[dict], Optional[dict]]], n: int) -> List[Tuple[List[dict], int]]:
+    client = _require_adb()
+    batch = client.batch()  # todas las escrituras del lote en un único commit
+    refs = []
+    for cid, msgs, meta in turns:
+        ref = client.collection("conversations").document(cid)
+        _fill_commit_batch(batch, ref, msgs, meta)
+        refs.append(ref)
+    await batch.commit()
+    windows, docs = await asyncio.gather(
+        asyncio.gather(*[load_tail_async(cid, n) for cid, _, _ in turns]),
+        asyncio.gather(*[ref.get() for ref in refs]),
+    )
+    datas = [_doc_data(d) for d in docs]
+    await asyncio.gather(*(_trim_async(client, ref, data) for ref, data in zip(refs, datas)))
+    return [(w, int(data.get("v", 0))) for w, data in zip(windows, datas)]
+
+# ---- Rango temporal: los ids (app.core.ids) ordenan por creación ----
+
+async def scan_ids_async(start: float, end: float) -> List[str]:
+    lo, hi = id_bounds(start, end)
+    col = _require_adb().collection("conversations")
+    key = _fs().FieldPath.document_id()
+    query = col.where(key, ">=", col.document(lo)).where(key, "<", col.document(hi)).select([])
+    return [doc.id async for doc in query.stream()]
+
+# ---- Archivo frío (app.storage.tiered) ----
+# archived/{cid} -> {meta..., messages: [registros app.storage.codec], archived_at}
+# Un doc por conversación: una escritura al archivar y una lectura al rehidratar.
+
+_ARCHIVE_BATCH = 500  # máx. de escrituras por batch en Firestore
+
+async def archive_many_async(items: List[Tuple[str, dict, List[dict]]]):
+    client = _require_adb()
+    col = client.collection("archived")
+    for i in range(0, len(items), _ARCHIVE_BATCH):
+        batch = client.batch()
+        for cid, meta, msgs in items[i:i + _ARCHIVE_BATCH]:
+            batch.set(col.document(cid), {
+                **meta,
+                "messages": [encode(m) for m in _truncate(msgs)],
+                "archived_at": _fs().SERVER_TIMESTAMP,
+            })
+        await batch.commit()
+
+async def load_archive_async(cid: str) -> Optional[Tuple[dict, List[dict]]]:
+    data = _doc_data(await _require_adb().collection("archived").document(cid).get())
+    if not data:
+        return None
+    msgs = [decode(x) for x in data.pop("messages", [])]
+    data.pop("archived_at", None)
+    return _meta_from(data), msgs
+
+async def delete_archive_async(cid: str):
+    await _require_adb().collection("archived").document(cid).delete()
+
+# ---- Ciclo de vida (app.core.registry) ----
+
+async def aclose():
+    """Cierra los canales del cliente async (fin del lifespan)."""
+    adb = _sdk()[1]
+    close = getattr(adb, "close", None)
+    if close is not None:
+        result = close()
+        if asyncio.iscoroutine(result):
+            await result
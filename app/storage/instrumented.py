@@ -0,0 +1,29 @@
+# app/storage/instrumented.py
+"""
+Mide cada llamada async al backend (stage = operación, backend = nombre) para
+el Server-Timing y los histogramas de app.core.metrics. Va por fuera de todas
+las capas: mide lo que ve el turno, con aciertos de caché incluidos.
+"""
+import functools
+
+from app.core.metrics import stage
+
+
+class InstrumentedStore:
+    def __init__(self, inner, backend: str):
+        self.inner = inner
+        self.backend = backend
+
+    def __getattr__(self, name):
+        attr = getattr(self.inner, name)
+        if not (name.endswith("_async") and callable(attr)):
+            return attr
+        op = name[:-len("_async")]
+
+        @functools.wraps(attr)
+        async def timed(*args, **kwargs):
+            with stage(op, self.backend):
+                return await attr(*args, **kwargs)
+
+        setattr(self, name, timed)  # se envuelve una sola vez
+        return timed
@@ -1,15 +1,199 @@
-from typing import Dict, List
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Tuple
+from app.core.ids import id_bounds
 from app.core.settings import settings
 
-_memory_store: Dict[str, List[dict]] = {}
+# Store en proceso acotado:
+#   - LRU por conversación (OrderedDict: la más antigua primero)
+#   - TTL por inactividad (MEMORY_TTL_SECS)
+#   - tope de conversaciones (MEMORY_MAX_CONVERSATIONS) y de bytes aprox. (MEMORY_MAX_BYTES)
+# Cada mensaje se guarda como un registro con __slots__ y el rol como flag,
+# en lugar de un dict {"role": ..., "message": ...}.
 
-def _truncate(msgs: List[dict]) -> List[dict]:
-    if len(msgs) > settings.history_soft_limit:
-        return msgs[-settings.history_soft_limit:]
-    return msgs
+_MSG_OVERHEAD = 64  # bytes aprox. por registro (objeto + slot + nodo del deque)
+
+class _Msg:
+    __slots__ = ("bot", "message")
+
+    def __init__(self, role: str, message: str):
+        self.bot = role == "bot"
+        self.message = message
+
+    def as_dict(self) -> dict:
+        return {"role": "bot" if self.bot else "user", "message": self.message}
+
+    def size(self) -> int:
+        return _MSG_OVERHEAD + len(self.message)
+
+class _Conv:
+    __slots__ = ("msgs", "meta", "nbytes", "touched", "version")
+
+    def __init__(self):
+        self.msgs: Deque[_Msg] = deque()
+        self.meta: dict = {}
+        self.nbytes = 0
+        self.version = 0  # nº de mensajes añadidos (no baja al recortar)
+        self.touched = time.monotonic()
+
+_memory_store: "OrderedDict[str, _Conv]" = OrderedDict()
+_total_bytes = 0
+_lock = threading.Lock()  # las funciones sync pueden llamarse desde hilos
+
+def _expired(conv: _Conv, now: float) -> bool:
+    return bool(settings.memory_ttl_secs) and now - conv.touched > settings.memory_ttl_secs
+
+def _drop(cid: str):
+    global _total_bytes
+    conv = _memory_store.pop(cid, None)
+    if conv is not None:
+        _total_bytes -= conv.nbytes
+
+def _evict(now: float):
+    # la cabeza del OrderedDict es la menos usada: se expulsa mientras
+    # esté caducada o se superen los límites
+    while _memory_store:
+        cid, conv = next(iter(_memory_store.items()))
+        over = (
+            (settings.memory_max_conversations and len(_memory_store) > settings.memory_max_conversations)
+            or (settings.memory_max_bytes and _total_bytes > settings.memory_max_bytes)
+        )
+        if not over and not _expired(conv, now):
+            break
+        _drop(cid)
+
+def _get(cid: str) -> Optional[_Conv]:
+    conv = _memory_store.get(cid)
+    if conv is None:
+        return None
+    now = time.monotonic()
+    if _expired(conv, now):
+        _drop(cid)
+        return None
+    conv.touched = now
+    _memory_store.move_to_end(cid)
+    return conv
+
+def _get_or_create(cid: str) -> _Conv:
+    conv = _get(cid)
+    if conv is None:
+        conv = _memory_store[cid] = _Conv()
+    return conv
+
+def _extend(conv: _Conv, msgs: List[dict]):
+    global _total_bytes
+    conv.version += len(msgs)
+    for m in msgs:
+        rec = _Msg(m["role"], m["message"])
+        conv.msgs.append(rec)
+        conv.nbytes += rec.size()
+        _total_bytes += rec.size()
+    limit = settings.history_soft_limit
+    while limit and len(conv.msgs) > limit:
+        old = conv.msgs.popleft()
+        conv.nbytes -= old.size()
+        _total_bytes -= old.size()
 
 def save_conversation(cid: str, msgs: List[dict]):
-    _memory_store[cid] = _truncate(msgs)
+    with _lock:
+        _drop(cid)
+        conv = _memory_store[cid] = _Conv()
+        _extend(conv, msgs)
+        _evict(conv.touched)
 
 def load_conversation(cid: str) -> List[dict]:
-    return _memory_store.get(cid, [])
+    with _lock:
+        conv = _get(cid)
+        return [m.as_dict() for m in conv.msgs] if conv else []
+
+def load_tail(cid: str, n: int) -> List[dict]:
+    with _lock:
+        conv = _get(cid)
+        if not conv:
+            return []
+        start = max(0, len(conv.msgs) - n)
+        return [conv.msgs[i].as_dict() for i in range(start, len(conv.msgs))]
+
+def load_seed(cid: str) -> Optional[dict]:
+    with _lock:
+        conv = _get(cid)
+        return conv.msgs[0].as_dict() if conv and conv.msgs else None
+
+def append_messages(cid: str, msgs: List[dict]):
+    with _lock:
+        conv = _get_or_create(cid)
+        _extend(conv, msgs)
+        _evict(conv.touched)
+
+def commit_turn(cid: str, msgs: List[dict], n: int, meta: Optional[dict] = None) -> Tuple[List[dict], int]:
+    with _lock:
+        conv = _get_or_create(cid)
+        if meta:
+            conv.meta.update(meta)
+        _extend(conv, msgs)
+        version = conv.version
+        start = max(0, len(conv.msgs) - n)
+        window = [conv.msgs[i].as_dict() for i in range(start, len(conv.msgs))]
+        _evict(conv.touched)
+    return window, version
+
+def save_meta(cid: str, topic: str, stance: str):
+    with _lock:
+        _get_or_create(cid).meta.update({"topic": topic, "stance": stance})
+
+def load_meta(cid: str) -> dict:
+    with _lock:
+        conv = _get(cid)
+        meta = dict(conv.meta, v=conv.version) if conv else {}
+    meta.setdefault("topic", "")
+    meta.setdefault("stance", "")
+    return meta
+
+def load_version(cid: str) -> Optional[int]:
+    with _lock:
+        conv = _get(cid)
+        return conv.version if conv else None
+
+def stats() -> dict:
+    return {"conversations": len(_memory_store), "bytes": _total_bytes}
+
+# ---- API async: sin I/O, delega directo en las funciones sync ----
+
+async def save_conversation_async(cid: str, msgs: List[dict]):
+    save_conversation(cid, msgs)
+
+async def load_conversation_async(cid: str) -> List[dict]:
+    return load_conversation(cid)
+
+async def load_tail_async(cid: str, n: int) -> List[dict]:
+    return load_tail(cid, n)
+
+async def load_seed_async(cid: str) -> Optional[dict]:
+    return load_seed(cid)
+
+async def append_messages_async(cid: str, msgs: List[dict]):
+    append_messages(cid, msgs)
+
+async def commit_turn_async(cid: str, msgs: List[dict], n: int, meta: Optional[dict] = None) -> Tuple[List[dict], int]:
+    return commit_turn(cid, msgs, n, meta)
+
+async def save_meta_async(cid: str, topic: str, stance: str):
+    save_meta(cid, topic, stance)
+
+async def load_meta_async(cid: str) -> dict:
+    return load_meta(cid)
+
+async def load_version_async(cid: str) -> Optional[int]:
+    return load_version(cid)
+
+async def load_many_async(cids: List[str], n: int) -> List[Tuple[dict, List[dict]]]:
+    return [(load_meta(cid), load_tail(cid, n)) for cid in cids]
+
+async def commit_many_async(turns: List[Tuple[str, List[dict], Optional[dict]]], n: int) -> List[Tuple[List[dict], int]]:
+    return [commit_turn(cid, msgs, n, meta) for cid, msgs, meta in turns]
+
+async def scan_ids_async(start: float, end: float) -> List[str]:
+    lo, hi = id_bounds(start, end)
+    with _lock:
+        return sorted(cid for cid in _memory_store if lo <= cid < hi)
@@ -0,0 +1,114 @@
+# app/storage/migrate_redis.py
+"""
+Pone al día las claves conv:* de Redis:
+
+1. Claves sin hash tag (conv:<cid>:...) -> conv:{<cid>}:...
+2. Con varios nodos en REDIS_URL, mueve cada conversación al nodo que le
+   asigna el anillo (tras añadir un nodo solo se mueve ~1/N de ellas).
+3. Re-codifica en el formato binario v1 las listas de mensajes que aún
+   tengan entradas JSON legacy.
+
+    python -m app.storage.migrate_redis [--dry-run] [--batch 500]
+
+Las listas se re-codifican en una transacción con WATCH (si un turno la
+modifica entretanto, se reintenta) y conservan su TTL. Los pasos 1 y 2 usan
+redis_store.adopt_legacy: cada clave se lee y borra del origen en un paso y,
+si el destino ya tiene turnos escritos tras el cambio, el historial movido se
+les antepone en vez de pisarlos.
+"""
+import argparse
+import json
+
+import redis
+
+from app.core.settings import settings
+from app.storage.codec import decode, encode, is_legacy
+from app.storage.redis_store import _key_meta, _key_msgs, _nodes, _shard, adopt_legacy
+
+
+def migrate_key(client, key: bytes, dry_run: bool) -> tuple:
+    """(bytes antes, bytes después) de la lista; (0, 0) si no había nada que migrar."""
+    while True:
+        with client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                raw = pipe.lrange(key, 0, -1)
+                if not any(is_legacy(x) for x in raw):
+                    return 0, 0
+                encoded = [encode(decode(x)) for x in raw]
+                before, after = sum(map(len, raw)), sum(map(len, encoded))
+                if dry_run:
+                    return before, after
+                ttl = pipe.pttl(key)
+                pipe.multi()
+                pipe.delete(key)
+                pipe.rpush(key, *encoded)
+                if ttl and ttl > 0:
+                    pipe.pexpire(key, ttl)
+                pipe.execute()
+                return before, after
+            except redis.WatchError:
+                continue
+
+
+def parse_key(key: bytes):
+    """conv:{cid}:suffix o legacy conv:cid:suffix -> (cid, suffix); None si no es nuestra."""
+    body, _, suffix = key.decode("utf-8").partition(":")[2].rpartition(":")
+    if suffix not in ("messages", "meta"):
+        return None
+    if body.startswith("{") and body.endswith("}"):
+        body = body[1:-1]
+    return body, suffix
+
+
+def move_conversation(src, cid: str, tagged: bool, dry_run: bool) -> bool:
+    """Lleva la conversación de src a sus claves actuales en su nodo."""
+    if dry_run:
+        return True
+    return adopt_legacy(cid, src, (_key_msgs(cid), _key_meta(cid)) if tagged else None)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--dry-run", action="store_true", help="only report the savings")
+    ap.add_argument("--batch", type=int, default=500, help="SCAN count hint")
+    args = ap.parse_args()
+    if not settings.redis_url:
+        raise SystemExit("REDIS_URL not set")
+
+    report = {"keys": 0, "renamed": 0, "moved": 0, "migrated": 0, "bytes_before": 0, "bytes_after": 0}
+    # foto de todas las claves antes de mover nada: ni SCAN abiertos mientras
+    # se borra, ni claves recién movidas contadas dos veces
+    snapshot = [list(client.scan_iter(match="conv:*", count=args.batch)) for client in _nodes]
+    for idx, client in enumerate(_nodes):
+        done = set()  # mensajes y meta se mueven juntos
+        for key in snapshot[idx]:
+            parsed = parse_key(key)
+            if parsed is None:
+                continue
+            cid, suffix = parsed
+            report["keys"] += 1
+            target = _key_msgs(cid) if suffix == "messages" else _key_meta(cid)
+            owner = _shard(cid)
+            tagged = key.decode("utf-8") == target
+            if owner != idx or not tagged:
+                if (cid, tagged) not in done:
+                    done.add((cid, tagged))
+                    if move_conversation(client, cid, tagged, args.dry_run):
+                        report["moved" if owner != idx else "renamed"] += 1
+                if args.dry_run:
+                    continue
+            if suffix == "messages" and settings.redis_codec != "json":
+                before, after = migrate_key(_nodes[owner], target, args.dry_run)
+                if before:
+                    report["migrated"] += 1
+                    report["bytes_before"] += before
+                    report["bytes_after"] += after
+    report["dry_run"] = args.dry_run
+    print(json.dumps(report, indent=2))
+    if not args.dry_run and settings.redis_adopt_legacy:
+        print("[INFO] No untagged keys left: set REDIS_ADOPT_LEGACY=0 to skip the legacy lookup on reads.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,520 @@
-from typing import List
-import json
+import asyncio
+import time
+from typing import List, Optional, Tuple
 import redis
+import redis.asyncio as aioredis
+from app.core.ids import PREFIX, id_bounds, id_timestamp
 from app.core.settings import settings
+from app.storage.codec import encode, decode
+from app.storage.sharding import HashRing, node_label, parse_urls
 
-# Conexión singleton
-_redis = redis.Redis.from_url(settings.redis_url, decode_responses=True)  # str I/O
+# REDIS_URL admite varias URLs (sharding en cliente por hashing consistente
+# del cid) o, con REDIS_CLUSTER=1, la URL de un nodo de un Redis Cluster
+# (el cluster reparte por slot). I/O en bytes: los mensajes usan la
+# codificación binaria de app.storage.codec y la meta se decodifica a mano
+# en _meta_from.
+_urls = parse_urls(settings.redis_url or "")
 
+if settings.redis_cluster:
+    from redis.cluster import RedisCluster
+    from redis.asyncio.cluster import RedisCluster as AsyncRedisCluster
+    _nodes = [RedisCluster.from_url(_urls[0])]
+    _anodes = [AsyncRedisCluster.from_url(_urls[0], max_connections=settings.redis_pool_size)]
+else:
+    _nodes = [redis.Redis.from_url(u) for u in _urls]
+    # Cliente async con pool acotado por nodo: si se agotan las conexiones se
+    # espera (BlockingConnectionPool) en lugar de abrir conexiones sin límite.
+    _anodes = [
+        aioredis.Redis(connection_pool=aioredis.BlockingConnectionPool.from_url(
+            u, max_connections=settings.redis_pool_size))
+        for u in _urls
+    ]
+
+_ring = HashRing([node_label(u) for u in _urls[:len(_nodes)]], settings.redis_vnodes)
+
+def _shard(cid: str) -> int:
+    return _ring.node(cid) if len(_nodes) > 1 else 0
+
+def _node(cid: str):
+    return _nodes[_shard(cid)]
+
+def _anode(cid: str):
+    return _anodes[_shard(cid)]
+
+# Primer nodo: scripts, herramientas y compatibilidad
+_redis, _aredis = _nodes[0], _anodes[0]
+
+# {cid} es un hash tag: mensajes y meta de una conversación caen en el mismo
+# slot/nodo, así el script de commit y los pipelines nunca cruzan nodos.
 def _key_msgs(cid: str) -> str:
-    return f"conv:{cid}:messages"
+    return f"conv:{{{cid}}}:messages"
 
-def _truncate_in_redis(key: str, max_len: int):
+def _truncate_in_redis(cid: str, max_len: int):
     # Mantén solo los últimos 'max_len' elementos
-    _redis.ltrim(key, -max_len, -1)
+    _node(cid).ltrim(_key_msgs(cid), -max_len, -1)
 
-def save_conversation(cid: str, msgs: List[dict]):
-    """
-    Persistimos la conversación completa como lista en Redis:
-    - Representamos cada msg como JSON en una LIST.
-    - Reemplazamos la lista por simplicidad (pipeline).
-    """
-    key = _key_msgs(cid)
-    pipe = _redis.pipeline()
+def _fill_save_pipeline(pipe, key: str, msgs: List[dict]):
     pipe.delete(key)
     if msgs:
         # LPUSH invierte, por eso usamos RPUSH para mantener orden original
-        pipe.rpush(key, *[json.dumps(m) for m in msgs])
+        pipe.rpush(key, *[encode(m) for m in msgs])
         if settings.history_soft_limit:
             pipe.ltrim(key, -settings.history_soft_limit, -1)
     # TTL opcional
     if settings.redis_ttl_secs:
         pipe.expire(key, settings.redis_ttl_secs)
+
+def save_conversation(cid: str, msgs: List[dict]):
+    """
+    Persistimos la conversación completa como lista en Redis:
+    - Representamos cada msg como un registro binario (codec) en una LIST.
+    - Reemplazamos la lista por simplicidad (pipeline).
+    """
+    pipe = _node(cid).pipeline()
+    _fill_save_pipeline(pipe, _key_msgs(cid), msgs)
     pipe.execute()
 
 def load_conversation(cid: str) -> List[dict]:
     key = _key_msgs(cid)
-    raw = _redis.lrange(key, 0, -1)  # orden natural (primer msg en index 0)
+    raw = _node(cid).lrange(key, 0, -1)  # orden natural (primer msg en index 0)
     if not raw:
         return []
-    return [json.loads(x) for x in raw]
+    return [decode(x) for x in raw]
+
+def load_tail(cid: str, n: int) -> List[dict]:
+    raw = _node(cid).lrange(_key_msgs(cid), -n, -1)  # solo los últimos n
+    return [decode(x) for x in raw] if raw else []
+
+def load_seed(cid: str) -> Optional[dict]:
+    raw = _node(cid).lindex(_key_msgs(cid), 0)
+    return decode(raw) if raw else None
+
+def _fill_append_pipeline(pipe, key: str, msgs: List[dict]):
+    # Solo los mensajes nuevos del turno: O(1) por turno en vez de O(historial)
+    pipe.rpush(key, *[encode(m) for m in msgs])
+    if settings.history_soft_limit:
+        pipe.ltrim(key, -settings.history_soft_limit, -1)
+    if settings.redis_ttl_secs:
+        pipe.expire(key, settings.redis_ttl_secs)
+
+def append_messages(cid: str, msgs: List[dict]):
+    if not msgs:
+        return
+    pipe = _node(cid).pipeline()
+    _fill_append_pipeline(pipe, _key_msgs(cid), msgs)
+    pipe.execute()
+
+# Commit de un turno en un único round trip y de forma atómica (Lua):
+# HSET meta opcional, RPUSH de los mensajes nuevos, LTRIM, TTL en ambas claves
+# e incrementa la versión de la conversación (meta.v = nº de mensajes añadidos);
+# devuelve [versión, últimos n]. Dos turnos concurrentes sobre el mismo cid se
+# serializan en el servidor, sin locks en el cliente.
+#   KEYS = [messages, meta]
+#   ARGV = [ttl, limit, n, nmeta, k1, v1, ..., msg1, msg2, ...]
+_COMMIT_TURN_LUA = """
+local mkey, hkey = KEYS[1], KEYS[2]
+local ttl, limit, n = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local i = 5
+for _ = 1, tonumber(ARGV[4]) do
+  redis.call('HSET', hkey, ARGV[i], ARGV[i + 1])
+  i = i + 2
+end
+for j = i, #ARGV do
+  redis.call('RPUSH', mkey, ARGV[j])
+end
+if limit > 0 then
+  redis.call('LTRIM', mkey, -limit, -1)
+end
+local v = redis.call('HINCRBY', hkey, 'v', #ARGV - i + 1)
+if ttl > 0 then
+  redis.call('EXPIRE', mkey, ttl)
+  redis.call('EXPIRE', hkey, ttl)
+end
+return {v, redis.call('LRANGE', mkey, -n, -1)}
+"""
+
+def _commit_args(msgs: List[dict], n: int, meta: Optional[dict]) -> list:
+    meta = meta or {}
+    args = [settings.redis_ttl_secs or 0, settings.history_soft_limit or 0, n, len(meta)]
+    for k, v in meta.items():
+        args += [k, v]
+    return args + [encode(m) for m in msgs]
+
+_commit_turn = _redis.register_script(_COMMIT_TURN_LUA)
+
+def commit_turn(cid: str, msgs: List[dict], n: int, meta: Optional[dict] = None) -> Tuple[List[dict], int]:
+    version, raw = _commit_turn(keys=[_key_msgs(cid), _key_meta(cid)], args=_commit_args(msgs, n, meta), client=_node(cid))
+    return [decode(x) for x in raw], int(version)
 
 def _key_meta(cid: str) -> str:
-    return f"conv:{cid}:meta"
+    return f"conv:{{{cid}}}:meta"
 
-def save_meta(cid: str, topic: str, stance: str):
-    key = _key_meta(cid)
-    _redis.hset(key, mapping={"topic": topic, "stance": stance})
+def _fill_meta_pipeline(pipe, key: str, topic: str, stance: str):
+    pipe.hset(key, mapping={"topic": topic, "stance": stance})
     if settings.redis_ttl_secs:
-        _redis.expire(key, settings.redis_ttl_secs)
+        pipe.expire(key, settings.redis_ttl_secs)
+
+def save_meta(cid: str, topic: str, stance: str):
+    pipe = _node(cid).pipeline()
+    _fill_meta_pipeline(pipe, _key_meta(cid), topic, stance)
+    pipe.execute()
+
+_INT_META = ("v", "summary_v", "t")
+
+def _meta_from(data: dict) -> dict:
+    # el hash guarda strings: topic/stance, versión y resumen del contexto
+    meta = {"topic": "", "stance": ""}
+    meta.update((k.decode(), v.decode()) for k, v in data.items())
+    for k in _INT_META:
+        if k in meta:
+            meta[k] = int(meta[k])
+    return meta
 
 def load_meta(cid: str) -> dict:
-    key = _key_meta(cid)
-    data = _redis.hgetall(key)
-    return {"topic": data.get("topic", ""), "stance": data.get("stance", "")}
+    return _meta_from(_node(cid).hgetall(_key_meta(cid)))
+
+# ---- API async (la que usan las rutas) ----
+
+async def save_conversation_async(cid: str, msgs: List[dict]):
+    pipe = _anode(cid).pipeline()
+    _fill_save_pipeline(pipe, _key_msgs(cid), msgs)
+    await pipe.execute()
+
+async def load_conversation_async(cid: str) -> List[dict]:
+    raw = await _anode(cid).lrange(_key_msgs(cid), 0, -1)
+    if not raw and await _adopted(cid):
+        raw = await _anode(cid).lrange(_key_msgs(cid), 0, -1)
+    return [decode(x) for x in raw] if raw else []
+
+async def load_tail_async(cid: str, n: int) -> List[dict]:
+    raw = await _anode(cid).lrange(_key_msgs(cid), -n, -1)
+    if not raw and await _adopted(cid):
+        raw = await _anode(cid).lrange(_key_msgs(cid), -n, -1)
+    return [decode(x) for x in raw] if raw else []
+
+async def load_seed_async(cid: str) -> Optional[dict]:
+    raw = await _anode(cid).lindex(_key_msgs(cid), 0)
+    if not raw and await _adopted(cid):
+        raw = await _anode(cid).lindex(_key_msgs(cid), 0)
+    return decode(raw) if raw else None
+
+async def append_messages_async(cid: str, msgs: List[dict]):
+    if not msgs:
+        return
+    pipe = _anode(cid).pipeline()
+    _fill_append_pipeline(pipe, _key_msgs(cid), msgs)
+    await pipe.execute()
+
+_commit_turn_async = _aredis.register_script(_COMMIT_TURN_LUA)
+
+async def commit_turn_async(cid: str, msgs: List[dict], n: int, meta: Optional[dict] = None) -> Tuple[List[dict], int]:
+    version, raw = await _commit_turn_async(
+        keys=[_key_msgs(cid), _key_meta(cid)], args=_commit_args(msgs, n, meta), client=_anode(cid))
+    return await _after_commit(cid, msgs, n, [decode(x) for x in raw], int(version))
+
+async def save_meta_async(cid: str, topic: str, stance: str):
+    pipe = _anode(cid).pipeline()
+    _fill_meta_pipeline(pipe, _key_meta(cid), topic, stance)
+    await pipe.execute()
+
+async def load_meta_async(cid: str) -> dict:
+    data = await _anode(cid).hgetall(_key_meta(cid))
+    if not data and await _adopted(cid):
+        data = await _anode(cid).hgetall(_key_meta(cid))
+    return _meta_from(data)
+
+async def load_version_async(cid: str) -> Optional[int]:
+    """Solo meta.v (comprobación barata de la caché L1)."""
+    v = await _anode(cid).hget(_key_meta(cid), "v")
+    if v is None and await _adopted(cid):
+        v = await _anode(cid).hget(_key_meta(cid), "v")
+    return int(v) if v is not None else None
+
+# ---- Claves sin hash tag (conv:<cid>:..., anteriores al sharding) ----
+# Vivían en el único nodo de entonces (el primero de REDIS_URL). Hasta que se
+# lance app.storage.migrate_redis, una conversación que no está en las claves
+# nuevas se busca ahí y se adopta: cada clave vieja se lee y borra de forma
+# atómica y un script la antepone a la nueva (que puede tener ya un commit
+# hecho sin lectura previa) sumando su versión. Los ids de app.core.ids son
+# posteriores al cambio de claves: esos nunca pagan la consulta. Tras la
+# migración, REDIS_ADOPT_LEGACY=0 la apaga para todos.
+
+def _legacy_keys(cid: str) -> Tuple[str, str]:
+    return f"conv:{cid}:messages", f"conv:{cid}:meta"
+
+# Lee y borra una clave (lista o hash) en un solo paso; una clave por
+# llamada para que valga también en cluster (cada una cae en su slot).
+_TAKE_LUA = """
+local kind = redis.call('TYPE', KEYS[1])['ok']
+local r = {}
+if kind == 'list' then
+  r = redis.call('LRANGE', KEYS[1], 0, -1)
+elseif kind == 'hash' then
+  r = redis.call('HGETALL', KEYS[1])
+end
+redis.call('DEL', KEYS[1])
+return r
+"""
+
+# Antepone lo legacy a la conversación actual: la meta nueva gana (HSETNX) y
+# la versión suma la de ambas.
+#   KEYS = [messages, meta]
+#   ARGV = [ttl, limit, v, nmeta, k1, v1, ..., msg1, msg2, ...]
+_ADOPT_LUA = """
+local mkey, hkey = KEYS[1], KEYS[2]
+local ttl, limit = tonumber(ARGV[1]), tonumber(ARGV[2])
+local i = 5
+for _ = 1, tonumber(ARGV[4]) do
+  redis.call('HSETNX', hkey, ARGV[i], ARGV[i + 1])
+  i = i + 2
+end
+for j = #ARGV, i, -1 do
+  redis.call('LPUSH', mkey, ARGV[j])
+end
+if limit > 0 then
+  redis.call('LTRIM', mkey, -limit, -1)
+end
+redis.call('HINCRBY', hkey, 'v', ARGV[3])
+if ttl > 0 then
+  redis.call('EXPIRE', mkey, ttl)
+  redis.call('EXPIRE', hkey, ttl)
+end
+return 1
+"""
+
+def _adopt_args(msgs: list, flat_meta: list) -> list:
+    meta = dict(zip(flat_meta[::2], flat_meta[1::2]))
+    # las conversaciones legacy ya llevaban meta.v; si no, cuenta la lista
+    v = int(meta.pop(b"v", 0)) or len(msgs)
+    args = [settings.redis_ttl_secs or 0, settings.history_soft_limit or 0, v, len(meta)]
+    for k, val in meta.items():
+        args += [k, val]
+    return args + list(msgs)
+
+_take, _adopt = _redis.register_script(_TAKE_LUA), _redis.register_script(_ADOPT_LUA)
+_take_async, _adopt_async = _aredis.register_script(_TAKE_LUA), _aredis.register_script(_ADOPT_LUA)
+
+def adopt_legacy(cid: str, src=None, keys: Optional[Tuple[str, str]] = None) -> bool:
+    """Pasa (mensajes, meta) de src -por defecto las claves legacy del primer
+    nodo- a las claves actuales de cid en su nodo. False si no había nada."""
+    src = src or _nodes[0]
+    msgs, meta = (_take(keys=[key], client=src) for key in keys or _legacy_keys(cid))
+    if not (msgs or meta):
+        return False
+    _adopt(keys=[_key_msgs(cid), _key_meta(cid)], args=_adopt_args(msgs, meta), client=_node(cid))
+    return True
+
+async def _adopt_legacy_async(cid: str) -> bool:
+    msgs, meta = await asyncio.gather(*(_take_async(keys=[key], client=_anodes[0]) for key in _legacy_keys(cid)))
+    if not (msgs or meta):
+        return False
+    await _adopt_async(keys=[_key_msgs(cid), _key_meta(cid)], args=_adopt_args(msgs, meta), client=_anode(cid))
+    return True
+
+_adopting: dict = {}
+
+async def _adopted(cid: str) -> bool:
+    """True si había claves legacy de cid y ya están en las nuevas. Las lecturas
+    concurrentes del mismo cid (meta y cola de un turno) comparten la adopción."""
+    if not settings.redis_adopt_legacy or id_timestamp(cid) is not None:
+        return False
+    task = _adopting.get(cid)
+    if task is None:
+        task = _adopting[cid] = asyncio.ensure_future(_adopt_legacy_async(cid))
+        task.add_done_callback(lambda _: _adopting.pop(cid, None))
+    return await asyncio.shield(task)
+
+async def _after_commit(cid: str, msgs: List[dict], n: int, window: List[dict], version: int) -> Tuple[List[dict], int]:
+    # un commit que crea la conversación puede tener historial legacy pendiente
+    if version == len(msgs) and await _adopted(cid):
+        return await load_tail_async(cid, n), await load_version_async(cid)
+    return window, version
+
+# ---- Lotes (/chat/batch): un pipeline por nodo para leer y otro para escribir ----
+# Con varios nodos los cids se agrupan por dueño y los pipelines de cada nodo
+# van en paralelo; el resultado conserva el orden de entrada.
+
+async def load_many_async(cids: List[str], n: int) -> List[Tuple[dict, List[dict]]]:
+    out: list = [None] * len(cids)
+
+    async def run(shard: int, positions: List[int]):
+        pipe = _anodes[shard].pipeline(transaction=False)
+        for i in positions:
+            pipe.hgetall(_key_meta(cids[i]))
+            pipe.lrange(_key_msgs(cids[i]), -n, -1)
+        res = await pipe.execute()
+        for j, i in enumerate(positions):
+            out[i] = (_meta_from(res[2 * j]), [decode(x) for x in res[2 * j + 1]])
+
+    await asyncio.gather(*(run(shard, pos) for shard, pos in _group(cids).items()))
+    empty = [i for i, (meta, tail) in enumerate(out) if not tail and "v" not in meta]
+    adopted = await asyncio.gather(*(_adopted(cids[i]) for i in empty))
+    for i, ok in zip(empty, adopted):
+        if ok:
+            out[i] = (await load_meta_async(cids[i]), await load_tail_async(cids[i], n))
+    return out
+
+async def commit_many_async(turns: List[Tuple[str, List[dict], Optional[dict]]], n: int) -> List[Tuple[List[dict], int]]:
+    if settings.redis_cluster:
+        # el pipeline de cluster no admite scripts: el cliente ya multiplexa por nodo
+        return list(await asyncio.gather(*(commit_turn_async(cid, msgs, n, meta) for cid, msgs, meta in turns)))
+    out: list = [None] * len(turns)
+
+    async def run(shard: int, positions: List[int]):
+        pipe = _anodes[shard].pipeline(transaction=False)
+        for i in positions:
+            cid, msgs, meta = turns[i]
+            await _commit_turn_async(keys=[_key_msgs(cid), _key_meta(cid)], args=_commit_args(msgs, n, meta), client=pipe)
+        res = await pipe.execute()
+        for (version, raw), i in zip(res, positions):
+            out[i] = ([decode(x) for x in raw], int(version))
+
+    await asyncio.gather(*(run(shard, pos) for shard, pos in _group([t[0] for t in turns]).items()))
+    return list(await asyncio.gather(*(
+        _after_commit(cid, msgs, n, window, version) for (cid, msgs, _), (window, version) in zip(turns, out)
+    )))
+
+def _group(cids: List[str]):
+    return _ring.group(cids) if len(_nodes) > 1 else {0: list(range(len(cids)))}
+
+# ---- Rango temporal: los ids (app.core.ids) ordenan por creación ----
+
+async def scan_ids_async(start: float, end: float, count: int = 1000) -> List[str]:
+    """
+    ids creados en [start, end]. Recorre con SCAN todo el keyspace de cada
+    nodo (O(nº de claves), no del resultado): para scripts y herramientas de
+    mantenimiento, no para el camino de un request.
+    """
+    lo, hi = id_bounds(start, end)
+
+    async def scan(client) -> List[str]:
+        cids = []
+        async for key in client.scan_iter(match=f"conv:{{{PREFIX}*}}:meta", count=count):
+            cid = _cid_from_meta_key(key)
+            if lo <= cid < hi:
+                cids.append(cid)
+        return cids
+
+    found = await asyncio.gather(*(scan(c) for c in _anodes))
+    return sorted(cid for cids in found for cid in cids)
+
+# ---- Tiering (app.storage.tiered): las conversaciones inactivas van a Firestore ----
+# meta.t = epoch (s) del último commit; lo escribe TieredStore en cada turno.
+
+def _cid_from_meta_key(key: bytes) -> str:
+    return key.decode("utf-8")[len("conv:{"):-len("}:meta")]
+
+# Marca meta.t solo si la meta sigue existiendo: entre el SCAN y el HSETNX
+# puede haber expirado o archivado, y recrearla dejaría un hash huérfano sin
+# TTL. HSETNX sobre un hash existente conserva su TTL.
+#   KEYS = [meta]   ARGV = [t]
+_STAMP_IDLE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+  return redis.call('HSETNX', KEYS[1], 't', ARGV[1])
+end
+return 0
+"""
+
+_stamp_idle = _aredis.register_script(_STAMP_IDLE_LUA)
+
+async def scan_idle_async(cutoff: float, count: int = 1000) -> List[str]:
+    """cids cuyo último commit es anterior a cutoff. Las metas sin 't' (de antes
+    del tiering) lo reciben ahora y entran en una pasada posterior."""
+    now = int(time.time())
+
+    async def check(client, keys: List[bytes]) -> List[str]:
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hget(key, "t")
+        res = await pipe.execute()
+        missing = [k for k, t in zip(keys, res) if t is None]
+        if missing and settings.redis_cluster:
+            # el pipeline de cluster no admite scripts
+            await asyncio.gather(*(_stamp_idle(keys=[key], args=[now], client=client) for key in missing))
+        elif missing:
+            pipe = client.pipeline(transaction=False)
+            for key in missing:
+                await _stamp_idle(keys=[key], args=[now], client=pipe)
+            await pipe.execute()
+        return [_cid_from_meta_key(k) for k, t in zip(keys, res) if t is not None and int(t) < cutoff]
+
+    async def scan(client) -> List[str]:
+        idle, keys = [], []
+        async for key in client.scan_iter(match="conv:{*}:meta", count=count):
+            keys.append(key)
+            if len(keys) >= count:
+                idle += await check(client, keys)
+                keys = []
+        return idle + (await check(client, keys) if keys else [])
+
+    found = await asyncio.gather(*(scan(c) for c in _anodes))
+    return [cid for cids in found for cid in cids]
+
+async def export_many_async(cids: List[str]) -> List[Tuple[dict, List[dict]]]:
+    # n=0 -> LRANGE 0 -1: la lista completa
+    return await load_many_async(cids, 0)
+
+# Borra la conversación solo si nadie ha hecho commit desde que se exportó.
+# Devuelve 1 si la borró, 0 si hay una versión más nueva (la copia archivada
+# quedó vieja) y -1 si ya no estaba (expiró: el archivo es la única copia).
+#   KEYS = [messages, meta]   ARGV = [v]
+_DROP_IF_UNCHANGED_LUA = """
+local v = redis.call('HGET', KEYS[2], 'v')
+if not v and redis.call('EXISTS', KEYS[2]) == 0 then
+  return -1
+end
+if (v or '') == ARGV[1] then
+  redis.call('DEL', KEYS[1], KEYS[2])
+  return 1
+end
+return 0
+"""
+
+_drop_if_unchanged = _aredis.register_script(_DROP_IF_UNCHANGED_LUA)
+
+DROPPED, SUPERSEDED, GONE = 1, 0, -1
+
+async def drop_many_async(items: List[Tuple[str, Optional[int]]]) -> List[int]:
+    """Borra [(cid, versión exportada)] de Redis; por item, DROPPED / SUPERSEDED / GONE."""
+    return [int(r) for r in await asyncio.gather(*(
+        _drop_if_unchanged(keys=[_key_msgs(cid), _key_meta(cid)], args=["" if v is None else v], client=_anode(cid))
+        for cid, v in items
+    ))]
+
+async def restore_async(cid: str, meta: dict, msgs: List[dict]):
+    """Reescribe la conversación completa (rehidratación desde el archivo frío)."""
+    pipe = _anode(cid).pipeline()
+    _fill_save_pipeline(pipe, _key_msgs(cid), msgs)
+    pipe.delete(_key_meta(cid))
+    pipe.hset(_key_meta(cid), mapping={k: v for k, v in meta.items() if v is not None})
+    if settings.redis_ttl_secs:
+        pipe.expire(_key_meta(cid), settings.redis_ttl_secs)
+    await pipe.execute()
+
+# ---- Caché de respuestas compartida (reply_cache): reparte por clave ----
+
+class _KeyRouter:
+    async def get(self, key: str):
+        return await _anode(key).get(key)
+
+    async def set(self, key: str, value, ex: Optional[int] = None):
+        return await _anode(key).set(key, value, ex=ex)
+
+def shared_client():
+    return _aredis if len(_anodes) == 1 else _KeyRouter()
+
+# ---- Ciclo de vida (app.core.registry) ----
+
+async def ping_async():
+    """Abre una conexión por nodo antes del primer request (en paralelo)."""
+    await asyncio.gather(*(n.ping() for n in _anodes))
 
+async def aclose():
+    """Cierra los pools de conexiones (fin del lifespan)."""
+    for n in _anodes:
+        if settings.redis_cluster:
+            await n.aclose()
+        else:
+            await n.aclose(close_connection_pool=True)
+    for n in _nodes:
+        n.close()
@@ -0,0 +1,56 @@
+# app/storage/sharding.py
+"""
+Reparto de conversaciones entre varios nodos Redis (REDIS_URL con varias URLs).
+
+Anillo de hashing consistente con nodos virtuales: cada nodo ocupa `vnodes`
+puntos del anillo y un cid pertenece al primer punto a su derecha. Al añadir
+un nodo solo cambian de dueño ~1/N de las conversaciones (las que caen en
+los tramos que ocupan sus puntos); el resto sigue donde estaba.
+
+Las claves de una conversación llevan el cid como hash tag (conv:{cid}:...),
+así que con Redis Cluster también acaban en el mismo slot y el script de
+commit y los pipelines siguen siendo de un solo nodo.
+"""
+from bisect import bisect
+from functools import lru_cache
+from hashlib import blake2b
+from typing import Dict, List
+from urllib.parse import urlsplit
+
+
+def parse_urls(value: str) -> List[str]:
+    """REDIS_URL admite una URL o varias separadas por comas/espacios."""
+    return [u for u in value.replace(",", " ").split() if u]
+
+
+def node_label(url: str) -> str:
+    # host:port/db sin credenciales: rotar la contraseña no debe mover claves
+    parts = urlsplit(url)
+    return f"{parts.hostname}:{parts.port or 6379}{parts.path or '/0'}"
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, labels: List[str], vnodes: int = 160):
+        if len(set(labels)) != len(labels):
+            raise ValueError(f"duplicated Redis nodes: {labels}")
+        ring = sorted((_point(f"{label}#{i}"), idx) for idx, label in enumerate(labels) for i in range(vnodes))
+        self.labels = list(labels)
+        self._points = [p for p, _ in ring]
+        self._owners = [idx for _, idx in ring]
+        self.node = lru_cache(maxsize=65536)(self._node)
+
+    def _node(self, cid: str) -> int:
+        """Índice (en `labels`) del nodo dueño del cid."""
+        i = bisect(self._points, _point(cid))
+        return self._owners[i % len(self._points)]
+
+    def group(self, cids: List[str]) -> Dict[int, List[int]]:
+        """nodo -> posiciones de `cids` que le tocan (para un pipeline por nodo)."""
+        out: Dict[int, List[int]] = {}
+        for pos, cid in enumerate(cids):
+            out.setdefault(self.node(cid), []).append(pos)
+        return out
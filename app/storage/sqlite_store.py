@@ -0,0 +1,372 @@
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+from app.core.ids import id_bounds
+from app.core.settings import settings
+from app.storage.codec import decode, encode
+
+# Backend en disco local (SQLITE_PATH) compartido por todos los workers de
+# una máquina: SQLite en modo WAL admite lectores concurrentes con un
+# escritor, también entre procesos, así que un turno puede caer en cualquier
+# worker sin Redis.
+#
+# Layout:
+#   conversations(cid PK, v, meta JSON, touched)  -> v = nº de mensajes añadidos
+#   messages(cid, seq, msg)  PK (cid, seq)         -> seq = 1..v, registros de app.storage.codec
+# Los turnos solo insertan filas (append-only); la cola se lee por rango de
+# la PK (seq > v - n) y HISTORY_SOFT_LIMIT borra por el otro extremo.
+#
+# Por proceso: un hilo escritor (una conexión) y SQLITE_READERS hilos
+# lectores, fuera del event loop. Los commits async que llegan mientras el
+# escritor está ocupado se agrupan en una sola transacción (group commit).
+# Un job por worker borra las conversaciones sin actividad en SQLITE_TTL_SECS.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+  cid TEXT PRIMARY KEY,
+  v INTEGER NOT NULL DEFAULT 0,
+  meta TEXT NOT NULL DEFAULT '{}',
+  touched REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS conversations_touched ON conversations (touched);
+CREATE TABLE IF NOT EXISTS messages (
+  cid TEXT NOT NULL,
+  seq INTEGER NOT NULL,
+  msg BLOB NOT NULL,
+  PRIMARY KEY (cid, seq)
+) WITHOUT ROWID;
+"""
+
+_VACUUM_BATCH = 500  # conversaciones por transacción al caducar
+
+_local = threading.local()
+_conns: List[sqlite3.Connection] = []
+_conns_lock = threading.Lock()
+_writer: Optional[ThreadPoolExecutor] = None
+_readers: Optional[ThreadPoolExecutor] = None
+_queue: list = []  # commits async pendientes: ((cid, msgs, n, meta), future)
+_flusher: Optional[asyncio.Task] = None
+_vacuum_task: Optional[asyncio.Task] = None
+_counters = {"commits": 0, "batches": 0, "vacuumed": 0}
+
+def _connect() -> sqlite3.Connection:
+    path = settings.sqlite_path
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    # autocommit: las transacciones se abren a mano (BEGIN IMMEDIATE para escribir)
+    conn = sqlite3.connect(path, timeout=settings.sqlite_busy_timeout_ms / 1000,
+                           isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")  # solo aplica al crear el fichero
+    conn.execute("PRAGMA journal_mode=WAL")
+    # sin fsync por commit: un corte de luz puede perder los últimos turnos, no corromper
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+def _conn() -> sqlite3.Connection:
+    """Conexión del hilo actual (sqlite3 no comparte una conexión entre hilos a la vez)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _connect()
+        with _conns_lock:
+            _conns.append(conn)
+    return conn
+
+_inherited: List[sqlite3.Connection] = []
+
+def _after_fork():
+    # el hijo no hereda los hilos. Las conexiones del padre se guardan sin
+    # cerrar: cerrarlas (o que las recoja el GC) haría checkpoint del WAL que
+    # el padre sigue usando
+    global _local, _conns, _writer, _readers, _queue, _flusher, _vacuum_task
+    _inherited.extend(_conns)
+    _local, _conns, _writer, _readers = threading.local(), [], None, None
+    _queue, _flusher, _vacuum_task = [], None, None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+@contextmanager
+def _tx(conn: sqlite3.Connection, mode: str = "IMMEDIATE"):
+    conn.execute(f"BEGIN {mode}")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def _pools() -> Tuple[ThreadPoolExecutor, ThreadPoolExecutor]:
+    global _writer, _readers
+    if _writer is None:
+        _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-w")
+        _readers = ThreadPoolExecutor(max_workers=max(1, settings.sqlite_readers), thread_name_prefix="sqlite-r")
+    return _writer, _readers
+
+async def _read(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_pools()[1], fn, *args)
+
+async def _write(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_pools()[0], fn, *args)
+
+# ---- Filas ----
+
+def _meta_from(row) -> dict:
+    meta = {"topic": "", "stance": ""}
+    if row is not None:
+        meta.update(json.loads(row[1]))
+        meta["v"] = row[0]
+    return meta
+
+def _select_meta(conn: sqlite3.Connection, cid: str):
+    return conn.execute("SELECT v, meta FROM conversations WHERE cid = ?", (cid,)).fetchone()
+
+def _select_tail(conn: sqlite3.Connection, cid: str, v: int, n: int) -> List[dict]:
+    rows = conn.execute("SELECT msg FROM messages WHERE cid = ? AND seq > ? ORDER BY seq", (cid, v - n))
+    return [decode(r[0]) for r in rows]
+
+def _tail(conn: sqlite3.Connection, cid: str, n: int) -> List[dict]:
+    row = conn.execute("SELECT v FROM conversations WHERE cid = ?", (cid,)).fetchone()
+    return _select_tail(conn, cid, row[0], n) if row and n > 0 else []
+
+def _upsert(conn: sqlite3.Connection, cid: str, v: int, meta: dict, now: float):
+    conn.execute("INSERT OR REPLACE INTO conversations (cid, v, meta, touched) VALUES (?, ?, ?, ?)",
+                 (cid, v, json.dumps(meta, separators=(",", ":")), now))
+
+def _commit_rows(conn: sqlite3.Connection, cid: str, msgs: List[dict], n: int, meta: Optional[dict],
+                 now: float) -> Tuple[List[dict], int]:
+    """Meta opcional + append + recorte; dentro de una transacción abierta."""
+    row = _select_meta(conn, cid)
+    v, stored = (row[0], json.loads(row[1])) if row else (0, {})
+    if meta:
+        stored.update(meta)
+    conn.executemany("INSERT INTO messages (cid, seq, msg) VALUES (?, ?, ?)",
+                     [(cid, v + i + 1, encode(m)) for i, m in enumerate(msgs)])
+    v += len(msgs)
+    _upsert(conn, cid, v, stored, now)
+    limit = settings.history_soft_limit
+    if limit and v > limit and msgs:
+        conn.execute("DELETE FROM messages WHERE cid = ? AND seq <= ?", (cid, v - limit))
+    return (_select_tail(conn, cid, v, n) if n > 0 else []), v
+
+def _commit_batch(turns: list) -> list:
+    """Varios commits en una transacción; si falla, uno a uno (un turno malo no tumba el lote)."""
+    conn, now = _conn(), time.time()
+    try:
+        with _tx(conn):
+            out = [_commit_rows(conn, cid, msgs, n, meta, now) for cid, msgs, n, meta in turns]
+        _counters["batches"] += 1
+        return out
+    except Exception:
+        if len(turns) == 1:
+            raise
+    out = []
+    for cid, msgs, n, meta in turns:
+        try:
+            with _tx(conn):
+                out.append(_commit_rows(conn, cid, msgs, n, meta, now))
+            _counters["batches"] += 1
+        except Exception as e:
+            out.append(e)
+    return out
+
+# ---- API sync (scripts y tests) ----
+
+def save_conversation(cid: str, msgs: List[dict]):
+    limit = settings.history_soft_limit
+    msgs = msgs[-limit:] if limit else msgs
+    conn = _conn()
+    with _tx(conn):
+        row = _select_meta(conn, cid)
+        conn.execute("DELETE FROM messages WHERE cid = ?", (cid,))
+        conn.executemany("INSERT INTO messages (cid, seq, msg) VALUES (?, ?, ?)",
+                         [(cid, i + 1, encode(m)) for i, m in enumerate(msgs)])
+        _upsert(conn, cid, len(msgs), json.loads(row[1]) if row else {}, time.time())
+
+def load_conversation(cid: str) -> List[dict]:
+    rows = _conn().execute("SELECT msg FROM messages WHERE cid = ? ORDER BY seq", (cid,))
+    return [decode(r[0]) for r in rows]
+
+def load_tail(cid: str, n: int) -> List[dict]:
+    conn = _conn()
+    with _tx(conn, "DEFERRED"):  # v y mensajes de la misma instantánea
+        return _tail(conn, cid, n)
+
+def load_seed(cid: str) -> Optional[dict]:
+    row = _conn().execute("SELECT msg FROM messages WHERE cid = ? ORDER BY seq LIMIT 1", (cid,)).fetchone()
+    return decode(row[0]) if row else None
+
+def append_messages(cid: str, msgs: List[dict]):
+    if msgs:
+        commit_turn(cid, msgs, 0)
+
+def commit_turn(cid: str, msgs: List[dict], n: int, meta: Optional[dict] = None) -> Tuple[List[dict], int]:
+    result = _commit_batch([(cid, msgs, n, meta)])[0]
+    _counters["commits"] += 1
+    return result
+
+def save_meta(cid: str, topic: str, stance: str):
+    commit_turn(cid, [], 0, {"topic": topic, "stance": stance})
+
+def load_meta(cid: str) -> dict:
+    return _meta_from(_select_meta(_conn(), cid))
+
+def _load_many(cids: List[str], n: int) -> List[Tuple[dict, List[dict]]]:
+    conn = _conn()
+    with _tx(conn, "DEFERRED"):
+        out = []
+        for cid in cids:
+            row = _select_meta(conn, cid)
+            out.append((_meta_from(row), _select_tail(conn, cid, row[0], n) if row and n > 0 else []))
+        return out
+
+def _scan_ids(lo: str, hi: str) -> List[str]:
+    rows = _conn().execute("SELECT cid FROM conversations WHERE cid >= ? AND cid < ? ORDER BY cid", (lo, hi))
+    return [r[0] for r in rows]
+
+def vacuum(now: Optional[float] = None) -> int:
+    """Borra las conversaciones sin actividad en SQLITE_TTL_SECS; devuelve cuántas."""
+    if not settings.sqlite_ttl_secs:
+        return 0
+    cutoff = (now or time.time()) - settings.sqlite_ttl_secs
+    conn, total = _conn(), 0
+    while True:
+        with _tx(conn):
+            cids = [(r[0],) for r in conn.execute(
+                "SELECT cid FROM conversations WHERE touched < ? LIMIT ?", (cutoff, _VACUUM_BATCH))]
+            conn.executemany("DELETE FROM messages WHERE cid = ?", cids)
+            conn.executemany("DELETE FROM conversations WHERE cid = ?", cids)
+        total += len(cids)
+        if len(cids) < _VACUUM_BATCH:
+            break
+    if total:
+        conn.execute("PRAGMA incremental_vacuum")  # devuelve al disco las páginas liberadas
+        _counters["vacuumed"] += total
+    return total
+
+def stats() -> dict:
+    return dict(_counters)
+
+# ---- API async: lecturas en el pool lector, escrituras en el hilo escritor ----
+
+async def _flush():
+    global _flusher
+    try:
+        while _queue:
+            batch = _queue[:]
+            del _queue[:]
+            try:
+                results = await _write(_commit_batch, [t for t, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, fut), res in zip(batch, results):
+                if fut.done():  # el request ya se canceló
+                    continue
+                if isinstance(res, Exception):
+                    fut.set_exception(res)
+                else:
+                    _counters["commits"] += 1
+                    fut.set_result(res)
+    finally:
+        _flusher = None
+
+def _enqueue(cid: str, msgs: List[dict], n: int, meta: Optional[dict]) -> asyncio.Future:
+    # los commits que llegan mientras el escritor trabaja van en la siguiente transacción
+    global _flusher
+    fut = asyncio.get_running_loop().create_future()
+    _queue.append(((cid, msgs, n, meta), fut))
+    if _flusher is None:
+        _flusher = asyncio.ensure_future(_flush())
+    return fut
+
+async def save_conversation_async(cid: str, msgs: List[dict]):
+    await _write(save_conversation, cid, msgs)
+
+async def load_conversation_async(cid: str) -> List[dict]:
+    return await _read(load_conversation, cid)
+
+async def load_tail_async(cid: str, n: int) -> List[dict]:
+    return await _read(load_tail, cid, n)
+
+async def load_seed_async(cid: str) -> Optional[dict]:
+    return await _read(load_seed, cid)
+
+async def append_messages_async(cid: str, msgs: List[dict]):
+    if msgs:
+        await _enqueue(cid, msgs, 0, None)
+
+async def commit_turn_async(cid: str, msgs: List[dict], n: int, meta: Optional[dict] = None) -> Tuple[List[dict], int]:
+    return await _enqueue(cid, msgs, n, meta)
+
+async def save_meta_async(cid: str, topic: str, stance: str):
+    await _enqueue(cid, [], 0, {"topic": topic, "stance": stance})
+
+async def load_meta_async(cid: str) -> dict:
+    return await _read(load_meta, cid)
+
+def load_version(cid: str) -> Optional[int]:
+    row = _conn().execute("SELECT v FROM conversations WHERE cid = ?", (cid,)).fetchone()
+    return row[0] if row else None
+
+async def load_version_async(cid: str) -> Optional[int]:
+    return await _read(load_version, cid)
+
+async def load_many_async(cids: List[str], n: int) -> List[Tuple[dict, List[dict]]]:
+    return await _read(_load_many, cids, n)
+
+async def commit_many_async(turns: List[Tuple[str, List[dict], Optional[dict]]], n: int) -> List[Tuple[List[dict], int]]:
+    futs = [_enqueue(cid, msgs, n, meta) for cid, msgs, meta in turns]  # una sola transacción
+    return list(await asyncio.gather(*futs))
+
+async def scan_ids_async(start: float, end: float) -> List[str]:
+    return await _read(_scan_ids, *id_bounds(start, end))
+
+# ---- Ciclo de vida (app.core.registry) ----
+
+async def ping_async():
+    """Abre la base (crea el esquema si hace falta) antes del primer request."""
+    await _write(_conn)
+
+async def _vacuum_loop():
+    interval = settings.sqlite_vacuum_interval_secs
+    while True:
+        # con jitter: los workers de la máquina no caducan todos a la vez
+        await asyncio.sleep(interval * random.uniform(0.5, 1.5))
+        try:
+            await _write(vacuum)
+        except Exception as e:
+            print(f"[WARN] SQLite vacuum failed: {e}")
+
+def start():
+    global _vacuum_task
+    if _vacuum_task is None and settings.sqlite_ttl_secs and settings.sqlite_vacuum_interval_secs > 0:
+        _vacuum_task = asyncio.ensure_future(_vacuum_loop())
+
+async def aclose():
+    """Termina los commits en curso, para el job y cierra hilos y conexiones."""
+    global _vacuum_task, _writer, _readers, _local
+    if _vacuum_task is not None:
+        _vacuum_task.cancel()
+        try:
+            await _vacuum_task
+        except asyncio.CancelledError:
+            pass
+        _vacuum_task = None
+    if _flusher is not None:
+        await _flusher
+    for pool in (_writer, _readers):
+        if pool is not None:
+            pool.shutdown(wait=True)
+    _writer = _readers = None
+    with _conns_lock:
+        for conn in _conns:
+            conn.close()
+        del _conns[:]
+    _local = threading.local()
@@ -0,0 +1,200 @@
+# app/storage/tiered.py
+"""
+Almacenamiento por niveles: Redis (caliente) + Firestore (frío).
+
+- Los turnos leen y escriben solo en Redis; cada commit marca meta.t (último uso).
+- Un job en segundo plano busca conversaciones con t < ahora - ARCHIVE_IDLE_SECS,
+  las copia a Firestore en batches (archive_many_async) y las borra de Redis
+  solo si no han cambiado desde la copia (versión meta.v). Si entretanto
+  llegó un turno, la copia archivada ya es vieja y se borra: si no, al
+  expirar Redis se rehidrataría sin ese turno.
+- Un turno sobre una conversación archivada la rehidrata: se lee del archivo,
+  se reescribe en Redis y se borra del archivo. Las lecturas concurrentes del
+  mismo cid comparten una sola rehidratación.
+
+Los ids de app.core.ids llevan su fecha de creación: una conversación creada
+hace menos de ARCHIVE_IDLE_SECS no puede estar archivada, así que un cid nuevo
+nunca paga la consulta a Firestore.
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.core.ids import id_timestamp
+
+# resultado de drop_many_async por conversación (como en redis_store)
+DROPPED, SUPERSEDED, GONE = 1, 0, -1
+
+_Archived = Optional[Tuple[dict, List[dict]]]
+
+
+def _empty(meta: dict, tail: List[dict]) -> bool:
+    return not (tail or meta.get("v") or meta.get("topic"))
+
+
+class TieredStore:
+    """Envuelve el backend caliente (redis_store) con la API async de app.storage.backend."""
+
+    def __init__(self, hot, cold, idle_secs: int, interval_secs: int, batch: int):
+        self.inner = hot
+        self.cold = cold
+        self.idle_secs = idle_secs
+        self.interval = interval_secs
+        self.batch = batch
+        self._inflight: Dict[str, "asyncio.Future[_Archived]"] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"archived": 0, "rehydrated": 0, "superseded": 0, "cold_misses": 0, "sweeps": 0, "errors": 0}
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    # ---- ciclo de vida (FastAPI lifespan) ----
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for backend in (self.inner, self.cold):  # pools de Redis y canales de Firestore
+            if hasattr(backend, "aclose"):
+                await backend.aclose()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.archive_idle()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"[WARN] archive sweep failed: {e}")
+
+    # ---- archivado ----
+
+    async def archive_idle(self) -> int:
+        """Una pasada: mueve a Firestore lo inactivo. Devuelve cuántas salieron de Redis."""
+        self.stats["sweeps"] += 1
+        cids = await self.inner.scan_idle_async(time.time() - self.idle_secs)
+        moved = 0
+        for i in range(0, len(cids), self.batch):
+            chunk = cids[i:i + self.batch]
+            exported = await self.inner.export_many_async(chunk)
+            items = [(cid, meta, msgs) for cid, (meta, msgs) in zip(chunk, exported) if not _empty(meta, msgs)]
+            if not items:
+                continue
+            # primero la copia fría; si falla, Redis sigue intacto
+            await self.cold.archive_many_async(items)
+            res = await self.inner.drop_many_async([(cid, meta.get("v")) for cid, meta, _ in items])
+            moved += sum(1 for r in res if r == DROPPED)
+            superseded = [cid for (cid, _, _), r in zip(items, res) if r == SUPERSEDED]
+            await asyncio.gather(*(self.cold.delete_archive_async(cid) for cid in superseded))
+            self.stats["superseded"] += len(superseded)
+        self.stats["archived"] += moved
+        return moved
+
+    # ---- rehidratación ----
+
+    def _maybe_archived(self, cid: str) -> bool:
+        created = id_timestamp(cid)
+        return created is None or created < time.time() - self.idle_secs
+
+    async def _rehydrate(self, cid: str) -> _Archived:
+        task = self._inflight.get(cid)
+        if task is None:
+            task = self._inflight[cid] = asyncio.ensure_future(self._restore(cid))
+            task.add_done_callback(lambda _: self._inflight.pop(cid, None))
+        return await asyncio.shield(task)
+
+    async def _restore(self, cid: str) -> _Archived:
+        archived = await self.cold.load_archive_async(cid)
+        if archived is None:
+            self.stats["cold_misses"] += 1
+            return None
+        meta, msgs = archived
+        meta["t"] = int(time.time())
+        await self.inner.restore_async(cid, meta, msgs)
+        await self.cold.delete_archive_async(cid)
+        self.stats["rehydrated"] += 1
+        return meta, msgs
+
+    async def _hot_or_archived(self, cid: str, meta: dict, tail: List[dict], n: int) -> Tuple[dict, List[dict]]:
+        if _empty(meta, tail) and self._maybe_archived(cid):
+            archived = await self._rehydrate(cid)
+            if archived is not None:
+                return dict(archived[0]), archived[1][-n:] if n else list(archived[1])
+        return meta, tail
+
+    # ---- lecturas: si Redis no tiene nada, se mira el archivo ----
+
+    async def load_meta_async(self, cid: str) -> dict:
+        meta = await self.inner.load_meta_async(cid)
+        return (await self._hot_or_archived(cid, meta, [], 0))[0]
+
+    async def load_tail_async(self, cid: str, n: int) -> List[dict]:
+        tail = await self.inner.load_tail_async(cid, n)
+        return (await self._hot_or_archived(cid, {}, tail, n))[1]
+
+    async def load_conversation_async(self, cid: str) -> List[dict]:
+        msgs = await self.inner.load_conversation_async(cid)
+        return (await self._hot_or_archived(cid, {}, msgs, 0))[1]
+
+    async def load_seed_async(self, cid: str) -> Optional[dict]:
+        msgs = await self.load_tail_async(cid, 1)  # rehidrata si hace falta
+        return await self.inner.load_seed_async(cid) if msgs else None
+
+    async def load_many_async(self, cids: List[str], n: int) -> List[Tuple[dict, List[dict]]]:
+        out = await self.inner.load_many_async(cids, n)
+        return list(await asyncio.gather(*(
+            self._hot_or_archived(cid, meta, tail, n) for cid, (meta, tail) in zip(cids, out)
+        )))
+
+    # ---- escrituras: marcan el último uso ----
+
+    async def commit_turn_async(
+        self, cid: str, msgs: List[dict], n: int, meta: Optional[dict] = None
+    ) -> Tuple[List[dict], int]:
+        window, version = await self.inner.commit_turn_async(cid, msgs, n, self._touch(meta))
+        if version == len(msgs) and self._maybe_archived(cid):
+            return await self._merge_archived(cid, msgs, n, window, version)
+        return window, version
+
+    async def commit_many_async(
+        self, turns: List[Tuple[str, List[dict], Optional[dict]]], n: int
+    ) -> List[Tuple[List[dict], int]]:
+        out = await self.inner.commit_many_async([(cid, msgs, self._touch(meta)) for cid, msgs, meta in turns], n)
+        return list(await asyncio.gather(*(
+            self._merge_archived(cid, msgs, n, window, version)
+            if version == len(msgs) and self._maybe_archived(cid) else _done(window, version)
+            for (cid, msgs, _), (window, version) in zip(turns, out)
+        )))
+
+    def _touch(self, meta: Optional[dict]) -> dict:
+        return {**(meta or {}), "t": int(time.time())}
+
+    async def _merge_archived(self, cid: str, msgs: List[dict], n: int, window: List[dict], version: int):
+        # commit sin lectura previa (p. ej. write-behind con la cola ya conocida)
+        # sobre una conversación archivada: el commit creó una conversación
+        # nueva en Redis, así que se antepone el historial archivado
+        archived = await self.cold.load_archive_async(cid)
+        if archived is None:
+            return window, version
+        meta, old = archived
+        version += int(meta.get("v") or len(old))
+        hot_meta = await self.inner.load_meta_async(cid)
+        full = old + await self.inner.load_conversation_async(cid)
+        meta.update((k, v) for k, v in hot_meta.items() if v not in ("", None))
+        meta["v"] = version
+        await self.inner.restore_async(cid, meta, full)
+        await self.cold.delete_archive_async(cid)
+        self.stats["rehydrated"] += 1
+        return full[-n:], version
+
+
+async def _done(window: List[dict], version: int) -> Tuple[List[dict], int]:
+    return window, version
@@ -0,0 +1,202 @@
+# app/storage/write_behind.py
+"""
+Persistencia write-behind (opt-in, WRITE_BEHIND=1).
+
+commit_turn_async responde sin esperar al backend: los mensajes quedan en
+una cola en proceso y una tarea de fondo los vuelca cada
+WRITE_BEHIND_INTERVAL_MS con commit_many_async (un pipeline), juntando todos
+los turnos pendientes de cada conversación en una sola escritura.
+
+Read-your-writes en el mismo worker: mientras una conversación tiene
+escrituras pendientes o en vuelo, su meta y su cola se sirven de la copia
+local (que ya incluye esos turnos) en lugar del backend. Cuando el volcado
+termina, la copia local se descarta y el backend vuelve a ser la fuente.
+
+Si la cola supera WRITE_BEHIND_MAX_PENDING mensajes, el turno se escribe en
+línea (write-through) como backpressure.
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+class _Local:
+    __slots__ = ("meta", "tail", "pending", "pending_meta", "flushing")
+
+    def __init__(self, meta: dict, tail: List[dict]):
+        self.meta = meta
+        self.tail = tail
+        self.pending: List[dict] = []
+        self.pending_meta: dict = {}
+        self.flushing = False
+
+
+class WriteBehindStore:
+    """Envuelve un backend (o CachedStore) con la API async de app.storage.backend."""
+
+    def __init__(self, inner, max_pending: int, interval_ms: int, seen_size: int = 10000):
+        self.inner = inner
+        self.max_pending = max_pending
+        self.interval = interval_ms / 1000
+        self.seen_size = seen_size
+        self._local: Dict[str, _Local] = {}
+        # última (meta, cola) leída del backend por conversación: base para
+        # calcular la ventana sin releer al hacer commit
+        self._seen: "OrderedDict[str, Tuple[dict, List[dict]]]" = OrderedDict()
+        self._count = 0  # mensajes pendientes de volcar
+        self._n = 1  # tamaño de ventana que piden los commits (para la caché de debajo)
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self.stats = {"queued": 0, "flushes": 0, "flushed_turns": 0, "write_through": 0, "errors": 0}
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    # ---- ciclo de vida (FastAPI lifespan) ----
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+        if hasattr(self.inner, "start"):  # p. ej. el job de archivado del TieredStore
+            self.inner.start()
+
+    async def aclose(self):
+        """Vuelca todo lo pendiente y para la tarea de fondo."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if hasattr(self.inner, "aclose"):
+            await self.inner.aclose()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    # ---- lecturas ----
+
+    def _remember(self, cid: str, meta: Optional[dict] = None, tail: Optional[List[dict]] = None):
+        old_meta, old_tail = self._seen.pop(cid, (None, None))
+        self._seen[cid] = (meta if meta is not None else old_meta, tail if tail is not None else old_tail)
+        while len(self._seen) > self.seen_size:
+            self._seen.popitem(last=False)
+
+    async def load_meta_async(self, cid: str) -> dict:
+        local = self._local.get(cid)
+        if local is not None:
+            return dict(local.meta)
+        meta = await self.inner.load_meta_async(cid)
+        self._remember(cid, meta=meta)
+        return meta
+
+    async def load_tail_async(self, cid: str, n: int) -> List[dict]:
+        local = self._local.get(cid)
+        if local is not None and (len(local.tail) >= n or local.meta.get("v") == len(local.tail)):
+            return local.tail[-n:]
+        if local is not None:
+            # la copia local es más corta que lo pedido: forzamos el volcado
+            await self.flush()
+        tail = await self.inner.load_tail_async(cid, n)
+        self._remember(cid, tail=tail)
+        return tail
+
+    async def load_many_async(self, cids: List[str], n: int) -> List[Tuple[dict, List[dict]]]:
+        out = await self.inner.load_many_async([c for c in cids if c not in self._local], n)
+        it = iter(out)
+        result = []
+        for cid in cids:
+            local = self._local.get(cid)
+            if local is not None:
+                result.append((dict(local.meta), local.tail[-n:]))
+            else:
+                meta, tail = next(it)
+                self._remember(cid, meta, tail)
+                result.append((meta, tail))
+        return result
+
+    # ---- escrituras ----
+
+    async def commit_turn_async(
+        self, cid: str, msgs: List[dict], n: int, meta: Optional[dict] = None
+    ) -> Tuple[List[dict], int]:
+        local = self._local.get(cid)
+        if local is None:
+            seen_meta, seen_tail = self._seen.get(cid, (None, None))
+            if seen_tail is None or self._count + len(msgs) > self.max_pending:
+                return await self._write_through(cid, msgs, n, meta)
+            local = self._local[cid] = _Local(dict(seen_meta or {}), list(seen_tail))
+        elif self._count + len(msgs) > self.max_pending:
+            await self.flush()
+            return await self._write_through(cid, msgs, n, meta)
+
+        if "v" not in local.meta and not local.tail:
+            local.meta["v"] = 0  # conversación nueva: la versión se conoce
+        local.pending.extend(msgs)
+        if meta:
+            local.pending_meta.update(meta)
+            local.meta.update(meta)
+        if "v" in local.meta:
+            local.meta["v"] += len(msgs)
+            version = local.meta["v"]
+        else:
+            version = len(local.tail) + len(msgs)  # legacy sin versión: aproximada
+        self._n = max(self._n, n)
+        local.tail = (local.tail + msgs)[-max(n, len(local.tail)):]
+        self._count += len(msgs)
+        self.stats["queued"] += 1
+        if self._count >= self.max_pending // 2 and self._wake is not None:
+            self._wake.set()  # volcado anticipado antes de llegar al tope
+        return local.tail[-n:], version
+
+    async def commit_many_async(
+        self, turns: List[Tuple[str, List[dict], Optional[dict]]], n: int
+    ) -> List[Tuple[List[dict], int]]:
+        return [await self.commit_turn_async(cid, msgs, n, meta) for cid, msgs, meta in turns]
+
+    async def _write_through(self, cid, msgs, n, meta):
+        self.stats["write_through"] += 1
+        window, version = await self.inner.commit_turn_async(cid, msgs, n, meta=meta)
+        self._seen.pop(cid, None)
+        return window, version
+
+    async def flush(self):
+        """Vuelca en un único commit_many_async todo lo pendiente (un commit por conversación)."""
+        batch = [(cid, local) for cid, local in self._local.items() if local.pending and not local.flushing]
+        if not batch:
+            return
+        turns = []
+        for cid, local in batch:
+            turns.append((cid, local.pending, local.pending_meta or None))
+            local.pending, local.pending_meta = [], {}
+            local.flushing = True
+        sent = sum(len(msgs) for _, msgs, _ in turns)
+        try:
+            await self.inner.commit_many_async(turns, self._n)
+        except Exception as e:
+            # se reencolan delante de lo que haya llegado mientras tanto
+            self.stats["errors"] += 1
+            print(f"[WARN] Write-behind flush failed: {e}")
+            for (cid, local), (_, msgs, meta) in zip(batch, turns):
+                local.pending = msgs + local.pending
+                local.pending_meta = {**(meta or {}), **local.pending_meta}
+                local.flushing = False
+            return
+        self._count -= sent
+        self.stats["flushes"] += 1
+        self.stats["flushed_turns"] += len(turns)
+        for cid, local in batch:
+            local.flushing = False
+            if not local.pending:
+                # ya está todo en el backend: vuelve a ser la fuente de verdad
+                del self._local[cid]
+                self._seen.pop(cid, None)
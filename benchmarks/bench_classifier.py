@@ -0,0 +1,70 @@
+"""
+Micro-benchmark del clasificador on-topic.
+
+    python -m benchmarks.bench_classifier [--n 20000] [--out report.json]
+
+Compara el clasificador anterior (split + intersección de palabras) con el
+actual (features de la claim precalculadas) y con el scoring por lotes.
+Imprime un informe JSON (benchmarks.report).
+"""
+import argparse
+import random
+import time
+
+from app.core.constants import TOPICS
+from app.services import nlp
+from benchmarks.report import emit, envelope
+
+MESSAGES = [
+    "Pepsi?", "¿por qué?", "But Pepsi is cheaper", "What is your opinion on rare medium steaks?",
+    "la coca cola tiene más azúcar", "Dogs need walks every day", "Cats are cleaner than dogs!",
+    "I read a book yesterday", "Movies are shorter than books", "Pizza with pineapple is gross",
+    "The earth looks flat from my window", "Football is boring", "Homework helps me learn",
+    "Video games improve reflexes", "Ocean exploration matters more", "Hola, ¿cómo estás?",
+]
+
+
+def legacy_is_on_topic(user_msg: str, topic: str) -> bool:
+    topic_kw = {w.lower() for w in topic.split() if len(w) > 3}
+    msg_kw = {w.lower() for w in user_msg.split() if len(w) > 3}
+    return len(topic_kw & msg_kw) >= max(1, len(topic_kw) // 6)
+
+
+def _timeit(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return (time.perf_counter() - t0) / n * 1e6  # µs por mensaje
+
+
+def run(n: int, seed: int = 7) -> dict:
+    rnd = random.Random(seed)
+    claims = list(TOPICS) + ["Coca-Cola es mejor que Pepsi"]
+    pairs = [(rnd.choice(MESSAGES), rnd.choice(claims)) for _ in range(n)]
+    feats = {c: nlp.claim_features(c) for c in claims}
+    counts = {c: nlp.term_counts(c) for c in claims}
+
+    report = {
+        "n": n,
+        "numpy": nlp._numpy() is not None,
+        "legacy_us": _timeit(lambda: [legacy_is_on_topic(m, c) for m, c in pairs], n),
+        "classifier_us": _timeit(lambda: [nlp.is_on_topic(m, c, feats[c]) for m, c in pairs], n),
+        "classifier_no_features_us": _timeit(lambda: [nlp.is_on_topic(m, c) for m, c in pairs], n),
+    }
+    claim = claims[0]
+    batch = [m for m, _ in pairs]
+    report["batch_us"] = _timeit(lambda: nlp.score_many(batch, counts[claim]), n)
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20000)
+    ap.add_argument("--out", default="", help="also write the JSON report here")
+    args = ap.parse_args()
+    results = run(args.n)
+    config = {"n": results.pop("n"), "numpy": results.pop("numpy")}
+    emit(envelope("classifier", config, results), args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Micro-benchmarks del camino de un turno (sin red ni LLM).
+
+    python -m benchmarks.bench_micro [--n 20000] [--out report.json]
+
+- parse_topic_and_stance sobre primeros mensajes típicos
+- is_on_topic con las features de la claim ya calculadas (como en /chat)
+- (de)serialización de mensajes: JSON legacy vs codec v1 de Redis
+- commit_turn + load_tail del backend en memoria
+Todos en µs por operación.
+"""
+import argparse
+import json
+import random
+import time
+
+from app.core.constants import TOPICS
+from app.services import nlp
+from app.storage import codec, memory
+from benchmarks.bench_classifier import MESSAGES
+from benchmarks.report import emit, envelope
+
+OPENERS = [f"Convince me that {t.lower()}" for t in TOPICS] + [
+    "Convénceme de que Coca-Cola es mejor que Pepsi", "La tierra es plana", "prove that cats are better than dogs",
+]
+
+
+def _us(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def run(n: int, seed: int = 7) -> dict:
+    rnd = random.Random(seed)
+    openers = [rnd.choice(OPENERS) for _ in range(n)]
+    claims = [nlp.parse_topic_and_stance(o)[1] for o in OPENERS]
+    feats = {c: nlp.claim_features(c) for c in claims}
+    pairs = [(rnd.choice(MESSAGES), rnd.choice(claims)) for _ in range(n)]
+    msgs = [{"role": rnd.choice(("user", "bot")), "message": rnd.choice(MESSAGES) * rnd.choice((1, 1, 1, 40))}
+            for _ in range(n)]
+    as_json = [json.dumps(m) for m in msgs]
+    as_v1 = [codec.encode(m) for m in msgs]
+    cids = [f"bench_{i % 500}" for i in range(n)]
+    turn = [{"role": "user", "message": "¿por qué?"}, {"role": "bot", "message": "Because it is."}]
+
+    return {
+        "parse_topic_and_stance_us": _us(lambda: [nlp.parse_topic_and_stance(o) for o in openers], n),
+        "is_on_topic_us": _us(lambda: [nlp.is_on_topic(m, c, feats[c]) for m, c in pairs], n),
+        "json_encode_us": _us(lambda: [json.dumps(m) for m in msgs], n),
+        "json_decode_us": _us(lambda: [json.loads(x) for x in as_json], n),
+        "codec_encode_us": _us(lambda: [codec.encode(m) for m in msgs], n),
+        "codec_decode_us": _us(lambda: [codec.decode(x) for x in as_v1], n),
+        "json_bytes_per_msg": sum(len(x.encode("utf-8")) for x in as_json) / n,
+        "codec_bytes_per_msg": sum(map(len, as_v1)) / n,
+        "memory_commit_turn_us": _us(lambda: [memory.commit_turn(c, turn, 5) for c in cids], n),
+        "memory_load_tail_us": _us(lambda: [memory.load_tail(c, 12) for c in cids], n),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--n", type=int, default=20000)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--out", default="", help="also write the JSON report here")
+    args = ap.parse_args()
+    config = {"n": args.n, "seed": args.seed, "numpy": nlp._numpy() is not None, "zstd": codec.zstandard is not None}
+    emit(envelope("micro", config, run(args.n, args.seed)), args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Compara dos informes JSON de benchmarks (antes / después).
+
+    python -m benchmarks.compare base.json new.json [--threshold 5]
+
+Empareja los números de "results" por ruta (p. ej. latency_ms.p99) e imprime
+la variación; marca con ! las que cambian más de --threshold %.
+"""
+import argparse
+import json
+
+
+def flatten(node, prefix: str = "") -> dict:
+    out = {}
+    if isinstance(node, dict):
+        for k, v in node.items():
+            out.update(flatten(v, f"{prefix}{k}."))
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        out[prefix[:-1]] = node
+    return out
+
+
+def compare(base: dict, new: dict) -> list:
+    a, b = flatten(base.get("results", {})), flatten(new.get("results", {}))
+    rows = []
+    for key in sorted(a.keys() & b.keys()):
+        delta = (b[key] - a[key]) / a[key] * 100 if a[key] else 0.0
+        rows.append((key, a[key], b[key], delta))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("base")
+    ap.add_argument("new")
+    ap.add_argument("--threshold", type=float, default=5.0, help="flag changes above this percentage")
+    args = ap.parse_args()
+    with open(args.base, encoding="utf-8") as fh:
+        base = json.load(fh)
+    with open(args.new, encoding="utf-8") as fh:
+        new = json.load(fh)
+    if base.get("bench") != new.get("bench"):
+        raise SystemExit(f"different benchmarks: {base.get('bench')} vs {new.get('bench')}")
+    print(f"{base.get('bench')}: {base.get('git') or '?'} -> {new.get('git') or '?'}")
+    for key, old, cur, delta in compare(base, new):
+        flag = "!" if abs(delta) > args.threshold else " "
+        print(f"{flag} {key:<40} {old:>14.3f} {cur:>14.3f} {delta:>+8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Generador de carga: debates multi-turno contra /chat a un ritmo objetivo.
+
+    python -m benchmarks.load [--backend memory|fakeredis|redis|sqlite] [--rps 50] [--duration 20]
+                              [--turns 4] [--ttft-ms 400] [--sigma 0.5] [--tokens-per-sec 80]
+                              [--out report.json]
+
+- Llegadas abiertas (Poisson): se abren debates a --rps / --turns por segundo
+  y cada uno juega --turns turnos seguidos, así que la tasa de requests es
+  ~--rps aunque el servidor se atasque (la latencia no frena la carga).
+- Por defecto la app corre en proceso (httpx + ASGI, con su lifespan) y el
+  LLM es benchmarks.mock_llm con la latencia indicada. Con --url se ataca un
+  servidor ya levantado y el modelo es el que tenga configurado.
+- Backends: memory, fakeredis (Redis en proceso; requiere `fakeredis` y
+  `lupa` para el script de commit), redis (--redis-url) o sqlite (fichero
+  temporal, o --sqlite-path). El resto de
+  ajustes (WRITE_BEHIND, L1_CACHE_SIZE, LLM_MAX_CONCURRENCY, ...) se toman
+  del entorno como en producción.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from benchmarks.report import emit, envelope, percentiles
+
+FOLLOW_UPS = [
+    "¿por qué?", "But Pepsi is cheaper", "Give me one piece of evidence", "I still disagree with you",
+    "What about the counterexamples?", "That claim sounds wrong to me", "What is your favourite movie?",
+]
+
+
+def _openers():
+    from app.core.constants import TOPICS
+    return [f"Convince me that {t.lower()}" for t in TOPICS] + ["Convénceme de que Coca-Cola es mejor que Pepsi"]
+
+
+def _prepare_backend(args):
+    """Ajusta el entorno ANTES de importar la app (los settings se leen al importar)."""
+    os.environ.pop("FIREBASE_CREDENTIALS", None)
+    os.environ.pop("SQLITE_PATH", None)
+    if args.backend in ("memory", "sqlite"):
+        os.environ.pop("REDIS_URL", None)
+        if args.backend == "sqlite":
+            os.environ["SQLITE_PATH"] = args.sqlite_path or os.path.join(tempfile.mkdtemp(), "bench.db")
+    elif args.backend == "redis":
+        os.environ["REDIS_URL"] = args.redis_url
+    else:
+        os.environ["REDIS_URL"] = "redis://fakeredis:6379/0"
+
+
+def _patch_fakeredis():
+    import fakeredis
+    from fakeredis import aioredis as fake_aioredis
+    from app.storage import redis_store
+
+    server = fakeredis.FakeServer()
+    redis_store._nodes[:] = [fakeredis.FakeRedis(server=server)]
+    redis_store._anodes[:] = [fake_aioredis.FakeRedis(server=server)]
+
+
+async def run_load(client, rps: float, duration: float, turns: int, think_ms: float = 0,
+                   timeout: float = 60, seed: int = 7) -> dict:
+    rnd = random.Random(seed)
+    openers = _openers()
+    latencies, by_turn, statuses = [], defaultdict(list), Counter()
+    loop = asyncio.get_running_loop()
+
+    async def debate():
+        cid = None
+        for t in range(turns):
+            body = {"message": rnd.choice(openers) if t == 0 else rnd.choice(FOLLOW_UPS)}
+            if cid:
+                body["conversation_id"] = cid
+            t0 = time.perf_counter()
+            try:
+                r = await client.post("/chat", json=body, timeout=timeout)
+                status = r.status_code
+                if status == 200:
+                    cid = r.json()["conversation_id"]
+            except Exception as e:
+                status = type(e).__name__
+            ms = (time.perf_counter() - t0) * 1000
+            statuses[str(status)] += 1
+            if status != 200:
+                return  # el debate se corta como lo haría un usuario
+            latencies.append(ms)
+            by_turn[t].append(ms)
+            if think_ms:
+                await asyncio.sleep(rnd.expovariate(1000 / think_ms))
+
+    tasks = []
+    started = loop.time()
+    end = started + duration
+    while loop.time() < end:
+        tasks.append(asyncio.ensure_future(debate()))
+        await asyncio.sleep(rnd.expovariate(rps / turns))
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - started
+
+    return {
+        "debates": len(tasks),
+        "requests": sum(statuses.values()),
+        "ok": len(latencies),
+        "statuses": dict(statuses),
+        "elapsed_s": elapsed,
+        "achieved_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_ms": percentiles(latencies),
+        "latency_by_turn_ms": {str(t): percentiles(v) for t, v in sorted(by_turn.items())},
+    }
+
+
+async def _main(args) -> dict:
+    import httpx
+
+    config = {k: v for k, v in vars(args).items() if k not in ("out", "redis_url", "sqlite_path")}
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, limits=httpx.Limits(max_connections=None)) as client:
+            results = await run_load(client, args.rps, args.duration, args.turns, args.think_ms, args.timeout, args.seed)
+        return envelope("load", config, results)
+
+    if args.backend == "fakeredis":
+        _patch_fakeredis()
+    from benchmarks.mock_llm import LatencyMockProvider, install
+    from app.core.metrics import layer_stats
+    from app.core.settings import settings
+    from app.main import app
+    from app.services import llm
+    from app.storage import backend
+
+    install(LatencyMockProvider(args.ttft_ms, args.sigma, args.tokens_per_sec, args.reply_tokens, args.seed),
+            keep_reply_cache=args.reply_cache)
+    config.update(write_behind=settings.write_behind, l1_cache_size=settings.l1_cache_size,
+                  llm_max_concurrency=settings.llm_max_concurrency, llm_queue_size=settings.llm_queue_size,
+                  llm_hedge=settings.llm_hedge)
+    transport = httpx.ASGITransport(app=app)
+    t0 = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        startup_ms = (time.perf_counter() - t0) * 1000
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            results = await run_load(client, args.rps, args.duration, args.turns, args.think_ms, args.timeout, args.seed)
+        store = backend.current()  # el registro lo suelta al cerrar
+    config["store"] = backend.name
+    results["startup_ms"] = startup_ms
+    results["llm"] = {k: v for k, v in llm.stats.items() if k not in ("inflight", "waiting")}
+    results["store"] = layer_stats(store)
+    return envelope("load", config, results)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--backend", choices=("memory", "fakeredis", "redis", "sqlite"), default="memory")
+    ap.add_argument("--redis-url", default="redis://localhost:6379/0")
+    ap.add_argument("--sqlite-path", default="", help="database file for --backend sqlite (default: a temp file)")
+    ap.add_argument("--url", default="", help="attack a running server instead of the in-process app")
+    ap.add_argument("--rps", type=float, default=50, help="target /chat requests per second")
+    ap.add_argument("--duration", type=float, default=20, help="seconds generating new debates")
+    ap.add_argument("--turns", type=int, default=4, help="turns per debate")
+    ap.add_argument("--think-ms", type=float, default=0, help="mean user think time between turns")
+    ap.add_argument("--timeout", type=float, default=60)
+    ap.add_argument("--ttft-ms", type=float, default=400, help="median mock time-to-first-token")
+    ap.add_argument("--sigma", type=float, default=0.5, help="lognormal spread of the mock TTFT")
+    ap.add_argument("--tokens-per-sec", type=float, default=80)
+    ap.add_argument("--reply-tokens", type=int, default=120)
+    ap.add_argument("--reply-cache", action="store_true", help="keep the reply cache on (off by default)")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--out", default="", help="also write the JSON report here")
+    args = ap.parse_args()
+    _prepare_backend(args)
+    emit(asyncio.run(_main(args)), args.out)
+
+
+if __name__ == "__main__":
+    main()
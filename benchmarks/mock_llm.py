@@ -0,0 +1,50 @@
+"""
+Modelo simulado con latencia realista para los benchmarks.
+
+Cada respuesta tarda  TTFT + tokens / token_rate:
+  - TTFT ~ lognormal con mediana `ttft_ms` y dispersión `sigma`
+    (cola larga: p99 ~ 3x la mediana con sigma=0.5)
+  - tokens ~ normal(reply_tokens, 25%), acotado a >= 1
+  - token_rate = `tokens_per_sec` constante
+y pasa por el mismo control de admisión que Gemini (run_model_coro), así que
+LLM_MAX_CONCURRENCY / LLM_QUEUE_SIZE limitan igual que en producción.
+"""
+import asyncio
+import random
+from typing import Optional
+
+from app.services import llm
+
+
+class LatencyMockProvider(llm.Provider):
+    name = "bench"
+
+    def __init__(self, ttft_ms: float = 400, sigma: float = 0.5, tokens_per_sec: float = 80,
+                 reply_tokens: int = 120, seed: Optional[int] = None):
+        super().__init__()
+        self.ttft_ms = ttft_ms
+        self.sigma = sigma
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self._rnd = random.Random(seed)
+
+    def sample_secs(self) -> float:
+        ttft = self.ttft_ms / 1000 * self._rnd.lognormvariate(0, self.sigma) if self.ttft_ms else 0.0
+        tokens = max(1, int(self._rnd.gauss(self.reply_tokens, self.reply_tokens / 4)))
+        return ttft + (tokens / self.tokens_per_sec if self.tokens_per_sec else 0.0)
+
+    async def _reply(self, secs: float, topic: str, user_message: str, style: str) -> str:
+        await asyncio.sleep(secs)
+        return llm._mock_reply(topic, user_message, style)
+
+    async def _call(self, prompt: str, **ctx) -> str:
+        return await llm.run_model_coro(
+            self._reply, self.sample_secs(), ctx.get("topic", ""), ctx.get("user_message", ""), ctx.get("style", ""))
+
+
+def install(provider: LatencyMockProvider, keep_reply_cache: bool = False):
+    """Registra el mock como proveedor principal (sin caché de respuestas salvo que se pida)."""
+    llm.register_provider("bench", provider)
+    llm.settings.llm_provider = "bench"
+    if not keep_reply_cache:
+        llm.reply_cache = None
@@ -0,0 +1,50 @@
+"""
+Formato común de los informes de benchmarks (JSON comparable entre ejecuciones).
+
+    {"bench": ..., "started_at": ..., "git": ..., "python": ..., "config": {...}, "results": {...}}
+
+Los números van en "results" con el sufijo de su unidad (_us, _ms, _rps, ...)
+para que benchmarks.compare pueda emparejarlos sin saber qué significan.
+"""
+import json
+import platform
+import subprocess
+import time
+from typing import List, Optional
+
+
+def percentiles(samples: List[float], qs=(0.5, 0.9, 0.99)) -> dict:
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+    out = {f"p{int(q * 100)}": ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in qs}
+    out["max"] = ordered[-1]
+    out["mean"] = sum(ordered) / len(ordered)
+    return out
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, timeout=5).stdout.strip()
+    except Exception:
+        return ""
+
+
+def envelope(bench: str, config: dict, results: dict) -> dict:
+    return {
+        "bench": bench,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git": _git_rev(),
+        "python": platform.python_version(),
+        "config": config,
+        "results": results,
+    }
+
+
+def emit(report: dict, out: Optional[str] = None):
+    text = json.dumps(report, indent=2, sort_keys=False)
+    if out:
+        with open(out, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    print(text)
@@ -0,0 +1,115 @@
+import asyncio
+
+from app.storage import memory
+from app.storage.cache import CachedStore
+
+
+def test_l1_cache_serves_reads_and_detects_other_writers():
+    store = CachedStore(memory, max_entries=10, ttl_secs=60)
+    cid = "l1_conv"
+    seed = [{"role": "bot", "message": "I will prove that X!"}]
+
+    async def scenario():
+        await store.commit_turn_async(cid, seed, 5, meta={"topic": "X", "stance": "X"})
+        meta = await store.load_meta_async(cid)
+        assert (meta["topic"], meta["stance"], meta["v"]) == ("X", "X", 1)
+        assert await store.load_tail_async(cid, 5) == seed
+        assert store.stats["hits"] == 2 and store.stats["misses"] == 0
+
+        # otro worker avanza la conversación sin pasar por esta caché
+        memory.append_messages(cid, [{"role": "user", "message": "otro worker"}])
+        window, version = await store.commit_turn_async(cid, [{"role": "user", "message": "yo"}], 5)
+        assert store.stats["stale"] == 1
+        assert [m["message"] for m in window][-2:] == ["otro worker", "yo"]
+        assert await store.load_tail_async(cid, 5) == window
+
+    asyncio.run(scenario())
+
+
+def test_l1_cache_checks_version_on_read():
+    store = CachedStore(memory, max_entries=10, ttl_secs=60)
+    cid = "l1_version"
+
+    async def scenario():
+        await store.commit_turn_async(cid, [{"role": "bot", "message": "seed"}], 5, meta={"topic": "X", "stance": "X"})
+        assert await store.load_tail_async(cid, 5) == [{"role": "bot", "message": "seed"}]
+
+        # otro worker avanza la conversación: la lectura no sirve la ventana cacheada
+        memory.append_messages(cid, [{"role": "user", "message": "otro worker"}])
+        meta, tail = await asyncio.gather(store.load_meta_async(cid), store.load_tail_async(cid, 5))
+        assert meta["v"] == 2 and [m["message"] for m in tail] == ["seed", "otro worker"]
+        assert store.stats["stale"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_l1_cache_never_serves_old_summary():
+    store = CachedStore(memory, max_entries=10, ttl_secs=60)
+    cid = "l1_summary"
+
+    async def scenario():
+        await store.commit_turn_async(cid, [{"role": "bot", "message": "seed"}], 5,
+                                      meta={"topic": "X", "stance": "X", "summary": "old", "summary_v": 0})
+        assert (await store.load_meta_async(cid))["summary"] == "old"
+
+        # otro worker avanza la conversación y reescribe el resumen
+        memory.commit_turn(cid, [{"role": "user", "message": "u"}, {"role": "bot", "message": "b"}], 5,
+                           meta={"summary": "new", "summary_v": 1})
+        meta, tail = await asyncio.gather(store.load_meta_async(cid), store.load_tail_async(cid, 5))
+        assert meta["summary"] == "new" and meta["summary_v"] == 1 and meta["v"] == 3
+        assert [m["message"] for m in tail] == ["seed", "u", "b"]
+        assert store.stats["stale"] == 1
+
+        # la entrada se vuelve a sembrar con la meta fresca y vuelve a acertar
+        hits = store.stats["hits"]
+        assert (await store.load_meta_async(cid))["summary"] == "new"
+        assert store.stats["hits"] == hits + 1
+
+    asyncio.run(scenario())
+
+
+def test_reply_cache_coalesces_identical_prompts_and_normalises_key():
+    from app.services.reply_cache import ReplyCache, cache_key
+
+    cache = ReplyCache(max_entries=10, ttl_secs=60)
+    calls = []
+
+    async def producer():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "Coca-Cola wins."
+
+    k1 = cache_key("Coca-Cola es mejor que Pepsi", "¿Por qué?", "Pragmatic", "m")
+    k2 = cache_key("coca-cola es  mejor que pepsi", "por qué", "Pragmatic", "m")
+    assert k1 == k2
+
+    async def scenario():
+        results = await asyncio.gather(*[cache.get_or_generate(k1, producer) for _ in range(5)])
+        assert results == ["Coca-Cola wins."] * 5
+        assert await cache.get_or_generate(k2, producer) == "Coca-Cola wins."
+
+    asyncio.run(scenario())
+    assert len(calls) == 1
+    assert cache.stats == {"hits": 1, "shared_hits": 0, "misses": 1, "coalesced": 4}
+
+
+def test_reply_cache_opens_shared_client_on_first_use():
+    from app.services.reply_cache import ReplyCache
+
+    opened, stored = [], {}
+
+    class _Shared:
+        async def get(self, key):
+            return stored.get(key)
+
+        async def set(self, key, value, ex=None):
+            stored[key] = value.encode("utf-8")
+
+    cache = ReplyCache(max_entries=10, ttl_secs=60, shared=lambda: opened.append(1) or _Shared())
+    assert not opened  # nada al construir (ni al importar la app)
+
+    async def producer():
+        return "Tea wins."
+
+    assert asyncio.run(cache.get_or_generate("k", producer)) == "Tea wins."
+    assert opened and stored == {"replycache:k": b"Tea wins."}
@@ -0,0 +1,49 @@
+from app.services.context import build_context, estimate_tokens
+from app.storage import memory
+
+
+def test_context_stays_bounded_and_summary_rolls(client):
+    r = client.post("/chat", json={"message": "Convénceme de que los perros son mejores que los gatos"})
+    cid = r.json()["conversation_id"]
+    sizes = []
+    for i in range(40):
+        client.post("/chat", json={"conversation_id": cid, "message": f"Argumento {i}: los gatos son independientes."})
+        meta = memory.load_meta(cid)
+        sizes.append(estimate_tokens(build_context(meta.get("summary", ""), memory.load_tail(cid, 12))))
+
+    meta = memory.load_meta(cid)
+    assert meta["summary_v"] > 0 and "Argumento" in meta["summary"]
+    # el resumen no guarda ni la semilla ni los recordatorios del bot
+    assert "I will prove" not in meta["summary"]
+    # el tamaño del contexto se estabiliza en vez de crecer con la conversación
+    assert max(sizes[-10:]) <= max(sizes[10:20]) + 20
+
+
+def test_build_context_respects_token_budget(monkeypatch):
+    monkeypatch.setattr("app.services.context.settings.context_token_budget", 30)
+    recent = [{"role": "user", "message": "x" * 80}, {"role": "bot", "message": "y" * 80}]
+    ctx = build_context("", recent)
+    assert estimate_tokens(ctx) <= 30
+    assert ctx.startswith("AI: y")  # se prioriza lo más reciente
+
+
+def test_summary_covers_every_message_with_four_message_turns(monkeypatch):
+    from app.services import context
+
+    folded = []
+
+    def fold(summary, msgs):
+        folded.extend(m["message"] for m in msgs)
+        return summary
+
+    monkeypatch.setattr(context, "fold_summary", fold)
+    history, meta = [], {"v": 0}
+    for turn in range(30):  # cada turno: usuario, aviso fuera de tema, usuario, réplica
+        update = context.roll_summary(meta, history[-context.tail_size():])
+        if update:
+            meta.update(update)
+        history += [{"role": "user", "message": f"m{len(history) + i}"} for i in range(4)]
+        meta["v"] = len(history)
+
+    assert meta["summary_v"] > 0
+    assert folded == [f"m{i}" for i in range(meta["summary_v"])]
@@ -0,0 +1,147 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.services import llm
+
+
+def test_llm_admission_rejects_when_saturated_and_tracks_abandoned(monkeypatch):
+    monkeypatch.setattr(llm, "_slots", asyncio.Semaphore(1))
+    monkeypatch.setattr(llm.settings, "llm_queue_size", 0)
+    monkeypatch.setattr(llm, "stats", dict.fromkeys(llm.stats, 0))
+    gate = threading.Event()
+
+    async def scenario():
+        slow = asyncio.ensure_future(llm.run_model_call(gate.wait, 5))
+        await asyncio.sleep(0.05)
+        with pytest.raises(llm.LLMOverloaded):
+            await llm.run_model_call(lambda: "never")
+
+        # el request abandona la espera, pero el hilo sigue ocupando el slot
+        slow.cancel()
+        await asyncio.sleep(0)
+        assert llm.stats["abandoned_running"] == 1 and llm._slots.locked()
+
+        gate.set()
+        await asyncio.sleep(0.05)
+        assert llm.stats["abandoned_running"] == 0 and not llm._slots.locked()
+        assert await llm.run_model_call(lambda: "ok") == "ok"
+
+    asyncio.run(scenario())
+    assert llm.stats["rejected"] == 1 and llm.stats["abandoned"] == 1
+
+
+class _ScriptedProvider(llm.Provider):
+    name = "scripted"
+
+    def __init__(self, delays):
+        super().__init__()
+        self.delays = list(delays)
+        self.cancelled = 0
+
+    async def _call(self, prompt, **ctx):
+        delay = self.delays.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return f"reply after {delay}"
+
+
+def test_hedged_request_takes_first_reply_and_cancels_loser(monkeypatch):
+    slow_then_fast = _ScriptedProvider([5, 0.01])
+    monkeypatch.setattr(llm, "providers", {"mock": llm.MockProvider(), "gemini": slow_then_fast})
+    monkeypatch.setattr(llm, "reply_cache", None)
+    monkeypatch.setattr(llm.settings, "llm_hedge_default_delay_secs", 0.05)
+
+    async def scenario():
+        deadline = asyncio.get_running_loop().time() + 10
+        return await llm.generate_gemini_response_async("X", "hola", "Pragmatic", deadline=deadline)
+
+    assert asyncio.run(scenario()) == "reply after 0.01"
+    assert slow_then_fast.cancelled == 1
+
+
+class _SlotProvider(llm.Provider):
+    """Llama al modelo bajo control de admisión, como GeminiProvider."""
+    name = "slotted"
+
+    def __init__(self, secs):
+        super().__init__()
+        self.secs = secs
+        self.calls = 0
+
+    async def _call(self, prompt, **ctx):
+        self.calls += 1
+        return await llm.run_model_coro(asyncio.sleep, self.secs, "ok")
+
+
+def test_hedge_only_uses_a_free_slot_and_latency_excludes_queue(monkeypatch):
+    monkeypatch.setattr(llm, "_slots", asyncio.Semaphore(2))
+    monkeypatch.setattr(llm, "stats", dict.fromkeys(llm.stats, 0))
+    monkeypatch.setattr(llm.settings, "llm_hedge_default_delay_secs", 0.02)
+    provider = _SlotProvider(0.1)
+
+    async def scenario():
+        until = asyncio.get_running_loop().time() + 5
+        other = asyncio.ensure_future(llm.run_model_coro(asyncio.sleep, 0.3))  # otro request con slot
+        await asyncio.sleep(0)
+        assert await llm._hedged(provider, "p", until) == "ok"
+        await other
+
+        # con la cola llena, la latencia medida es la de la llamada, no la espera
+        monkeypatch.setattr(llm, "_slots", asyncio.Semaphore(1))
+        monkeypatch.setattr(llm.settings, "llm_hedge", False)
+        busy = asyncio.ensure_future(llm.run_model_coro(asyncio.sleep, 0.3))
+        await asyncio.sleep(0)
+        waited = _SlotProvider(0.01)
+        await llm._hedged(waited, "p", until)
+        await busy
+        return waited
+
+    waited = asyncio.run(scenario())
+    assert provider.calls == 1 and llm.stats["hedged"] == 0 and llm.stats["hedge_skipped"] == 1
+    assert llm.stats["waiting"] == 0 and waited.latency.percentile(0.5) < 0.1
+
+
+def test_canned_reply_before_deadline_when_provider_hangs(monkeypatch):
+    monkeypatch.setattr(llm, "providers", {"mock": llm.MockProvider(), "gemini": _ScriptedProvider([5, 5])})
+    monkeypatch.setattr(llm, "reply_cache", None)
+    monkeypatch.setattr(llm.settings, "llm_hedge", False)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        reply = await llm.generate_gemini_response_async("X", "hola", "Pragmatic", deadline=start + 0.7)
+        return reply, loop.time() - start
+
+    reply, elapsed = asyncio.run(scenario())
+    assert reply == llm.canned_reply("X")
+    assert elapsed < 0.7
+
+
+def test_latency_mock_and_load_generator_smoke(monkeypatch):
+    import httpx
+    from app.main import app
+    from benchmarks.load import run_load
+    from benchmarks.mock_llm import LatencyMockProvider
+
+    mock = LatencyMockProvider(ttft_ms=20, sigma=0.5, tokens_per_sec=0, seed=1)
+    samples = sorted(mock.sample_secs() for _ in range(2000))
+    assert 0.015 < samples[1000] < 0.025 and samples[1980] > 1.5 * samples[1000]  # cola larga
+
+    monkeypatch.setitem(llm.providers, "bench", mock)
+    monkeypatch.setattr(llm.settings, "llm_provider", "bench")
+    monkeypatch.setattr(llm, "reply_cache", None)
+    monkeypatch.setattr(llm.settings, "llm_hedge", False)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await run_load(client, rps=40, duration=0.3, turns=2)
+
+    report = asyncio.run(scenario())
+    assert report["ok"] == report["requests"] > 0 and report["statuses"] == {"200": report["ok"]}
+    assert report["latency_ms"]["p50"] >= 15
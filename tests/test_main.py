@@ -36,15 +36,16 @@ def test_long_conversation(client):
 def test_returns_last_five_messages_in_order(client, monkeypatch):
     mem_store: dict[str, list[dict]] = {}
 
-    def _fake_load(cid: str):
-        return mem_store.get(cid, [])
+    async def _fake_tail(cid: str, n: int):
+        return list(mem_store.get(cid, []))[-n:]
 
-    def _fake_save(cid: str, msgs: list[dict]):
-        mem_store[cid] = list(msgs)
+    async def _fake_commit(cid: str, msgs: list[dict], n: int, meta=None):
+        mem_store.setdefault(cid, []).extend(msgs)
+        return list(mem_store[cid])[-n:], len(mem_store[cid])
 
-    # parcheamos load/save dentro de routes
-    monkeypatch.setattr("app.api.routes.load_conversation", _fake_load)
-    monkeypatch.setattr("app.api.routes.save_conversation", _fake_save)
+    # parcheamos load_tail/commit del backend que usan las rutas
+    monkeypatch.setattr("app.services.turns.store.load_tail_async", _fake_tail)
+    monkeypatch.setattr("app.services.turns.store.commit_turn_async", _fake_commit)
 
     cid = None
     for i in range(7):
@@ -71,3 +72,97 @@ def test_returns_last_five_messages_in_order(client, monkeypatch):
     assert resp["message"][-1]["role"] == "bot"
 
 
+
+
+def test_chat_batch_plays_turns_on_many_conversations(client):
+    first = client.post("/chat", json={"message": "Convénceme de que los libros son mejores que las películas"})
+    cid = first.json()["conversation_id"]
+
+    r = client.post("/chat/batch", json={"items": [
+        {"conversation_id": cid, "message": "Las películas son más rápidas"},
+        {"message": "Convénceme de que la pizza con piña es deliciosa"},
+        {"conversation_id": cid, "message": "duplicado"},
+    ]})
+    assert r.status_code == 200
+    results = r.json()["results"]
+    assert [x["status"] for x in results] == [200, 200, 409]
+    assert results[0]["conversation_id"] == cid
+    assert results[0]["message"][-1]["role"] == "bot"
+    assert "pizza con piña" in results[1]["message"][0]["message"]
+
+    # el turno del lote quedó persistido en la conversación original
+    r2 = client.post("/chat", json={"conversation_id": cid, "message": "¿y qué más?"})
+    assert any(m["message"] == "Las películas son más rápidas" for m in r2.json()["message"])
+
+
+def test_chat_batch_replaces_empty_llm_reply_with_canned_one(client, monkeypatch):
+    from app.api import routes
+
+    async def _reply(claim, message, style, **_):
+        return "   " if "vacía" in message else f"Sobre {claim}"
+
+    monkeypatch.setattr(routes, "generate_gemini_response_async", _reply)
+    r = client.post("/chat/batch", json={"items": [
+        {"message": "Convénceme de que el té es mejor que el café, respuesta vacía"},
+        {"message": "Convénceme de que el mar es mejor que la montaña"},
+    ]})
+    assert r.status_code == 200
+    results = r.json()["results"]
+    assert [x["status"] for x in results] == [200, 200]
+    assert "I stand by it" in results[0]["message"][-1]["message"]
+    assert results[1]["message"][-1]["message"].startswith("Sobre")
+
+
+def test_chat_batch_rejects_empty_batch(client):
+    assert client.post("/chat/batch", json={"items": []}).status_code == 422
+
+
+def test_server_timing_and_metrics_endpoint(client, monkeypatch):
+    from app.core import metrics
+    monkeypatch.setattr(metrics.settings, "metrics_enabled", True)
+
+    r = client.post("/chat", json={"message": "Convince me that dogs are better pets than cats"})
+    assert r.status_code == 200
+    timing = r.headers["Server-Timing"]
+    stages = {part.split(";")[0] for part in timing.split(", ")}
+    assert {"load_meta", "load_tail", "nlp", "llm", "commit_turn", "total"} <= stages
+
+    body = client.get("/metrics").text
+    assert 'debate_stage_seconds_bucket{stage="commit_turn"' in body
+    assert "debate_llm_rejected" in body and "debate_http_timeouts" in body
+
+
+def test_healthz_live_vs_ready(client):
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    # sin lifespan: vivo pero no listo
+    assert client.get("/healthz").status_code == 200
+    r = client.get("/healthz", params={"ready": 1})
+    assert r.status_code == 503 and r.json()["live"] is True
+
+    with TestClient(app) as started:  # lifespan: crea y calienta store, LLM, ...
+        r = started.get("/healthz", params={"ready": 1})
+        assert r.status_code == 200
+        assert r.json()["ready"] is True and all(r.json()["resources"].values())
+        assert started.post("/chat", json={"message": "Is expensive perfume worth it?"}).status_code == 200
+    assert client.get("/healthz", params={"ready": 1}).status_code == 503  # shutdown: ya no listo
+
+
+def test_llm_pool_is_closed_on_shutdown_and_recreated_on_use():
+    import asyncio
+    import pytest
+    from app.core.registry import resources
+    from app.services import llm
+
+    async def scenario():
+        assert await llm.run_model_call(lambda x: x * 2, 21) == 42
+        pool = resources.peek("llm_pool")
+        await resources.shutdown()
+        assert resources.peek("llm_pool") is None
+        with pytest.raises(RuntimeError):  # cerrado: no acepta más trabajo
+            pool.submit(int)
+        assert await llm.run_model_call(lambda x: x + 1, 1) == 2
+        assert resources.peek("llm_pool") is not pool
+
+    asyncio.run(scenario())
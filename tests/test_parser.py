@@ -4,3 +4,24 @@ def test_extract_topic_from_seed():
     seed = "I will prove that football is the best sport!"
     topic = extract_topic_from_seed(seed)
     assert topic == "football is the best sport"
+
+
+def test_on_topic_classifier_normalises_punctuation_and_accents():
+    from app.services.nlp import is_on_topic, claim_features, normalize_tokens
+
+    claim = "Coca-Cola es mejor que Pepsi"
+    feats = claim_features(claim)
+    assert is_on_topic("Pepsi?", claim, feats)
+    assert is_on_topic("la coca cola tiene más azúcar", claim, feats)
+    assert not is_on_topic("¿por qué?", claim, feats)
+    assert not is_on_topic("What is your opinion on rare medium steaks?", claim, feats)
+    assert normalize_tokens("Los Perros son geniales") == normalize_tokens("el perro es genial")
+
+
+def test_score_many_matches_single_scoring():
+    from app.services import nlp
+
+    counts = nlp.term_counts("Dogs are better pets than cats")
+    msgs = ["cats are lazy pets", "I like pizza", "dogs!!"]
+    batch = nlp.score_many(msgs, counts)
+    assert [s > nlp.ON_TOPIC_THRESHOLD for s in batch] == [True, False, True]
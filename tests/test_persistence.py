@@ -11,3 +11,500 @@ def test_conversation_persists_in_memory(client):
 
     # 3) Debe seguir defendiendo la misma claim
     assert any("Coca-Cola es mejor que Pepsi" in m["message"] for m in msgs if m["role"] == "bot")
+
+
+def test_memory_append_keeps_order_and_soft_limit(monkeypatch):
+    from app.storage import memory
+    monkeypatch.setattr(memory.settings, "history_soft_limit", 4)
+    memory.append_messages("append_test", [{"role": "bot", "message": "m0"}])
+    memory.append_messages("append_test", [{"role": "user", "message": f"m{i}"} for i in range(1, 6)])
+    msgs = memory.load_conversation("append_test")
+    assert [m["message"] for m in msgs] == ["m2", "m3", "m4", "m5"]
+
+
+def test_memory_store_evicts_lru_and_keeps_meta(monkeypatch):
+    from app.storage import memory
+    monkeypatch.setattr(memory.settings, "memory_max_conversations", 2)
+    memory._memory_store.clear()
+    memory._total_bytes = 0
+
+    memory.commit_turn("lru_a", [{"role": "bot", "message": "a"}], 5, meta={"topic": "A", "stance": "A"})
+    memory.commit_turn("lru_b", [{"role": "bot", "message": "b"}], 5)
+    memory.load_tail("lru_a", 5)  # 'a' pasa a ser la más reciente
+    memory.commit_turn("lru_c", [{"role": "bot", "message": "c"}], 5)
+
+    assert memory.load_tail("lru_b", 5) == []
+    assert memory.load_tail("lru_a", 5) == [{"role": "bot", "message": "a"}]
+    assert memory.load_meta("lru_a")["stance"] == "A"
+
+
+def test_memory_store_expires_idle_conversations(monkeypatch):
+    from app.storage import memory
+    monkeypatch.setattr(memory.settings, "memory_ttl_secs", 10)
+    memory.append_messages("ttl_conv", [{"role": "user", "message": "hola"}])
+    memory._memory_store["ttl_conv"].touched -= 11
+    assert memory.load_tail("ttl_conv", 5) == []
+    assert "ttl_conv" not in memory._memory_store
+
+
+def test_write_behind_coalesces_flushes_and_reads_own_writes():
+    import asyncio
+    from app.storage import memory
+    from app.storage.write_behind import WriteBehindStore
+
+    store = WriteBehindStore(memory, max_pending=100, interval_ms=10)
+    cid = "wb_conv"
+
+    async def turn(msgs, meta=None):
+        await store.load_meta_async(cid)
+        await store.load_tail_async(cid, 5)
+        return await store.commit_turn_async(cid, msgs, 5, meta=meta)
+
+    async def scenario():
+        window, version = await turn([{"role": "bot", "message": "seed"}, {"role": "user", "message": "u1"}],
+                                     meta={"topic": "T", "stance": "T"})
+        assert version == 2 and memory.load_tail(cid, 5) == []  # aún no volcado
+        window, version = await turn([{"role": "user", "message": "u2"}])
+        assert [m["message"] for m in window] == ["seed", "u1", "u2"] and version == 3
+        assert (await store.load_meta_async(cid))["stance"] == "T"
+
+        await store.aclose()
+        assert [m["message"] for m in memory.load_tail(cid, 5)] == ["seed", "u1", "u2"]
+        assert memory.load_meta(cid)["stance"] == "T"
+        assert store.stats["flushes"] == 1 and store.stats["flushed_turns"] == 1
+        assert cid not in store._local
+
+    asyncio.run(scenario())
+
+
+def test_codec_roundtrip_compresses_long_replies_and_reads_legacy_json():
+    import json
+    from app.storage.codec import encode, decode
+
+    short = {"role": "user", "message": "¿Por qué?"}
+    long_reply = {"role": "bot", "message": "Coca-Cola wins on taste and history. " * 40}
+    assert decode(encode(short)) == short
+    packed = encode(long_reply)
+    assert decode(packed) == long_reply
+    assert len(packed) < len(json.dumps(long_reply)) / 4
+    assert decode(json.dumps(short)) == short  # entrada legacy (str)
+    assert decode(json.dumps(short).encode()) == short  # entrada legacy (bytes)
+
+
+def test_hash_ring_moves_only_a_fraction_when_adding_a_node():
+    from app.storage.sharding import HashRing, node_label, parse_urls
+
+    urls = parse_urls("redis://:pw@r1:6379/0, redis://r2:6379/0 redis://r3")
+    assert node_label(urls[0]) == "r1:6379/0" and node_label(urls[2]) == "r3:6379/0"
+    cids = [f"conv_{i}" for i in range(4000)]
+    three = HashRing([node_label(u) for u in urls])
+    four = HashRing(three.labels + ["r4:6379/0"])
+    before = [three.node(c) for c in cids]
+    after = [four.node(c) for c in cids]
+    moved = [(b, a) for b, a in zip(before, after) if b != a]
+    # solo se mueven conversaciones al nodo nuevo, ~1/4 del total
+    assert all(a == 3 for _, a in moved)
+    assert 0.15 < len(moved) / len(cids) < 0.35
+    assert sorted(p for ps in three.group(cids).values() for p in ps) == list(range(len(cids)))
+
+
+def test_conversation_ids_are_unique_sorted_and_scannable_by_time():
+    import time
+    from app.core.ids import IdGenerator, id_timestamp, id_bounds
+
+    gen = IdGenerator(node=7)
+    ids = [gen.new_id() for _ in range(5000)]  # muchos en el mismo ms
+    assert len(set(ids)) == len(ids) and ids == sorted(ids)
+    assert all(len(i) == 31 and i.startswith("conv_") for i in ids)
+    now = time.time()
+    assert abs(id_timestamp(ids[0]) - now) < 5
+    assert id_timestamp("conv_1234") is None
+    lo, hi = id_bounds(now - 60, now + 60)
+    assert all(lo <= i < hi for i in ids)
+
+
+def test_memory_scan_ids_by_time_range():
+    import asyncio
+    import time
+    from app.core.ids import new_id
+    from app.storage import memory
+
+    cids = [new_id() for _ in range(3)]
+    for cid in cids:
+        memory.commit_turn(cid, [{"role": "user", "message": "hola"}], 5)
+    now = time.time()
+    found = asyncio.run(memory.scan_ids_async(now - 5, now + 1))
+    assert [c for c in found if c in cids] == cids
+    assert not set(cids) & set(asyncio.run(memory.scan_ids_async(now - 3600, now - 60)))
+
+
+class _FakeHot:
+    """Contrato de redis_store que usa TieredStore, sobre dicts."""
+
+    def __init__(self):
+        self.meta, self.msgs = {}, {}
+
+    async def load_meta_async(self, cid):
+        return dict(self.meta.get(cid, {"topic": "", "stance": ""}))
+
+    async def load_tail_async(self, cid, n):
+        return self.msgs.get(cid, [])[-n:]
+
+    async def load_conversation_async(self, cid):
+        return list(self.msgs.get(cid, []))
+
+    async def commit_turn_async(self, cid, msgs, n, meta=None):
+        m = self.meta.setdefault(cid, {"topic": "", "stance": ""})
+        m.update(meta or {})
+        m["v"] = m.get("v", 0) + len(msgs)
+        self.msgs.setdefault(cid, []).extend(msgs)
+        return self.msgs[cid][-n:], m["v"]
+
+    async def scan_idle_async(self, cutoff):
+        return [cid for cid, m in self.meta.items() if m["t"] < cutoff]
+
+    async def export_many_async(self, cids):
+        return [(dict(self.meta[c]), list(self.msgs[c])) for c in cids]
+
+    async def drop_many_async(self, items):
+        res = [-1 if c not in self.meta else int(self.meta[c].get("v") == v) for c, v in items]
+        for (c, _), r in zip(items, res):
+            if r == 1:
+                del self.meta[c], self.msgs[c]
+        return res
+
+    async def restore_async(self, cid, meta, msgs):
+        self.meta[cid], self.msgs[cid] = dict(meta), list(msgs)
+
+
+class _FakeCold:
+    def __init__(self):
+        self.docs = {}
+
+    async def archive_many_async(self, items):
+        self.docs.update((cid, (dict(m), list(msgs))) for cid, m, msgs in items)
+
+    async def load_archive_async(self, cid):
+        doc = self.docs.get(cid)
+        return (dict(doc[0]), list(doc[1])) if doc else None
+
+    async def delete_archive_async(self, cid):
+        self.docs.pop(cid, None)
+
+
+def test_tiered_store_archives_idle_and_rehydrates_on_next_turn():
+    import asyncio
+    from app.core.ids import new_id
+    from app.storage.tiered import TieredStore
+
+    hot, cold = _FakeHot(), _FakeCold()
+    tiered = TieredStore(hot, cold, idle_secs=3600, interval_secs=0, batch=10)
+    hello = [{"role": "user", "message": "hola"}, {"role": "bot", "message": "Pepsi no"}]
+
+    async def scenario():
+        await tiered.commit_turn_async("legacy_1", hello, 5, {"topic": "Cola", "stance": "pro"})
+        fresh = new_id()
+        await tiered.commit_turn_async(fresh, hello, 5)
+        hot.meta["legacy_1"]["t"] -= 7200  # inactiva más allá del umbral
+        assert await tiered.archive_idle() == 1
+        assert "legacy_1" not in hot.meta and "legacy_1" in cold.docs and fresh in hot.meta
+
+        # dos lecturas concurrentes comparten una sola rehidratación
+        meta, tail = await asyncio.gather(tiered.load_meta_async("legacy_1"), tiered.load_tail_async("legacy_1", 5))
+        assert meta["topic"] == "Cola" and tail == hello
+        assert tiered.stats["rehydrated"] == 1 and "legacy_1" not in cold.docs
+        # un id nuevo nunca consulta el archivo
+        assert await tiered.load_tail_async(new_id(), 5) == [] and tiered.stats["cold_misses"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_tiered_store_deletes_archive_superseded_during_the_sweep():
+    import asyncio
+    from app.storage.tiered import TieredStore
+
+    hot, cold = _FakeHot(), _FakeCold()
+    tiered = TieredStore(hot, cold, idle_secs=3600, interval_secs=0, batch=10)
+    turn = [{"role": "user", "message": "hola"}, {"role": "bot", "message": "no"}]
+    export = hot.export_many_async
+
+    async def export_then_new_turn(cids):
+        out = await export(cids)
+        await hot.commit_turn_async("legacy_2", turn, 5)  # llega entre la copia y el borrado
+        return out
+
+    hot.export_many_async = export_then_new_turn
+
+    async def scenario():
+        await tiered.commit_turn_async("legacy_2", turn, 5, {"topic": "T", "stance": "pro"})
+        hot.meta["legacy_2"]["t"] -= 7200
+        assert await tiered.archive_idle() == 0
+        assert hot.meta["legacy_2"]["v"] == 4 and "legacy_2" not in cold.docs
+        assert tiered.stats["superseded"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_store_group_commits_and_is_shared_across_processes(tmp_path, monkeypatch):
+    import asyncio, multiprocessing, time
+    from app.storage import sqlite_store as sq
+    monkeypatch.setattr(sq.settings, "sqlite_path", str(tmp_path / "conv.db"))
+    monkeypatch.setattr(sq.settings, "history_soft_limit", 50)
+    cid = "sqlite_conv"
+
+    async def scenario():
+        window, v = await sq.commit_turn_async(cid, [{"role": "bot", "message": "seed"}], 5,
+                                               meta={"topic": "T", "stance": "T"})
+        assert v == 1 and window == [{"role": "bot", "message": "seed"}]
+        # commits concurrentes: se agrupan en menos transacciones y las versiones no se pisan
+        res = await asyncio.gather(*(sq.commit_turn_async(cid, [{"role": "user", "message": f"u{i}"}], 2)
+                                     for i in range(20)))
+        assert sorted(v for _, v in res) == list(range(2, 22))
+        assert sq.stats()["batches"] < 21
+        meta, tail = (await sq.load_many_async([cid], 2))[0]
+        assert meta["stance"] == "T" and meta["v"] == 21 and [m["message"] for m in tail] == ["u18", "u19"]
+        await sq.aclose()
+
+    asyncio.run(scenario())
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return
+
+    def worker(k):
+        for i in range(30):
+            sq.commit_turn(cid, [{"role": "user", "message": f"{k}-{i}"}], 1)
+
+    procs = [multiprocessing.get_context("fork").Process(target=worker, args=(k,)) for k in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert [p.exitcode for p in procs] == [0, 0, 0]
+    assert sq.load_meta(cid)["v"] == 21 + 90
+    assert len(sq.load_conversation(cid)) == 50  # HISTORY_SOFT_LIMIT
+
+    monkeypatch.setattr(sq.settings, "sqlite_ttl_secs", 60)
+    assert sq.vacuum(time.time() + 61) == 1
+    assert sq.load_tail(cid, 5) == [] and sq.load_meta(cid) == {"topic": "", "stance": ""}
+    asyncio.run(sq.aclose())
+
+
+class _FakeIncrement:
+    def __init__(self, n):
+        self.n = n
+
+
+class _FakeSnap:
+    def __init__(self, ref, data):
+        self.reference, self.id, self.exists = ref, ref.id, data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class _FakeDoc:
+    def __init__(self, db, path):
+        self.db, self.path, self.id = db, path, path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return _FakeQuery(self.db, f"{self.path}/{name}")
+
+    def _apply(self, data, merge):
+        cur = dict(self.db.docs.get(self.path, {})) if merge else {}
+        for k, v in data.items():
+            cur[k] = cur.get(k, 0) + v.n if isinstance(v, _FakeIncrement) else v
+        self.db.docs[self.path] = cur
+
+    async def get(self):
+        return _FakeSnap(self, self.db.docs.get(self.path))
+
+
+class _FakeQuery:
+    def __init__(self, db, path, order=None, first=None, last=None):
+        self.db, self.path, self.order, self.first, self.last = db, path, order, first, last
+
+    def document(self, doc_id=None):
+        self.db.auto += 1
+        return _FakeDoc(self.db, f"{self.path}/{doc_id or f'auto{self.db.auto}'}")
+
+    def order_by(self, field):
+        return _FakeQuery(self.db, self.path, field)
+
+    def limit(self, k):
+        return _FakeQuery(self.db, self.path, self.order, first=k)
+
+    def limit_to_last(self, k):
+        return _FakeQuery(self.db, self.path, self.order, last=k)
+
+    async def get(self):
+        prefix = self.path + "/"
+        docs = [(p, d) for p, d in self.db.docs.items() if p.startswith(prefix) and "/" not in p[len(prefix):]]
+        docs.sort(key=lambda pd: pd[1][self.order])
+        docs = docs[:self.first] if self.first is not None else docs
+        docs = docs[-self.last:] if self.last else docs
+        return [_FakeSnap(_FakeDoc(self.db, p), d) for p, d in docs]
+
+    async def stream(self):
+        for snap in await self.get():
+            yield snap
+
+
+class _FakeBatch:
+    def __init__(self, db):
+        self.db, self.ops = db, []
+
+    def set(self, ref, data, merge=False):
+        self.ops.append(lambda: ref._apply(data, merge))
+
+    def delete(self, ref):
+        self.ops.append(lambda: self.db.docs.pop(ref.path, None))
+
+    async def commit(self):
+        for op in self.ops:
+            op()
+
+
+class _FakeAsyncFirestore:
+    def __init__(self):
+        self.docs, self.auto = {}, 0
+
+    def collection(self, name):
+        return _FakeQuery(self, name)
+
+    def batch(self):
+        return _FakeBatch(self)
+
+
+def test_firestore_trims_message_subcollection_to_soft_limit(monkeypatch):
+    import asyncio, types
+    from app.core import deps
+    from app.storage import firestore
+
+    adb = _FakeAsyncFirestore()
+    sdk = types.SimpleNamespace(Increment=_FakeIncrement)
+    monkeypatch.setattr(deps, "firebase", lambda: (None, adb, sdk))
+    monkeypatch.setattr(firestore.settings, "history_soft_limit", 5)
+
+    async def scenario():
+        for i in range(4):
+            window, v = await firestore.commit_turn_async(
+                "fs_conv", [{"role": "user", "message": f"u{i}"}, {"role": "bot", "message": f"b{i}"}], 3)
+        assert v == 8 and [m["message"] for m in window] == ["b2", "u3", "b3"]
+        stored = await firestore.load_conversation_async("fs_conv")
+        assert [m["message"] for m in stored] == ["b1", "u2", "b2", "u3", "b3"]
+        assert "trimmed" not in await firestore.load_meta_async("fs_conv")
+
+    asyncio.run(scenario())
+    assert sum(p.startswith("conversations/fs_conv/messages/") for p in adb.docs) == 5
+
+
+def _fake_redis_store(monkeypatch):
+    """redis_store sobre fakeredis (un nodo, sin servidor)."""
+    import importlib
+    import fakeredis
+    from app.core.settings import settings
+
+    monkeypatch.setattr(settings, "redis_url", "redis://localhost:6379/0")
+    rs = importlib.import_module("app.storage.redis_store")
+    server = fakeredis.FakeServer()
+    sync, aio = fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server)
+    monkeypatch.setattr(rs, "_nodes", [sync])
+    monkeypatch.setattr(rs, "_anodes", [aio])
+    return rs, sync
+
+
+def test_redis_store_adopts_untagged_keys_without_losing_new_turns(monkeypatch):
+    import asyncio, json
+    rs, r = _fake_redis_store(monkeypatch)
+    # conversación escrita antes del hash tag: JSON legacy, meta con versión
+    r.rpush("conv:old1:messages", *[json.dumps({"role": "user", "message": f"m{i}"}) for i in range(3)])
+    r.hset("conv:old1:meta", mapping={"topic": "t", "stance": "pro", "v": 3})
+    r.rpush("conv:old2:messages", json.dumps({"role": "user", "message": "a"}))
+    r.hset("conv:old2:meta", mapping={"topic": "t2", "stance": "con", "v": 1})
+
+    async def scenario():
+        meta, tail = await asyncio.gather(rs.load_meta_async("old1"), rs.load_tail_async("old1", 10))
+        assert meta["v"] == 3 and meta["stance"] == "pro"
+        assert [m["message"] for m in tail] == ["m0", "m1", "m2"]
+        # commit sin lectura previa: el historial legacy se antepone
+        window, v = await rs.commit_turn_async("old2", [{"role": "bot", "message": "b"}], 5, {"stance": "con"})
+        assert v == 2 and [m["message"] for m in window] == ["a", "b"]
+
+    asyncio.run(scenario())
+    assert not r.exists("conv:old1:messages", "conv:old1:meta", "conv:old2:messages", "conv:old2:meta")
+
+    # la migración tampoco pisa turnos escritos ya en las claves nuevas
+    r.rpush("conv:old3:messages", json.dumps({"role": "user", "message": "x"}))
+    r.hset("conv:old3:meta", mapping={"topic": "t3", "v": 1})
+    r.rpush("conv:{old3}:messages", json.dumps({"role": "user", "message": "y"}))
+    r.hset("conv:{old3}:meta", mapping={"topic": "new", "v": 1})
+    assert rs.adopt_legacy("old3")
+    assert [json.loads(x)["message"] for x in r.lrange("conv:{old3}:messages", 0, -1)] == ["x", "y"]
+    assert r.hget("conv:{old3}:meta", "topic") == b"new" and r.hget("conv:{old3}:meta", "v") == b"2"
+
+
+def test_redis_store_skips_legacy_lookup_when_disabled(monkeypatch):
+    import asyncio, json
+    rs, r = _fake_redis_store(monkeypatch)
+    monkeypatch.setattr(rs.settings, "redis_adopt_legacy", False)
+    r.rpush("conv:old4:messages", json.dumps({"role": "user", "message": "x"}))
+
+    assert asyncio.run(rs.load_tail_async("old4", 5)) == []
+    assert r.exists("conv:old4:messages") and not r.exists("conv:{old4}:messages")
+
+
+def test_redis_scan_ids_by_time_range(monkeypatch):
+    import asyncio, time
+    from app.core.ids import new_id
+    rs, r = _fake_redis_store(monkeypatch)
+
+    async def scenario():
+        cids = [new_id() for _ in range(3)]
+        for cid in cids:
+            await rs.commit_turn_async(cid, [{"role": "user", "message": "hola"}], 1)
+        r.hset("conv:{legacy}:meta", "v", 1)  # ids sin fecha: fuera de cualquier rango
+        now = time.time()
+        assert await rs.scan_ids_async(now - 5, now + 1) == sorted(cids)
+        assert await rs.scan_ids_async(now - 3600, now - 60) == []
+
+    asyncio.run(scenario())
+
+
+def test_redis_scan_idle_stamps_only_live_metas_and_keeps_ttl(monkeypatch):
+    import asyncio, time
+    rs, r = _fake_redis_store(monkeypatch)
+    r.hset("conv:{old}:meta", mapping={"topic": "t", "v": 2})  # de antes del tiering
+    r.expire("conv:{old}:meta", 600)
+    r.hset("conv:{idle}:meta", mapping={"topic": "t", "v": 2, "t": int(time.time()) - 3600})
+
+    class _ExpiresOnStamp:
+        """El cliente real, pero la meta 'gone' expira justo antes de marcarla."""
+
+        def __init__(self, inner):
+            self.inner = inner
+
+        def __getattr__(self, name):
+            return getattr(self.inner, name)
+
+        def pipeline(self, *a, **kw):
+            r.delete("conv:{gone}:meta")
+            return self.inner.pipeline(*a, **kw)
+
+    r.hset("conv:{gone}:meta", mapping={"topic": "t", "v": 1})
+    monkeypatch.setattr(rs, "_anodes", [_ExpiresOnStamp(rs._anodes[0])])
+    assert asyncio.run(rs.scan_idle_async(time.time() - 60)) == ["idle"]
+    assert r.hget("conv:{old}:meta", "t") is not None and 0 < r.ttl("conv:{old}:meta") <= 600
+    assert not r.exists("conv:{gone}:meta")
+
+
+def test_redis_drop_reports_superseded_and_gone(monkeypatch):
+    import asyncio
+    rs, r = _fake_redis_store(monkeypatch)
+    for cid, v in (("a", 2), ("b", 4)):
+        r.rpush(f"conv:{{{cid}}}:messages", b"x")
+        r.hset(f"conv:{{{cid}}}:meta", "v", v)
+
+    res = asyncio.run(rs.drop_many_async([("a", 2), ("b", 2), ("c", 1)]))
+    assert res == [rs.DROPPED, rs.SUPERSEDED, rs.GONE]
+    assert not r.exists("conv:{a}:meta") and r.exists("conv:{b}:meta")
@@ -0,0 +1,182 @@
+import json
+
+
+def _events(body: str):
+    out = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        out.append((lines["event"], json.loads(lines["data"])))
+    return out
+
+
+def test_chat_stream_sends_chunks_and_persists_reply(client):
+    r = client.post("/chat/stream", json={"message": "Convénceme de que la pizza es mejor que el sushi"})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+    cid = r.headers["X-Conversation-Id"]
+
+    events = _events(r.text)
+    kinds = [e for e, _ in events]
+    assert kinds[0] == "start" and kinds[-1] == "done"
+    assert kinds.count("chunk") > 1
+
+    reply = "".join(d["text"] for e, d in events if e == "chunk").strip()
+    done = events[-1][1]
+    assert done["conversation_id"] == cid
+    assert done["message"][-1] == {"role": "bot", "message": reply}
+
+    # el siguiente turno ve la respuesta persistida
+    r2 = client.post("/chat", json={"conversation_id": cid, "message": "¿y el precio?"})
+    assert any(m["message"] == reply for m in r2.json()["message"])
+
+
+def test_websocket_session_streams_and_persists_turns(client):
+    from app.storage import memory
+
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"message": "Convénceme de que el café es mejor que el té"})
+        start = ws.receive_json()
+        assert start["event"] == "start"
+        cid = start["conversation_id"]
+        events = [ws.receive_json()]
+        while events[-1]["event"] != "done":
+            events.append(ws.receive_json())
+        assert any(e["event"] == "chunk" for e in events)
+
+        ws.send_text("El café tiene más cafeína")
+        while (msg := ws.receive_json())["event"] != "done":
+            pass
+        assert msg["message"][-2]["message"] == "El café tiene más cafeína"
+
+        ws.send_json({"message": ""})
+        assert ws.receive_json()["status"] == 422
+
+    # al cerrar la sesión, los turnos ya están persistidos (solo appends)
+    stored = memory.load_conversation(cid)
+    assert stored[0]["message"] == "I will prove that el café es mejor que el té!"
+    assert stored[-1] == msg["message"][-1]
+    assert memory.load_meta(cid)["stance"] == "el café es mejor que el té"
+
+
+def test_chat_stream_releases_llm_slot_when_client_leaves_after_start(monkeypatch):
+    import asyncio
+    from app.api import routes
+    from app.models.schemas import MessageRequest
+    from app.services.llm import ReplyStream
+
+    released = []
+
+    async def chunks():
+        yield "never sent"
+
+    async def fake_stream(*args, **kwargs):
+        return ReplyStream(chunks(), lambda: released.append(1))
+
+    monkeypatch.setattr(routes, "stream_gemini_response_async", fake_stream)
+
+    async def scenario():
+        resp = await routes.chat_stream(MessageRequest(message="Convénceme de que el mar es azul"))
+        body = resp.body_iterator
+        assert (await body.__anext__()).startswith("event: start")
+        await body.aclose()  # desconexión justo después de `start`
+
+    asyncio.run(scenario())
+    assert released == [1]
+
+
+def test_websocket_session_surfaces_failed_writes(client, monkeypatch):
+    import time
+    from app.services import turns
+
+    calls = []
+
+    async def broken_commit(*args, **kwargs):
+        calls.append(1)
+        raise ConnectionError("store down")
+
+    monkeypatch.setattr(turns, "_WRITE_BACKOFF_SECS", 0)
+    monkeypatch.setattr("app.services.turns.store.commit_turn_async", broken_commit)
+    failures = turns.session_stats["write_failures"]
+
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"message": "Convénceme de que el invierno es mejor que el verano"})
+        while ws.receive_json()["event"] != "done":
+            pass
+        for _ in range(50):  # el write-behind agota los reintentos en segundo plano
+            if turns.session_stats["write_failures"] > failures:
+                break
+            time.sleep(0.01)
+        ws.send_json({"message": "¿por qué?"})
+        err = ws.receive_json()
+        assert err["event"] == "error" and err["status"] == 500
+
+    assert len(calls) == turns._WRITE_ATTEMPTS
+    assert turns.session_stats["write_failures"] == failures + 1
+
+
+def test_empty_streamed_reply_is_saved_as_canned_and_batch_still_works(client, monkeypatch):
+    from app.api import routes
+    from app.services.llm import ReplyStream
+
+    async def blank():
+        yield "  "
+
+    async def fake_stream(*args, **kwargs):
+        return ReplyStream(blank(), lambda: None)
+
+    monkeypatch.setattr(routes, "stream_gemini_response_async", fake_stream)
+    r = client.post("/chat/stream", json={"message": "Convénceme de que el otoño es la mejor estación"})
+    cid = r.headers["X-Conversation-Id"]
+    done = _events(r.text)[-1]
+    assert done[0] == "done" and "I stand by it" in done[1]["message"][-1]["message"]
+
+    r2 = client.post("/chat/batch", json={"items": [{"conversation_id": cid, "message": "¿y la lluvia?"}]})
+    assert r2.status_code == 200 and r2.json()["results"][0]["status"] == 200
+
+
+def test_chat_stream_reports_provider_errors(client, monkeypatch):
+    from app.api import routes
+    from app.core import metrics
+    from app.services.llm import ReplyStream
+
+    released = []
+
+    async def blocked():
+        yield "Primera parte"
+        raise ValueError("response.text: candidate was blocked")
+
+    async def fake_stream(*args, **kwargs):
+        return ReplyStream(blocked(), lambda: released.append(1))
+
+    monkeypatch.setattr(routes, "stream_gemini_response_async", fake_stream)
+    errors = metrics.http["stream_errors"]
+    r = client.post("/chat/stream", json={"message": "Convénceme de que la radio es mejor que la tele"})
+    kinds = [e for e, _ in _events(r.text)]
+    assert kinds == ["start", "chunk", "error"] and _events(r.text)[-1][1]["status"] == 502
+    assert metrics.http["stream_errors"] == errors + 1 and released == [1]
+
+
+def test_websocket_reports_provider_errors_and_keeps_session(client, monkeypatch):
+    from app.api import routes
+    from app.services.llm import ReplyStream
+
+    async def blocked():
+        raise ValueError("response.text: candidate was blocked")
+        yield  # generador async
+
+    real = routes.stream_gemini_response_async
+    calls = []
+
+    async def flaky_stream(*args, **kwargs):
+        calls.append(1)
+        return ReplyStream(blocked(), lambda: None) if len(calls) == 1 else await real(*args, **kwargs)
+
+    monkeypatch.setattr(routes, "stream_gemini_response_async", flaky_stream)
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"message": "Convénceme de que el tren es mejor que el avión"})
+        assert ws.receive_json()["event"] == "start"
+        err = ws.receive_json()
+        assert err["event"] == "error" and err["status"] == 500
+        ws.send_json({"message": "¿y la puntualidad?"})  # la sesión sigue viva
+        while (msg := ws.receive_json())["event"] != "done":
+            assert msg["event"] != "error"